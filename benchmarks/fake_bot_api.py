@@ -0,0 +1,178 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from telegram.request import BaseRequest
+
+
+# A local stand-in for the Telegram Bot API, for benchmarks that run the bot's
+# real sending code. It enforces Telegram's rate limits itself and answers 429
+# (Too Many Requests) when they are exceeded. StubRequest answers the same
+# calls inside the bot's own process, without HTTP or limits.
+
+_BOT_USER = {
+    "id": 123456,
+    "is_bot": True,
+    "first_name": "shuteye",
+    "username": "shuteye_bot",
+}
+
+
+def _message(message_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text,
+    }
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    """Answers getMe and sendMessage like the Bot API, counting what it receives."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        rate: float = float("inf"),
+        chat_rate: float = float("inf"),
+        latency: float = 0,
+        record: bool = False,
+    ):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.accepted = deque()  # monotonic times of the last second's messages
+        self.last_sent = {}  # chat id -> monotonic time of its last message
+        self.sent = 0
+        self.rejected = 0
+        self.per_chat = defaultdict(int)
+        # chat id -> texts sent to it, in order (with record)
+        self.texts = defaultdict(list) if record else None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/bot"
+
+    def send(self, chat_id: int, text: str = "") -> float:
+        """Record a message; return how long the sender must wait instead (0: accepted)."""
+        now = time.monotonic()
+        with self.lock:
+            while self.accepted and now - self.accepted[0] >= 1:
+                self.accepted.popleft()
+            # 5% slack for clock granularity between client and server
+            if len(self.accepted) >= self.rate * 1.05:
+                self.rejected += 1
+                return 1 - (now - self.accepted[0])
+            last = self.last_sent.get(chat_id)
+            if last is not None and now - last < 0.95 / self.chat_rate:
+                self.rejected += 1
+                return 1 / self.chat_rate - (now - last)
+            self.accepted.append(now)
+            self.last_sent[chat_id] = now
+            self.sent += 1
+            self.per_chat[chat_id] += 1
+            if self.texts is not None:
+                self.texts[chat_id].append(text)
+            return 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if method == "getMe":
+            self._reply({"ok": True, "result": _BOT_USER})
+        elif method == "sendMessage":
+            params = _params(body, self.headers.get("Content-Type", ""))
+            chat_id = int(params["chat_id"])
+            retry_after = self.server.send(chat_id, params.get("text", ""))
+            if retry_after > 0:
+                self._reply(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": "Too Many Requests",
+                        "parameters": {"retry_after": max(1, round(retry_after))},
+                    },
+                    429,
+                )
+                return
+            self._reply(
+                {
+                    "ok": True,
+                    "result": _message(
+                        self.server.sent, chat_id, params.get("text", "")
+                    ),
+                }
+            )
+        else:
+            self._reply(
+                {"ok": False, "error_code": 404, "description": "Not Found"}, 404
+            )
+
+    def _reply(self, payload: dict, status: int = 200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _params(body: bytes, content_type: str) -> dict:
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+
+class StubRequest(BaseRequest):
+    """
+    The bot's Bot API connection, answered in-process: getMe and sendMessage
+    succeed after latency seconds (without blocking the event loop), and the
+    texts sent are kept per chat.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.sent = 0
+        self.texts = defaultdict(list)  # chat id -> texts sent to it, in order
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, **timeouts):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == "getMe":
+            result = _BOT_USER
+        elif endpoint == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.sent += 1
+            self.texts[chat_id].append(params.get("text", ""))
+            result = _message(self.sent, chat_id, params.get("text", ""))
+        else:
+            payload = {"ok": False, "error_code": 404, "description": "Not Found"}
+            return 404, json.dumps(payload).encode()
+        return 200, json.dumps({"ok": True, "result": result}).encode()
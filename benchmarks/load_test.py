@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date
+
+# The bot config reads these at import time; the load test never talks to Telegram
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:load-test")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "1")
+
+import numpy as np  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+from benchmarks.fake_bot_api import StubRequest  # noqa: E402
+from benchmarks.synthetic import synthetic_log_chunks  # noqa: E402
+from src.common.config import (  # noqa: E402
+    EARLIEST_BEDTIME,
+    INIT_WINDOW,
+    UPDATE_WINDOW,
+)
+from src.common.models import SleepPlan  # noqa: E402
+from src.data_manager import storage  # noqa: E402
+from src.messaging import bot  # noqa: E402
+from src.messaging.messages import Messages  # noqa: E402
+from src.messaging.persistence import SqlitePersistence  # noqa: E402
+
+
+# Load test: thousands of synthetic chats hold /log conversations at once
+# through the real Application from bot.build_application (ConversationHandler,
+# ChatOrderedProcessor, persistence, log writer, plan cache and compute pool),
+# on a fresh SQLite store. Updates go into the Application's update queue as
+# they would from polling, and replies are answered in-process by StubRequest,
+# so the numbers are the bot's own cost. A handler in a later group marks each
+# update done once the conversation step (replies included) has finished.
+#
+# Each chat follows one profile, seeded so that its conversation takes a
+# given branch:
+#   entry       logs a night; not enough nights for a plan yet
+#   first_plan  logs its INIT_WINDOW-th night and gets its first plan
+#   new_plan    logs the night that triggers a plan update (clipped)
+#   bedtime     answers the earliest-bedtime question of a conversation
+#               restored from persistence (conservative plan update); no step
+#               of bot.py leads to EARLIEST_BEDTIME, so it is only reachable
+#               this way
+# Chats arrive following a pattern (see arrivals) and answer each question as
+# soon as the previous reply is in, or after an exponential think time.
+
+NIGHT = [
+    ("/log", "/log"),
+    ("BEDTIME", "23:30"),
+    ("WAKEUP", "06:45"),
+    ("ONSET", "15"),
+    ("AWAKE", "20"),
+]
+SCRIPTS = {
+    "entry": NIGHT,
+    "first_plan": NIGHT + [("EARLIEST_WAKE", "06:30")],
+    "new_plan": NIGHT + [("EARLIEST_WAKE", "06:30")],
+    "bedtime": [("EARLIEST_BEDTIME", "23:00")],
+}
+# The last reply each profile should end with
+EXPECTED = {
+    "entry": Messages.thats_it,
+    "first_plan": Messages.first_sleep_plan.split("{")[0],
+    "new_plan": Messages.new_sleep_plan.split("{")[0],
+    "bedtime": Messages.new_sleep_plan.split("{")[0],
+}
+STATES = ["/log", "BEDTIME", "WAKEUP", "ONSET", "AWAKE"]
+STATES += ["EARLIEST_WAKE", "EARLIEST_BEDTIME"]
+DEFAULT_MIX = "entry=0.6,first_plan=0.15,new_plan=0.15,bedtime=0.1"
+PATTERNS = ("burst", "morning", "uniform", "poisson")
+
+
+def arrivals(pattern: str, n: int, duration: float, rng: random.Random) -> list:
+    """
+    Start times (seconds) of n conversations:
+      burst    all at once
+      morning  a peak a third of the way into duration, as when most
+               users wake up around the same time, thinning out after
+      uniform  evenly spread over duration
+      poisson  random with a constant rate of n / duration
+    """
+    if pattern == "burst" or duration <= 0:
+        return [0.0] * n
+    if pattern == "morning":
+        return sorted(
+            min(max(rng.gauss(duration / 3, duration / 8), 0), duration)
+            for _ in range(n)
+        )
+    if pattern == "uniform":
+        return [i * duration / n for i in range(n)]
+    starts, t = [], 0.0
+    for _ in range(n):
+        starts.append(t)
+        t += rng.expovariate(n / duration)
+    return starts
+
+
+def assign_profiles(chats: int, mix: dict, rng: random.Random) -> dict:
+    """chat id → profile, in the proportions of mix."""
+    total = sum(mix.values())
+    profiles = []
+    for profile, share in mix.items():
+        profiles += [profile] * round(chats * share / total)
+    profiles = (profiles + [next(iter(mix))] * chats)[:chats]
+    rng.shuffle(profiles)
+    return {chat_id: p for chat_id, p in enumerate(profiles, start=1)}
+
+
+def _nights(profile: str, rng: random.Random) -> int:
+    """Nights already logged, so that the next /log takes the profile's branch."""
+    if profile == "entry":
+        return rng.randrange(INIT_WINDOW - 1)
+    if profile == "first_plan":
+        return INIT_WINDOW - 1
+    if profile == "new_plan":
+        return INIT_WINDOW + UPDATE_WINDOW - 1
+    return INIT_WINDOW + UPDATE_WINDOW
+
+
+def seed_store(store, profiles: dict, rng: random.Random):
+    """Log each chat's past nights (ending yesterday) and its plan, if it has one."""
+    nights = {chat_id: _nights(p, rng) for chat_id, p in profiles.items()}
+    total = sum(nights.values())
+    rows = next(synthetic_log_chunks(total, chunk_size=max(total, 1)))
+    chat_ids = np.repeat(list(nights), list(nights.values()))
+    # Each chat's nights are consecutive days up to yesterday
+    back = np.concatenate([np.arange(n, 0, -1) for n in nights.values()] or [[]])
+    today = np.datetime64(date.today(), "D")
+    rows["date"] = (today - back.astype("timedelta64[D]")).astype(str)
+    rows.insert(0, "chat_id", chat_ids)
+    store.import_rows(rows)
+    store.finish_import(sorted(set(chat_ids.tolist())))
+    for chat_id, profile in profiles.items():
+        if profile in ("new_plan", "bedtime"):
+            store.save_plan(chat_id, SleepPlan.from_minutes(420, 23 * 60, 6 * 60))
+
+
+async def seed_conversations(path: str, profiles: dict):
+    """Put the bedtime chats' conversations in EARLIEST_BEDTIME, as after a restart."""
+    persistence = SqlitePersistence(path)
+    await asyncio.gather(
+        *(
+            persistence.update_conversation("log", (c, c), EARLIEST_BEDTIME)
+            for c, profile in profiles.items()
+            if profile == "bedtime"
+        )
+    )
+    await persistence.flush()
+
+
+def _update(update_id: int, chat_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "load"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+class LoadTest:
+    """Drives chats' scripts through an Application and times every step."""
+
+    def __init__(self, app, think: float, rng: random.Random):
+        self.app = app
+        self.think = think
+        self.rng = rng
+        self.latencies = defaultdict(list)  # state -> seconds per update
+        self.finished = Counter()  # profile -> conversations done
+        self._next_update = 1
+        self._waiting = {}  # update id -> future set when it's handled
+        app.add_handler(TypeHandler(Update, self._done), group=1)
+
+    async def _done(self, update: Update, context):
+        waiter = self._waiting.pop(update.update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def send(self, chat_id: int, text: str) -> float:
+        """Queue one update and wait until it's handled; returns the latency."""
+        update_id, self._next_update = self._next_update, self._next_update + 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting[update_id] = waiter
+        update = Update.de_json(_update(update_id, chat_id, text), self.app.bot)
+        start = time.perf_counter()
+        await self.app.update_queue.put(update)
+        return await waiter - start
+
+    async def chat(self, chat_id: int, profile: str, start_at: float, t0: float):
+        await asyncio.sleep(max(0.0, t0 + start_at - time.perf_counter()))
+        for state, text in SCRIPTS[profile]:
+            self.latencies[state].append(await self.send(chat_id, text))
+            if self.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.think))
+        self.finished[profile] += 1
+
+
+def _percentiles(values: list) -> dict:
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1e3, [50, 95, 99])
+    return {"n": len(values), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+async def run_load(args, tmp: str) -> dict:
+    rng = random.Random(args.seed)
+    mix = {k: float(v) for k, v in (p.split("=") for p in args.mix.split(","))}
+    profiles = assign_profiles(args.chats, mix, rng)
+
+    store = storage.SqliteStore(os.path.join(tmp, "shuteye.db"))
+    storage.set_store(store)
+    persistence_path = os.path.join(tmp, "conversations.db")
+    start = time.perf_counter()
+    seed_store(store, profiles, rng)
+    await seed_conversations(persistence_path, profiles)
+    seeding = time.perf_counter() - start
+
+    request = StubRequest(args.latency)
+    app = bot.build_application(
+        persistence_path=persistence_path, send_reminders=False, request=request
+    )
+    load = LoadTest(app, args.think, rng)
+    starts = arrivals(args.arrival, args.chats, args.duration, rng)
+    async with app:
+        await bot.on_startup(app)
+        await app.start()
+        # The compute pool starts in the background (warm_up); wait for it, so
+        # the first plans don't time its startup
+        await asyncio.sleep(args.warmup)
+        t0 = time.perf_counter()
+        await asyncio.gather(
+            *(
+                load.chat(chat_id, profile, start_at, t0)
+                for (chat_id, profile), start_at in zip(profiles.items(), starts)
+            )
+        )
+        elapsed = time.perf_counter() - t0
+        await app.stop()
+    await bot.on_shutdown(app)
+    storage.set_store(None)
+
+    unexpected = sum(
+        not (request.texts[c] and request.texts[c][-1].startswith(EXPECTED[p]))
+        for c, p in profiles.items()
+    )
+    updates = sum(len(v) for v in load.latencies.values())
+    return {
+        "chats": args.chats,
+        "arrival": args.arrival,
+        "duration_s": args.duration,
+        "think_s": args.think,
+        "profiles": dict(Counter(profiles.values())),
+        "seeding_s": seeding,
+        "seconds": elapsed,
+        "updates": updates,
+        "updates_per_s": updates / elapsed,
+        "conversations_per_s": sum(load.finished.values()) / elapsed,
+        "replies": request.sent,
+        "unexpected_endings": unexpected,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        / 1024,
+        "states": {
+            state: _percentiles(load.latencies[state])
+            for state in STATES
+            if load.latencies[state]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test /log conversations through the bot's real handlers."
+    )
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument(
+        "--arrival",
+        choices=PATTERNS,
+        default="morning",
+        help="how conversation starts spread over --duration",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds over which chats arrive"
+    )
+    parser.add_argument(
+        "--think", type=float, default=0, help="mean seconds before each answer"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="stub Bot API response time (s)"
+    )
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX, help="profile shares, e.g. entry=1,new_plan=1"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="seconds to let the pools start"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        r = asyncio.run(run_load(args, tmp))
+
+    print(
+        f"{r['chats']:,} chats ({', '.join(f'{n} {p}' for p, n in r['profiles'].items())}), "
+        f"{r['arrival']} arrivals over {r['duration_s']:g} s"
+    )
+    print(
+        f"{r['updates']:,} updates in {r['seconds']:.2f} s = "
+        f"{r['updates_per_s']:,.0f} updates/s, "
+        f"{r['conversations_per_s']:,.1f} conversations/s; "
+        f"{r['unexpected_endings']} conversations ended unexpectedly"
+    )
+    print(
+        f"peak RSS {r['peak_rss_mb']:.0f} MB (compute workers "
+        f"{r['peak_rss_children_mb']:.0f} MB); seeding took {r['seeding_s']:.1f} s"
+    )
+    print(f"{'state':<18}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for state, s in r["states"].items():
+        print(
+            f"{state:<18}{s['n']:>8}{s['p50_ms']:>10.1f}"
+            f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+        )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(r, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
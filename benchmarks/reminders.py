@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from benchmarks.fake_bot_api import FakeBotApi
+from src.data_manager import storage
+from src.messaging.reminders import DEFAULT_TIME, ReminderScheduler, ReminderService
+
+
+# Reminder throughput: the heap scheduler on its own, then a burst of reminders
+# all due at once (everyone waking at the same time) sent through a local fake
+# Bot API server. The server enforces Telegram's limits itself and answers 429
+# (Too Many Requests) when they are exceeded, so a rejected send shows the
+# token buckets let too much through.
+
+TOKEN = "123456:reminder-benchmark"
+
+
+def bench_scheduler(jobs: int) -> dict:
+    """Microseconds per schedule, reschedule and pop on a heap of jobs reminders."""
+    rng = random.Random(0)
+    dues = [rng.uniform(0, 86_400) for _ in range(jobs)]
+    scheduler = ReminderScheduler()
+
+    start = time.perf_counter()
+    for chat_id, due in enumerate(dues):
+        scheduler.schedule(chat_id, due)
+    schedule = time.perf_counter() - start
+
+    # Plan changes: a tenth of the chats move their reminder
+    moved = rng.sample(range(jobs), jobs // 10)
+    start = time.perf_counter()
+    for chat_id in moved:
+        scheduler.schedule(chat_id, rng.uniform(0, 86_400))
+    reschedule = time.perf_counter() - start
+
+    start = time.perf_counter()
+    popped = 0
+    while True:
+        batch = scheduler.pop_due(86_400, 1024)
+        if not batch:
+            break
+        popped += len(batch)
+    pop = time.perf_counter() - start
+    assert popped == jobs, (popped, jobs)
+
+    return {
+        "jobs": jobs,
+        "schedule_us": schedule / jobs * 1e6,
+        "reschedule_us": reschedule / max(len(moved), 1) * 1e6,
+        "pop_us": pop / jobs * 1e6,
+    }
+
+
+async def bench_send(
+    chats: int, rate: float, chat_rate: float, senders: int, latency: float
+) -> dict:
+    """Send one reminder to each of chats chats, all due now, through the fake server."""
+    server = FakeBotApi(rate, chat_rate, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # No plans: every chat gets the default reminder time
+        storage.set_store(storage.SqliteStore(os.path.join(tmp, "bench.db")))
+        bot = Bot(
+            TOKEN,
+            base_url=server.base_url,
+            request=HTTPXRequest(connection_pool_size=senders),
+        )
+        try:
+            async with bot:
+                service = ReminderService(
+                    bot, rate=rate, chat_rate=chat_rate, senders=senders
+                )
+                now = time.time()
+                for chat_id in range(1, chats + 1):
+                    service.subscribers[chat_id] = ("UTC", DEFAULT_TIME)
+                service.scheduler.schedule_many([(now, c) for c in range(1, chats + 1)])
+
+                start = time.perf_counter()
+                await service.start(load=False)
+                while service.sent + service.skipped + service.failed < chats:
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - start
+                await service.stop()
+        finally:
+            server.shutdown()
+            server.server_close()
+            storage.set_store(None)
+
+    return {
+        "chats": chats,
+        "sent": service.sent,
+        "failed": service.failed,
+        "rejected_429": server.rejected,
+        "seconds": elapsed,
+        "msgs_per_s": service.sent / elapsed,
+        "limit_per_s": rate,
+        "rescheduled": len(service.scheduler),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the reminder scheduler and rate-limited sender."
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1_000_000, help="reminders in the heap benchmark"
+    )
+    parser.add_argument(
+        "--chats", type=int, default=300, help="reminders sent to the fake server"
+    )
+    parser.add_argument("--rate", type=float, default=25, help="global messages/s")
+    parser.add_argument(
+        "--chat-rate", type=float, default=1, help="messages/s per chat"
+    )
+    parser.add_argument("--senders", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="fake server response time (s)"
+    )
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = {"scheduler": bench_scheduler(args.jobs)}
+    s = results["scheduler"]
+    print(
+        f"scheduler, {s['jobs']:,} jobs: schedule {s['schedule_us']:.2f} us, "
+        f"reschedule {s['reschedule_us']:.2f} us, pop {s['pop_us']:.2f} us"
+    )
+
+    results["send"] = asyncio.run(
+        bench_send(args.chats, args.rate, args.chat_rate, args.senders, args.latency)
+    )
+    r = results["send"]
+    print(
+        f"send, {r['chats']:,} chats due at once: {r['sent']:,} sent in "
+        f"{r['seconds']:.2f} s = {r['msgs_per_s']:.1f} msgs/s "
+        f"(limit {r['limit_per_s']:g}), {r['rejected_429']} rejected with 429, "
+        f"{r['failed']} failed, {r['rescheduled']:,} rescheduled for tomorrow"
+    )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
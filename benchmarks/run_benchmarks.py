@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+from datetime import time as dtime
+from types import SimpleNamespace
+
+# The bot config reads these at import time; benchmarks never talk to Telegram
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "1")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from telegram.ext import ConversationHandler  # noqa: E402
+
+from benchmarks.synthetic import fill_sqlite, write_log_csv  # noqa: E402
+from src.common.config import (  # noqa: E402
+    AWAKE,
+    BEDTIME,
+    EARLIEST_BEDTIME,
+    EARLIEST_WAKE,
+    INIT_WINDOW,
+    ONSET,
+    UPDATE_WINDOW,
+    WAKEUP,
+)
+from src.common.models import LogEntry, SleepPlan, week_start  # noqa: E402
+from src.data_manager import log_utils, plan_utils, storage  # noqa: E402
+from src.data_manager.log_writer import close_log_writer  # noqa: E402
+from src.data_manager.plan_repository import close_plan_repository  # noqa: E402
+from src.messaging import async_facade, handlers  # noqa: E402
+from src.processing import compute_sleep_plan  # noqa: E402
+
+
+DEFAULT_SIZES = [10, 1_000, 100_000, 10_000_000]
+CHAT_ID = 1
+CONCURRENT_ENTRIES = 64
+
+
+def measure(fn, setup=None, min_time: float = 0.5, max_repeat: int = 1000) -> dict:
+    """Time fn (at least once, until min_time has elapsed), then trace its peak memory."""
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    # Separate run, so tracing overhead doesn't skew the timings
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "repeat": len(times),
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+class CsvFixture:
+    """A synthetic CSV log plus plan that can be reset to its initial state."""
+
+    def __init__(self, workdir: str, n_rows: int):
+        self.log_path = os.path.join(workdir, f"log-{n_rows}.csv")
+        self.plan_path = os.path.join(workdir, f"plan-{n_rows}.json")
+        write_log_csv(self.log_path, n_rows)
+        self.store = storage.CsvStore(self.log_path, self.plan_path)
+        self.store.save_plan(CHAT_ID, _plan())
+        self.store.log_meta(CHAT_ID)  # build the counter sidecar once
+        self.store.weekly_summaries(CHAT_ID)  # ... and the weekly summaries
+
+        self.size = os.path.getsize(self.log_path)
+        self.weeks_size = os.path.getsize(self.store.weeks_path)
+        with open(self.store.meta_path) as f:
+            self.meta = f.read()
+
+    def reset(self):
+        # Drop rows appended by the previous run instead of rewriting the log
+        os.truncate(self.log_path, self.size)
+        os.truncate(self.store.weeks_path, self.weeks_size)
+        with open(self.store.meta_path, "w") as f:
+            f.write(self.meta)
+        close_plan_repository()  # drop cached plans so the reset one is read back
+        self.store.save_plan(CHAT_ID, _plan())
+
+
+class SqliteFixture:
+    """A synthetic SQLite log plus plan that can be reset to its initial state."""
+
+    def __init__(self, workdir: str, n_rows: int):
+        self.store = storage.SqliteStore(os.path.join(workdir, f"log-{n_rows}.db"))
+        fill_sqlite(self.store, CHAT_ID, n_rows)
+        self.store.save_plan(CHAT_ID, _plan())
+        conn = self.store._conn()
+        (self.max_rowid,) = conn.execute("SELECT MAX(rowid) FROM log").fetchone()
+        self.meta = conn.execute(
+            "SELECT * FROM log_meta WHERE chat_id = ?", (CHAT_ID,)
+        ).fetchone()
+        self.window = conn.execute(
+            "SELECT * FROM log_window WHERE chat_id = ?", (CHAT_ID,)
+        ).fetchone()
+        # Benchmarks append tonight's entries, which all land in this week
+        self.week = week_start(date.today()).isoformat()
+
+    def reset(self):
+        with self.store._conn() as conn:
+            conn.execute("DELETE FROM log WHERE rowid > ?", (self.max_rowid,))
+            conn.execute("INSERT OR REPLACE INTO log_meta VALUES (?, ?, ?)", self.meta)
+            conn.execute("INSERT OR REPLACE INTO log_window VALUES (?, ?)", self.window)
+            conn.execute(
+                "DELETE FROM weekly_summary WHERE chat_id = ? AND week = ?",
+                (CHAT_ID, self.week),
+            )
+        close_plan_repository()  # drop cached plans so the reset one is read back
+        self.store.save_plan(CHAT_ID, _plan())
+
+
+def _plan() -> SleepPlan:
+    return SleepPlan(tib=420, bedtime=dtime(23, 30), wake_time=dtime(6, 30))
+
+
+def _rows_triggering_update(n_rows: int) -> int:
+    """Largest row count <= n_rows for which the next entry triggers a plan."""
+    if n_rows < INIT_WINDOW:
+        return INIT_WINDOW - 1
+    return n_rows - (n_rows + 1 - INIT_WINDOW) % UPDATE_WINDOW
+
+
+class _StubMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+
+class _StubApplication:
+    def stop_running(self):
+        pass
+
+
+_ANSWERS = {
+    BEDTIME: "23:30",
+    WAKEUP: "06:45",
+    ONSET: "15",
+    AWAKE: "20",
+    EARLIEST_WAKE: "06:30",
+    EARLIEST_BEDTIME: "23:00",
+}
+
+_STATE_HANDLERS = {
+    BEDTIME: handlers.get_bedtime,
+    WAKEUP: handlers.get_wakeup_time,
+    ONSET: handlers.get_sleep_onset,
+    AWAKE: handlers.get_awaken_time,
+    EARLIEST_WAKE: handlers.ask_earliest_wake,
+    EARLIEST_BEDTIME: handlers.ask_earliest_bedtime,
+}
+
+
+def _stub_update(text: str):
+    return SimpleNamespace(
+        message=_StubMessage(text), effective_chat=SimpleNamespace(id=CHAT_ID)
+    )
+
+
+async def run_conversation() -> list:
+    """Drive one /log conversation through the handlers, returning visited states."""
+    context = SimpleNamespace(
+        user_data={}, bot_data={"one_shot": False}, application=_StubApplication()
+    )
+    state = await handlers.log(_stub_update("/log"), context)
+    visited = [state]
+    while state != ConversationHandler.END:
+        state = await _STATE_HANDLERS[state](_stub_update(_ANSWERS[state]), context)
+        visited.append(state)
+    return visited
+
+
+def bench_size(fixture, n_rows: int, min_time: float) -> list:
+    results = []
+
+    def record(name, fn, setup=fixture.reset):
+        results.append({"name": name, "rows": n_rows, **measure(fn, setup, min_time)})
+
+    if isinstance(fixture, CsvFixture):
+        record("parse_log_csv", lambda: log_utils.parse_log_csv(fixture.log_path))
+        # Parsed-log cache: unchanged file, then one entry appended since
+        record(
+            "read_log_csv",
+            lambda: log_utils.read_log_csv(fixture.log_path),
+            setup=lambda: log_utils.read_log_csv(fixture.log_path),
+        )
+
+        def append_one():
+            fixture.reset()
+            log_utils.read_log_csv(fixture.log_path)
+            entry = log_utils.new_entry(dtime(23, 30), dtime(6, 45), 15, 20)
+            fixture.store.append_entry(CHAT_ID, entry)
+
+        record(
+            "read_log_csv[after append]",
+            lambda: log_utils.read_log_csv(fixture.log_path),
+            setup=append_one,
+        )
+        record(
+            "read_log_tail",
+            lambda: log_utils.read_log_tail(fixture.log_path, UPDATE_WINDOW),
+        )
+    record("read_log", lambda: log_utils.read_log(CHAT_ID))
+    record(
+        "read_log[last UPDATE_WINDOW]",
+        lambda: log_utils.read_log(CHAT_ID, UPDATE_WINDOW),
+    )
+    record("read_log_window", lambda: log_utils.read_log_window(CHAT_ID))
+    record("sleep_stats", lambda: log_utils.sleep_stats(CHAT_ID))
+    record(
+        "plan_triggers",
+        lambda: (
+            log_utils.enough_data_for_first_plan(CHAT_ID),
+            log_utils.ready_for_new_plan(CHAT_ID),
+        ),
+    )
+    record(
+        "add_new_entry",
+        lambda: log_utils.add_new_entry(dtime(23, 30), dtime(6, 45), 15, 20, CHAT_ID),
+    )
+
+    async def concurrent_entries():
+        # A burst of users logging at once, committed in shared batches
+        await asyncio.gather(
+            *(
+                async_facade.add_new_entry(dtime(23, 30), dtime(6, 45), 15, 20, CHAT_ID)
+                for _ in range(CONCURRENT_ENTRIES)
+            )
+        )
+
+    record(
+        f"add_new_entry[x{CONCURRENT_ENTRIES} concurrent]",
+        lambda: asyncio.run(concurrent_entries()),
+    )
+    # Warm up the worker pools so process startup isn't timed
+    fixture.reset()
+    asyncio.run(run_conversation())
+    record("conversation[/log]", lambda: asyncio.run(run_conversation()))
+    return results
+
+
+def bench_fixed(min_time: float) -> list:
+    """Hot paths whose cost doesn't depend on log length."""
+    results = []
+
+    def record(name, fn, rows=None, setup=None):
+        results.append({"name": name, "rows": rows, **measure(fn, setup, min_time)})
+
+    record("load_plan", lambda: plan_utils.load_plan(CHAT_ID))
+    record("save_plan", lambda: plan_utils.save_plan(_plan(), CHAT_ID))
+    record(
+        "update_wake_time", lambda: plan_utils.update_wake_time(dtime(6, 30), CHAT_ID)
+    )
+
+    def compute_metrics():
+        entry = LogEntry(
+            date=date(2025, 1, 1),
+            bedtime=dtime(23, 30),
+            wakeup=dtime(6, 45),
+            onset=15,
+            awake=20,
+        )
+        entry.compute_metrics
+
+    record("LogEntry.compute_metrics", compute_metrics)
+
+    df = log_utils.read_log(CHAT_ID, INIT_WINDOW)
+    record(
+        "initialize_sleep_plan",
+        lambda: compute_sleep_plan.initialize_sleep_plan(df, _plan(), CHAT_ID),
+        rows=INIT_WINDOW,
+    )
+    df = log_utils.read_log(CHAT_ID, UPDATE_WINDOW)
+    record(
+        "adjust_sleep_plan_se_tst_clipped",
+        lambda: compute_sleep_plan.adjust_sleep_plan_se_tst_clipped(
+            df, _plan(), CHAT_ID
+        ),
+        rows=UPDATE_WINDOW,
+    )
+    window = log_utils.read_log_window(CHAT_ID)
+    record(
+        "adjust_sleep_plan_se_tst_clipped[window]",
+        lambda: compute_sleep_plan.adjust_sleep_plan_se_tst_clipped(
+            window, _plan(), CHAT_ID
+        ),
+        rows=UPDATE_WINDOW,
+    )
+    record(
+        "adjust_sleep_plan_se_tst_conservative",
+        lambda: compute_sleep_plan.adjust_sleep_plan_se_tst_conservative(
+            df, _plan(), CHAT_ID
+        ),
+        rows=UPDATE_WINDOW,
+    )
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(current: dict, baseline_path: str, threshold: float):
+    """Print median-time ratios against an earlier run, flagging regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"{'benchmark':<45} {'rows':>10} {'before':>11} {'after':>11} {'ratio':>7}")
+    for r in current["results"]:
+        old = baseline.get((r["name"], r["rows"]))
+        if old is None:
+            continue
+        ratio = r["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(
+            f"{r['name']:<45} {str(r['rows']):>10} {old['median_s']:>11.6f} "
+            f"{r['median_s']:>11.6f} {ratio:>7.2f}{flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the log, plan and compute hot paths."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="synthetic log lengths",
+    )
+    parser.add_argument("--backend", choices=("csv", "sqlite"), default="csv")
+    parser.add_argument(
+        "--min-time", type=float, default=0.5, help="seconds per benchmark"
+    )
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier JSON results")
+    parser.add_argument("--threshold", type=float, default=1.2, help="regression ratio")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="shuteye-bench-")
+    results = []
+    try:
+        for n_rows in args.sizes:
+            n_rows = _rows_triggering_update(n_rows)
+            if args.backend == "csv":
+                fixture = CsvFixture(workdir, n_rows)
+            else:
+                fixture = SqliteFixture(workdir, n_rows)
+            storage.set_store(fixture.store)
+            results += bench_size(fixture, n_rows, args.min_time)
+        results += bench_fixed(args.min_time)
+    finally:
+        async_facade.shutdown()
+        close_log_writer()
+        close_plan_repository()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "environment": {**environment(), "backend": args.backend},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        compare(report, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
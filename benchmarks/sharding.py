@@ -0,0 +1,168 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_bot_api import FakeBotApi
+from src.messaging.messages import Messages
+from src.messaging.sharding import Cluster
+
+
+# Worker-mode throughput: many chats each log a week of nights and get their
+# first plan, all at once, through Cluster with 1, 2, 4... workers. Updates
+# are fed to the dispatcher side directly and the replies go to a local fake
+# Bot API server (fake_bot_api), so the numbers are the bot's own cost.
+# Every chat's updates are queued back to back, so a conversation only ends
+# with its plan if the worker kept them in order.
+
+TOKEN = "123456:sharding-benchmark"
+
+# One chat's week: six nights, then a seventh that asks for the first plan
+NIGHT = ["/log", "23:10", "06:40", "15", "20"]
+SCRIPT = NIGHT * 7 + ["07:00"]
+
+
+def _update(update_id: int, chat_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+def _feed(cluster: Cluster, chat_ids: list[int], first_update: int) -> int:
+    """Queue every chat's SCRIPT, interleaved step by step; returns the updates sent."""
+    update_id = first_update
+    for text in SCRIPT:
+        for chat_id in chat_ids:
+            cluster.send(chat_id, json.dumps(_update(update_id, chat_id, text)))
+            update_id += 1
+    return update_id - first_update
+
+
+_PLAN = Messages.first_sleep_plan.split("!")[0]
+
+
+def _wait(server: FakeBotApi, chat_ids: list[int], timeout: float):
+    """Wait until every chat got its first plan."""
+    deadline = time.monotonic() + timeout
+    pending = list(chat_ids)
+    while pending:
+        pending = [
+            c
+            for c in pending
+            if not (server.texts[c] and server.texts[c][-1].startswith(_PLAN))
+        ]
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{len(pending)} chats without a plan after {timeout} s")
+        time.sleep(0.01)
+
+
+def bench_workers(server: FakeBotApi, workers: int, chats: int, timeout: float) -> dict:
+    server.texts.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        cluster = Cluster(
+            workers,
+            db_path=os.path.join(tmp, "shuteye.db"),
+            persistence_path=os.path.join(tmp, "conversations.db"),
+        )
+        start = time.perf_counter()
+        cluster.start()
+        startup = time.perf_counter() - start
+        try:
+            # A chat on each worker first, to warm up imports and count the replies
+            warm = {}
+            for chat_id in itertools.count(-1, -1):
+                warm.setdefault(cluster.ring.shard_for(chat_id), chat_id)
+                if len(warm) == workers:
+                    break
+            _feed(cluster, list(warm.values()), 1)
+            _wait(server, list(warm.values()), timeout)
+            replies = len(server.texts[-1])
+
+            chat_ids = list(range(1, chats + 1))
+            start = time.perf_counter()
+            updates = _feed(cluster, chat_ids, 1_000_000)
+            _wait(server, chat_ids, timeout)
+            elapsed = time.perf_counter() - start
+        finally:
+            cluster.stop()
+
+    # An update handled out of order gets an error reply instead
+    mixed_up = sum(len(server.texts[c]) != replies for c in chat_ids)
+    per_shard = {}
+    for c in chat_ids:
+        shard = cluster.ring.shard_for(c)
+        per_shard[shard] = per_shard.get(shard, 0) + 1
+    return {
+        "workers": workers,
+        "chats": chats,
+        "updates": updates,
+        "startup_s": startup,
+        "seconds": elapsed,
+        "updates_per_s": updates / elapsed,
+        "chats_out_of_order": mixed_up,
+        "chats_per_shard": per_shard,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark worker-mode throughput for 1..N worker processes."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+
+    server = FakeBotApi(record=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Read by the worker processes' config
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "SHUTEYE_BOT_API_URL": server.base_url,
+            "SHUTEYE_STORAGE": "sqlite",
+            "SHUTEYE_REMINDERS": "0",
+            "SHUTEYE_METRICS_PORT": "0",
+            # Plans are computed in the worker itself: one process per worker
+            "SHUTEYE_COMPUTE_PROCESSES": "0",
+        }
+    )
+
+    print(f"{os.cpu_count()} CPUs")
+    results = []
+    try:
+        for workers in args.workers:
+            r = bench_workers(server, workers, args.chats, args.timeout)
+            results.append(r)
+            speedup = r["updates_per_s"] / results[0]["updates_per_s"]
+            print(
+                f"{workers} workers: {r['updates']:,} updates in {r['seconds']:.2f} s "
+                f"= {r['updates_per_s']:,.0f} updates/s ({speedup:.2f}x), "
+                f"{r['chats_out_of_order']} chats out of order, "
+                f"chats per shard {sorted(r['chats_per_shard'].values())}, "
+                f"startup {r['startup_s']:.1f} s"
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
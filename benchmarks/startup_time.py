@@ -0,0 +1,107 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Measures how long the bot takes to import and build its Application in a fresh
+# interpreter, and fails if that exceeds a budget or if modules that should load
+# lazily (pandas, NumPy) are imported at startup.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_STARTUP = """
+import time
+start = time.perf_counter()
+from src.messaging import bot
+bot.build_application()
+print(time.perf_counter() - start)
+"""
+
+
+def _env() -> dict:
+    env = {k: v for k, v in os.environ.items() if not k.startswith("TELEGRAM_")}
+    env["PYTHONPATH"] = ROOT
+    # build_application needs a token (and the CSV store its chat); nothing
+    # is sent to Telegram
+    env["TELEGRAM_BOT_TOKEN"] = "123456:startup-check"
+    env["TELEGRAM_CHAT_ID"] = "1"
+    return env
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Map module name -> cumulative import time in seconds, from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(cumulative) / 1e6
+    return modules
+
+
+def measure_once() -> tuple[float, dict]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP],
+        cwd=ROOT,
+        env=_env(),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        # Show the traceback, not the importtime noise around it
+        errors = [
+            l for l in proc.stderr.splitlines() if not l.startswith("import time:")
+        ]
+        sys.exit("startup failed:\n" + "\n".join(errors))
+    return float(proc.stdout.strip()), parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the bot's cold-start time against a budget."
+    )
+    parser.add_argument(
+        "--budget", type=float, default=0.75, help="seconds, median over runs"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument(
+        "--forbid",
+        nargs="*",
+        default=["pandas", "numpy"],
+        help="modules that must not be imported at startup",
+    )
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.repeat)]
+    startup = statistics.median(t for t, _ in runs)
+    modules = runs[-1][1]
+
+    print(f"startup (import + build_application): {startup * 1000:.1f} ms")
+    print("slowest top-level imports (cumulative):")
+    top = sorted(
+        ((t, name) for name, t in modules.items() if "." not in name),
+        reverse=True,
+    )
+    for t, name in top[: args.top]:
+        print(f"  {t * 1000:8.1f} ms  {name}")
+
+    failed = False
+    loaded = [m for m in args.forbid if m in modules]
+    if loaded:
+        print(f"FAIL: imported at startup: {', '.join(loaded)}")
+        failed = True
+    if startup > args.budget:
+        print(
+            f"FAIL: {startup * 1000:.1f} ms exceeds the {args.budget * 1000:.0f} ms budget"
+        )
+        failed = True
+    if not failed:
+        print(f"OK: within the {args.budget * 1000:.0f} ms budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+from datetime import date
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from src.common.minutes import hhmm_table
+from src.common.config import ROLLING_WINDOWS
+from src.data_manager.log_utils import cols, to_log_window
+from src.processing.reports import summarize_sqlite
+
+
+# Synthetic dates cycle through ~100 years so that 10^7-row logs stay valid dates,
+# ending before today so that entries appended by benchmarks start a new week
+DATE_CYCLE_DAYS = 36_500
+START_DATE = date(1925, 1, 1)
+
+
+def synthetic_log_chunks(
+    n_rows: int, chunk_size: int = 1_000_000, seed: int = 0
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield raw log rows (same columns and text formats as log.csv) in chunks.
+    Bedtimes scatter around 23:30, wake-ups around 07:00, with metrics derived
+    the same way LogEntry.compute_metrics does.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(START_DATE, "D")
+    for offset in range(0, n_rows, chunk_size):
+        n = min(chunk_size, n_rows - offset)
+        bedtime = np.rint(rng.normal(23.5 * 60, 45, n)).astype(int) % 1440
+        wakeup = np.rint(rng.normal(7 * 60, 40, n)).astype(int) % 1440
+        onset = rng.integers(0, 60, n)
+        awake = rng.integers(0, 90, n)
+
+        tib = (wakeup - bedtime) % 1440
+        tib[tib == 0] = 1440  # same time means a full day in bed
+        tst = tib - (onset + awake)
+        se = np.trunc(tst / tib * 100).astype(int)
+
+        dates = start + (offset + np.arange(n)) % DATE_CYCLE_DAYS
+
+        yield pd.DataFrame(
+            {
+                "date": dates.astype(str),
+                "bedtime": hhmm_table()[bedtime],
+                "wakeup": hhmm_table()[wakeup],
+                "onset": onset,
+                "awake": awake,
+                "tib": tib,
+                "tst": tst,
+                "se": se,
+            },
+            columns=cols,
+        )
+
+
+def write_log_csv(path: str, n_rows: int, seed: int = 0):
+    """Write an n_rows log in the log.csv format (no header, no trailing newline)."""
+    with open(path, "w") as f:
+        first = True
+        for chunk in synthetic_log_chunks(n_rows, seed=seed):
+            text = chunk.to_csv(header=False, index=False, lineterminator="\n")
+            f.write(("" if first else "\n") + text.rstrip("\n"))
+            first = False
+
+
+def fill_sqlite(store, chat_id: int, n_rows: int, seed: int = 0):
+    """Insert an n_rows log for one chat into a SqliteStore."""
+    conn = store._conn()
+    with conn:
+        for chunk in synthetic_log_chunks(n_rows, seed=seed):
+            rows = zip([chat_id] * len(chunk), *(chunk[c].tolist() for c in cols))
+            conn.executemany("INSERT INTO log VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO log_meta "
+            "SELECT chat_id, COUNT(*), MAX(date) FROM log WHERE chat_id = ?",
+            (chat_id,),
+        )
+        window = to_log_window(store.read_log(chat_id, ROLLING_WINDOWS[-1]))
+        store._save_window(conn, chat_id, window)
+        store._save_weeks(conn, summarize_sqlite(conn, chat_id, chat_id))
@@ -1,13 +1,105 @@
 import os
 
 
-# API Key
-BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
-CHAT_ID = os.environ["TELEGRAM_CHAT_ID"]
+# API Key: BOT_TOKEN and CHAT_ID are read from the environment on first use
+# (see __getattr__ below), so tools that never talk to Telegram don't need them
+_FROM_ENV = {
+    "BOT_TOKEN": "TELEGRAM_BOT_TOKEN",
+    "CHAT_ID": "TELEGRAM_CHAT_ID",
+}
 
 # Paths
 LOG_PATH = os.environ.get("TEST_LOG_PATH", "data/log.csv")
 PLAN_PATH = os.environ.get("TEST_PLAN_PATH", "data/plan.json")
+DB_PATH = os.environ.get("SHUTEYE_DB_PATH", "data/shuteye.db")
+
+# Storage backend: "csv" (single user, LOG_PATH/PLAN_PATH) or "sqlite" (per chat, DB_PATH)
+STORAGE_BACKEND = os.environ.get("SHUTEYE_STORAGE", "csv")
+
+# Async handlers: threads for storage I/O, processes for plan computation
+# (0 processes runs plan computation on the I/O threads instead)
+IO_THREADS = int(os.environ.get("SHUTEYE_IO_THREADS", "8"))
+COMPUTE_PROCESSES = int(os.environ.get("SHUTEYE_COMPUTE_PROCESSES", "1"))
+
+# Plan cache: plans kept in memory, and how often changed plans are written
+# back in seconds (0 writes every change through immediately)
+PLAN_CACHE_SIZE = int(os.environ.get("SHUTEYE_PLAN_CACHE_SIZE", "10000"))
+PLAN_FLUSH_INTERVAL = float(os.environ.get("SHUTEYE_PLAN_FLUSH_INTERVAL", "1.0"))
+
+# Parsed-log cache: full CSV logs parsed recently, up to LOG_CACHE_ROWS rows
+# in all (about 190 bytes each; 0 disables)
+LOG_CACHE_ROWS = int(os.environ.get("SHUTEYE_LOG_CACHE_ROWS", "500000"))
+
+# Log segments (CSV storage): the log is sealed into gzipped segments next to
+# it, "monthly" when a night of a new month is logged or "size" once the log
+# reaches LOG_SEGMENT_BYTES; "off" keeps a single file
+LOG_SEGMENTS = os.environ.get("SHUTEYE_LOG_SEGMENTS", "off")
+LOG_SEGMENT_BYTES = int(os.environ.get("SHUTEYE_LOG_SEGMENT_BYTES", "1048576"))
+
+# Log writer: entries are group-committed, up to LOG_BATCH_SIZE at a time and
+# waiting at most LOG_BATCH_LATENCY seconds after the first one for company
+# (0: commit whatever is queued right away; batches still form while a
+# previous commit is syncing)
+LOG_BATCH_SIZE = int(os.environ.get("SHUTEYE_LOG_BATCH_SIZE", "256"))
+LOG_BATCH_LATENCY = float(os.environ.get("SHUTEYE_LOG_BATCH_LATENCY", "0"))
+
+# Service mode: by default one long-running process serves every chat;
+# ONE_SHOT restores the old behaviour of stopping after each conversation
+ONE_SHOT = os.environ.get("SHUTEYE_ONE_SHOT", "0") == "1"
+CONCURRENT_UPDATES = int(os.environ.get("SHUTEYE_CONCURRENT_UPDATES", "64"))
+
+# Webhook: receive updates on a local HTTP server instead of polling when
+# WEBHOOK_URL (the public URL Telegram posts to) is set
+WEBHOOK_URL = os.environ.get("SHUTEYE_WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("SHUTEYE_WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("SHUTEYE_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("SHUTEYE_WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("SHUTEYE_WEBHOOK_SECRET")
+
+# Sharded workers: with WORKERS > 1, one dispatcher process receives the
+# updates and routes each chat, by consistent hashing of its id, to one of
+# WORKERS processes with their own SQLite shard (DB_PATH and PERSISTENCE_PATH
+# with ".shard<N>" before the extension). SHARD_VNODES points per worker on
+# the hash ring even out the split
+WORKERS = int(os.environ.get("SHUTEYE_WORKERS", "1"))
+SHARD_VNODES = int(os.environ.get("SHUTEYE_SHARD_VNODES", "128"))
+
+# Bot API server, e.g. a self-hosted telegram-bot-api ("http://host:8081/bot");
+# unset uses Telegram's
+BOT_API_URL = os.environ.get("SHUTEYE_BOT_API_URL")
+
+# Conversation persistence: in-flight /log conversations and their answers so
+# far are kept in an SQLite file so they survive restarts (empty disables);
+# changes are saved every PERSISTENCE_INTERVAL seconds and on shutdown
+PERSISTENCE_PATH = os.environ.get("SHUTEYE_PERSISTENCE_PATH", "data/conversations.db")
+PERSISTENCE_INTERVAL = float(os.environ.get("SHUTEYE_PERSISTENCE_INTERVAL", "1.0"))
+
+# Morning reminders (/reminders on <timezone>): Messages.good_morning at each
+# subscriber's planned wake-up time, or REMINDER_DEFAULT_TIME until they have
+# a plan. Sends are limited to REMINDER_RATE per second overall and
+# REMINDER_CHAT_RATE per chat (Telegram allows about 30 and 1); a reminder
+# that is more than REMINDER_GRACE seconds late (after downtime) is skipped
+REMINDERS = os.environ.get("SHUTEYE_REMINDERS", "1") == "1"
+REMINDER_DEFAULT_TIME = os.environ.get("SHUTEYE_REMINDER_DEFAULT_TIME", "08:00")
+REMINDER_TIMEZONE = os.environ.get("SHUTEYE_REMINDER_TIMEZONE", "UTC")
+REMINDER_RATE = float(os.environ.get("SHUTEYE_REMINDER_RATE", "25"))
+REMINDER_CHAT_RATE = float(os.environ.get("SHUTEYE_REMINDER_CHAT_RATE", "1"))
+REMINDER_SENDERS = int(os.environ.get("SHUTEYE_REMINDER_SENDERS", "8"))
+REMINDER_GRACE = float(os.environ.get("SHUTEYE_REMINDER_GRACE", "3600"))
+
+# Metrics: Prometheus endpoint on METRICS_LISTEN:METRICS_PORT/metrics
+# (0 disables all instrumentation)
+METRICS_PORT = int(os.environ.get("SHUTEYE_METRICS_PORT", "0"))
+METRICS_LISTEN = os.environ.get("SHUTEYE_METRICS_LISTEN", "127.0.0.1")
+
+# Tracing: record a Chrome-trace span file for each /log conversation of the
+# chats listed in SHUTEYE_TRACE_CHAT (comma-separated ids), with cProfile
+# stats attached when SHUTEYE_TRACE_PROFILE=1
+TRACE_CHATS = {
+    int(c) for c in os.environ.get("SHUTEYE_TRACE_CHAT", "").split(",") if c.strip()
+}
+TRACE_DIR = os.environ.get("SHUTEYE_TRACE_DIR", "traces")
+TRACE_PROFILE = os.environ.get("SHUTEYE_TRACE_PROFILE", "0") == "1"
 
 # Conversation states
 BEDTIME, WAKEUP, ONSET, AWAKE, EARLIEST_WAKE, EARLIEST_BEDTIME = range(6)
@@ -15,8 +107,20 @@ BEDTIME, WAKEUP, ONSET, AWAKE, EARLIEST_WAKE, EARLIEST_BEDTIME = range(6)
 # Sleep Plan
 INIT_WINDOW = 7
 UPDATE_WINDOW = 5
+# Nights covered by the rolling averages kept up to date on every new entry
+ROLLING_WINDOWS = tuple(sorted({UPDATE_WINDOW, INIT_WINDOW, 14, 30}))
 DELTA_UP = 5   # NOTE: Minor tweak. Originally 15 min.
 DELTA_DOWN = 5 # NOTE: Minor tweak. Originally 15 min.
 BUFFER = 30
 MIN_TIB = 330  # 5.5h floor
 MIN_TIB_CONSERVATIVE = 420  # 7h floor
+
+# Reports: a night follows the plan if bedtime/wake-up is within this many
+# minutes of the planned time
+ADHERENCE_TOLERANCE = 30
+
+
+def __getattr__(name: str):
+    if name in _FROM_ENV:
+        return os.environ[_FROM_ENV[name]]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
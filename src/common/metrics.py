@@ -0,0 +1,237 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.common.config import METRICS_LISTEN, METRICS_PORT
+
+
+# Latency histograms, error counters and queue-depth gauges, served in the
+# Prometheus text format on METRICS_LISTEN:METRICS_PORT/metrics.
+# With metrics disabled (METRICS_PORT=0, the default) the decorators return the
+# function unchanged and the other calls return immediately.
+
+ENABLED = METRICS_PORT > 0
+
+# Upper bounds in seconds; the last bucket (+Inf) catches everything else
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+_HELP = {
+    "shuteye_call_seconds": (
+        "histogram",
+        "Latency of storage, plan and compute calls.",
+    ),
+    "shuteye_handler_seconds": ("histogram", "Latency of each conversation step."),
+    "shuteye_errors_total": ("counter", "Errors reported to the user, by type."),
+    "shuteye_queue_depth": ("gauge", "Items waiting in each work queue."),
+    "shuteye_log_cache_total": (
+        "counter",
+        "Parsed-log cache lookups, by result (hit, extend or miss).",
+    ),
+    "shuteye_log_cache_rows": ("gauge", "Log rows held by the parsed-log cache."),
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}  # (name, labels) -> value
+_gauges = {}  # (name, labels) -> callable returning the current value
+_NULL = nullcontext()
+
+
+def _labels(**labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    if not ENABLED:
+        return
+    key = (name, _labels(**labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+
+def count(name: str, **labels):
+    if not ENABLED:
+        return
+    key = (name, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def count_error(error_type: str):
+    count("shuteye_errors_total", type=error_type)
+
+
+def gauge(name: str, fn, **labels):
+    """Report fn() as the value of a gauge at every scrape."""
+    if ENABLED:
+        _gauges[(name, _labels(**labels))] = fn
+
+
+def queue_depth(queue: str, fn):
+    """Report fn() as the depth of a queue at every scrape."""
+    gauge("shuteye_queue_depth", fn, queue=queue)
+
+
+@contextmanager
+def _timer(name: str, labels: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timer(fn_name: str):
+    """Context manager timing a block as shuteye_call_seconds{fn=fn_name}."""
+    return _timer("shuteye_call_seconds", {"fn": fn_name}) if ENABLED else _NULL
+
+
+def timed(fn):
+    """Decorator: time every call of fn (sync or async) under its name."""
+    if not ENABLED:
+        return fn
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timer(fn.__name__):
+                return await fn(*args, **kwargs)
+
+    else:
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(fn.__name__):
+                return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def transition(state_names: dict):
+    """Decorator for async conversation handlers: time each step by handler and next state."""
+
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            next_state = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                next_state = state_names.get(result, str(result))
+                return result
+            finally:
+                observe(
+                    "shuteye_handler_seconds",
+                    time.perf_counter() - start,
+                    handler=fn.__name__,
+                    next_state=next_state,
+                )
+
+        return wrapper
+
+    return decorate
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    gauges = {}
+    for key, fn in list(_gauges.items()):
+        try:
+            gauges[key] = fn()
+        except Exception:
+            continue  # e.g. the queue's owner was shut down
+
+    samples = {}
+    for (name, labels), h in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), h[:-1]):
+            cumulative += count
+            le = labels + (("le", bound),)
+            samples.setdefault(name, []).append(
+                f"{name}_bucket{_format_labels(le)} {cumulative}"
+            )
+        samples[name].append(f"{name}_sum{_format_labels(labels)} {h[-1]}")
+        samples[name].append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    for (name, labels), value in sorted({**counters, **gauges}.items()):
+        samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+
+    lines = []
+    for name, (kind, help_text) in _HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples.get(name, []))
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+_server = None
+
+
+def start_server(listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+    """Serve /metrics from a daemon thread (no-op when metrics are disabled)."""
+    global _server
+    if not ENABLED or _server is not None:
+        return
+    _server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    threading.Thread(
+        target=_server.serve_forever, name="shuteye-metrics", daemon=True
+    ).start()
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
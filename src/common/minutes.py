@@ -0,0 +1,72 @@
+from datetime import datetime, time
+
+
+# Clock times are minutes after midnight (0..1439). The arithmetic helpers only
+# use integer operators, so they accept plain ints and NumPy arrays alike.
+MINUTES_PER_DAY = 1440
+
+
+def to_minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def from_minutes(m: int) -> time:
+    return time(*divmod(int(m) % MINUTES_PER_DAY, 60))
+
+
+def parse_hhmm(text: str) -> int:
+    """Parse "HH:MM" (raises ValueError like datetime.strptime)."""
+    return to_minutes(datetime.strptime(text, "%H:%M").time())
+
+
+def format_hhmm(m: int) -> str:
+    hours, minutes = divmod(int(m) % MINUTES_PER_DAY, 60)
+    return f"{hours:02d}:{minutes:02d}"
+
+
+def shift(m, delta):
+    """Move a clock time by delta minutes, wrapping around midnight."""
+    return (m + delta) % MINUTES_PER_DAY
+
+
+def span(start, end):
+    """
+    Minutes from start to end, crossing midnight if end is not after start.
+    Equal times count as a full day, as when bedtime and wake-up coincide.
+    """
+    d = (end - start) % MINUTES_PER_DAY
+    return d + MINUTES_PER_DAY * (d == 0)
+
+
+def distance(a, b):
+    """Minutes between two clock times the short way round (23:50 to 00:10 is 20)."""
+    d = (a - b) % MINUTES_PER_DAY
+    return d + (MINUTES_PER_DAY - 2 * d) * (d > MINUTES_PER_DAY // 2)
+
+
+_hhmm_table = None
+_time_table = None
+
+
+def hhmm_table():
+    """NumPy array of "HH:MM" strings indexed by minute, for vectorized formatting."""
+    global _hhmm_table
+    if _hhmm_table is None:
+        import numpy as np
+
+        _hhmm_table = np.array(
+            [format_hhmm(m) for m in range(MINUTES_PER_DAY)], dtype=object
+        )
+    return _hhmm_table
+
+
+def time_table():
+    """NumPy array of datetime.time objects indexed by minute."""
+    global _time_table
+    if _time_table is None:
+        import numpy as np
+
+        _time_table = np.array(
+            [from_minutes(m) for m in range(MINUTES_PER_DAY)], dtype=object
+        )
+    return _time_table
@@ -1,66 +1,179 @@
-from dataclasses import dataclass
-from datetime import datetime, date, time, timedelta
+import statistics
+from dataclasses import dataclass, field
+from datetime import date, time, timedelta
 from typing import Optional
 
+from src.common.config import ADHERENCE_TOLERANCE, ROLLING_WINDOWS
+from src.common.minutes import (
+    distance,
+    format_hhmm,
+    from_minutes,
+    parse_hhmm,
+    shift,
+    span,
+    to_minutes,
+)
+
+
+def _minutes_or_none(t: Optional[time]) -> Optional[int]:
+    return None if t is None else to_minutes(t)
+
+
+def _time_or_none(m: Optional[int]) -> Optional[time]:
+    return None if m is None else from_minutes(m)
+
 
-@dataclass
 class SleepPlan:
-    tib: Optional[int] = None  # target Time in bed in minutes
-    bedtime: Optional[time] = None
-    wake_time: Optional[time] = None
+    # Clock times are kept as minutes after midnight; bedtime/wake_time expose them as time
+    __slots__ = ("tib", "bedtime_min", "wake_time_min")
+
+    def __init__(
+        self,
+        tib: Optional[int] = None,  # target Time in bed in minutes
+        bedtime: Optional[time] = None,
+        wake_time: Optional[time] = None,
+    ):
+        self.tib = tib
+        self.bedtime_min = _minutes_or_none(bedtime)
+        self.wake_time_min = _minutes_or_none(wake_time)
+
+    @staticmethod
+    def from_minutes(
+        tib: Optional[int], bedtime: Optional[int], wake_time: Optional[int]
+    ) -> "SleepPlan":
+        plan = SleepPlan(tib=tib)
+        plan.bedtime_min = bedtime
+        plan.wake_time_min = wake_time
+        return plan
+
+    def copy(self) -> "SleepPlan":
+        return SleepPlan.from_minutes(self.tib, self.bedtime_min, self.wake_time_min)
+
+    @property
+    def bedtime(self) -> Optional[time]:
+        return _time_or_none(self.bedtime_min)
+
+    @bedtime.setter
+    def bedtime(self, value: Optional[time]):
+        self.bedtime_min = _minutes_or_none(value)
+
+    @property
+    def wake_time(self) -> Optional[time]:
+        return _time_or_none(self.wake_time_min)
+
+    @wake_time.setter
+    def wake_time(self, value: Optional[time]):
+        self.wake_time_min = _minutes_or_none(value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SleepPlan):
+            return NotImplemented
+        return (self.tib, self.bedtime_min, self.wake_time_min) == (
+            other.tib,
+            other.bedtime_min,
+            other.wake_time_min,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"SleepPlan(tib={self.tib!r}, bedtime={self.bedtime!r}, "
+            f"wake_time={self.wake_time!r})"
+        )
 
     def to_dict(self) -> dict:
         return {
             "tib": self.tib,
-            "bedtime": self.bedtime.strftime("%H:%M"),
-            "wake_time": self.wake_time.strftime("%H:%M"),
+            "bedtime": format_hhmm(self.bedtime_min),
+            "wake_time": format_hhmm(self.wake_time_min),
         }
 
     @staticmethod
     def from_dict(data: dict) -> "SleepPlan":
-        return SleepPlan(
+        return SleepPlan.from_minutes(
             tib=int(data["tib"]),
-            bedtime=datetime.strptime(data["bedtime"], "%H:%M").time(),
-            wake_time=datetime.strptime(data["wake_time"], "%H:%M").time(),
+            bedtime=parse_hhmm(data["bedtime"]),
+            wake_time=parse_hhmm(data["wake_time"]),
         )
 
     @property
     def time_in_bed(self) -> None:
-        if self.bedtime is None or self.wake_time is None:
+        if self.bedtime_min is None or self.wake_time_min is None:
             raise ValueError("bedtime and wake_time must be set to compute tib")
-        bt = datetime.combine(datetime.today(), self.bedtime)
-        wt = datetime.combine(datetime.today(), self.wake_time)
-        if wt <= bt:  # handle crossing midnight
-            bt -= timedelta(days=1)
-        self.tib = int((wt - bt).total_seconds() // 60)
+        self.tib = span(self.bedtime_min, self.wake_time_min)
 
     @property
     def update_bedtime(self) -> None:
-        if self.tib is None or self.wake_time is None:
+        if self.tib is None or self.wake_time_min is None:
             raise ValueError("tib and wake_time must be set to update bedtime")
-        wt = datetime.combine(datetime.today(), self.wake_time)
-        bt = wt - timedelta(minutes=self.tib)
-        self.bedtime = bt.time()
+        self.bedtime_min = shift(self.wake_time_min, -self.tib)
 
     @property
     def update_wake_time(self) -> None:
-        if self.tib is None or self.bedtime is None:
+        if self.tib is None or self.bedtime_min is None:
             raise ValueError("tib and bedtime must be set to update wake_time")
-        bt = datetime.combine(datetime.today(), self.bedtime)
-        wt = bt + timedelta(minutes=self.tib)
-        self.wake_time = wt.time()
+        self.wake_time_min = shift(self.bedtime_min, self.tib)
 
 
-@dataclass
 class LogEntry:
-    date: date  # calendar date of entry
-    bedtime: time  # time went to bed
-    wakeup: time  # time woke up
-    onset: int  # sleep onset latency (minutes)
-    awake: int  # minutes awake after sleep onset
-    tib: Optional[int] = None  # time in bed (minutes)
-    tst: Optional[int] = None  # total sleep time (minutes)
-    se: Optional[int] = None  # sleep efficiency (%)
+    # Clock times are kept as minutes after midnight; bedtime/wakeup expose them as time
+    __slots__ = (
+        "date",
+        "bedtime_min",
+        "wakeup_min",
+        "onset",
+        "awake",
+        "tib",
+        "tst",
+        "se",
+    )
+
+    def __init__(
+        self,
+        date: date,  # calendar date of entry
+        bedtime: time,  # time went to bed
+        wakeup: time,  # time woke up
+        onset: int,  # sleep onset latency (minutes)
+        awake: int,  # minutes awake after sleep onset
+        tib: Optional[int] = None,  # time in bed (minutes)
+        tst: Optional[int] = None,  # total sleep time (minutes)
+        se: Optional[int] = None,  # sleep efficiency (%)
+    ):
+        self.date = date
+        self.bedtime_min = to_minutes(bedtime)
+        self.wakeup_min = to_minutes(wakeup)
+        self.onset = onset
+        self.awake = awake
+        self.tib = tib
+        self.tst = tst
+        self.se = se
+
+    @property
+    def bedtime(self) -> time:
+        return from_minutes(self.bedtime_min)
+
+    @bedtime.setter
+    def bedtime(self, value: time):
+        self.bedtime_min = to_minutes(value)
+
+    @property
+    def wakeup(self) -> time:
+        return from_minutes(self.wakeup_min)
+
+    @wakeup.setter
+    def wakeup(self, value: time):
+        self.wakeup_min = to_minutes(value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, LogEntry):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __repr__(self) -> str:
+        return (
+            f"LogEntry(date={self.date!r}, bedtime={self.bedtime!r}, "
+            f"wakeup={self.wakeup!r}, onset={self.onset!r}, awake={self.awake!r}, "
+            f"tib={self.tib!r}, tst={self.tst!r}, se={self.se!r})"
+        )
 
     def to_csv_row(self) -> str:
         """Serialize to a single CSV row (no header)."""
@@ -69,8 +182,8 @@ class LogEntry:
                 str,
                 [
                     self.date.isoformat(),
-                    self.bedtime.strftime("%H:%M"),
-                    self.wakeup.strftime("%H:%M"),
+                    format_hhmm(self.bedtime_min),
+                    format_hhmm(self.wakeup_min),
                     self.onset,
                     self.awake,
                     self.tib,
@@ -83,17 +196,211 @@ class LogEntry:
     @property
     def compute_metrics(self) -> None:
         """Compute tib, tst, se based on bedtime, wakeup, onset, awake."""
-        bt = datetime.combine(self.date, self.bedtime)
-        wt = datetime.combine(self.date, self.wakeup)
-        if wt <= bt:  # handle crossing midnight
-            bt -= timedelta(days=1)
-        self.tib = int((wt - bt).total_seconds() // 60)  # time in bed (minutes)
+        self.tib = span(self.bedtime_min, self.wakeup_min)  # handles crossing midnight
         self.tst = self.tib - (self.onset + self.awake)  # total sleep time
         self.se = (
             int((self.tst / self.tib) * 100) if self.tib > 0 else 0
         )  # sleep efficiency %
 
 
-plan = SleepPlan(tib=402, wake_time=datetime.strptime("06:45", "%H:%M").time())
-plan.update_bedtime
-print(plan.bedtime)
+@dataclass
+class LogMeta:
+    n_entries: int = 0  # number of entries in the log
+    last_date: Optional[date] = None  # date of the most recent entry
+
+    def to_dict(self) -> dict:
+        return {
+            "n_entries": self.n_entries,
+            "last_date": self.last_date.isoformat() if self.last_date else None,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "LogMeta":
+        last_date = data.get("last_date")
+        return LogMeta(
+            n_entries=int(data["n_entries"]),
+            last_date=date.fromisoformat(last_date) if last_date else None,
+        )
+
+
+@dataclass
+class LogWindow:
+    """
+    A user's most recent nights of TST and SE (oldest first, None where missing),
+    with a running sum and count per rolling window, updated on every append.
+    """
+
+    tst: list = field(default_factory=list)
+    se: list = field(default_factory=list)
+    # column -> {window: total}, only over nights with a value
+    sums: dict = field(default_factory=dict)
+    counts: dict = field(default_factory=dict)
+
+    COLUMNS = ("tst", "se")
+
+    def __post_init__(self):
+        if set(self.sums.get("tst", ())) != set(ROLLING_WINDOWS):
+            # New window, or windows changed in the config: recount from the values
+            values = {c: getattr(self, c) for c in self.COLUMNS}
+            self.tst, self.se = [], []
+            self.sums = {c: dict.fromkeys(ROLLING_WINDOWS, 0) for c in self.COLUMNS}
+            self.counts = {c: dict.fromkeys(ROLLING_WINDOWS, 0) for c in self.COLUMNS}
+            for tst, se in zip(values["tst"], values["se"]):
+                self.push(tst, se)
+
+    def push(self, tst: Optional[int], se: Optional[int]):
+        """Add the newest night, dropping nights that fall out of each window."""
+        for col, value in (("tst", tst), ("se", se)):
+            values = getattr(self, col)
+            values.append(value)
+            for w in ROLLING_WINDOWS:
+                if value is not None:
+                    self.sums[col][w] += value
+                    self.counts[col][w] += 1
+                if len(values) > w and values[-w - 1] is not None:
+                    self.sums[col][w] -= values[-w - 1]
+                    self.counts[col][w] -= 1
+            del values[: -ROLLING_WINDOWS[-1]]
+
+    def last(self, col: str, n: int) -> list:
+        """The last n nights of a column (fewer if the log is shorter)."""
+        return getattr(self, col)[-n:] if n > 0 else []
+
+    def mean(self, col: str, window: int) -> float:
+        """Average over the last `window` nights, skipping missing values (NaN if none)."""
+        count = self.counts[col][window]
+        return self.sums[col][window] / count if count else float("nan")
+
+    def to_dict(self) -> dict:
+        return {
+            "tst": self.tst,
+            "se": self.se,
+            # JSON object keys are strings
+            "sums": {
+                c: {str(w): v for w, v in s.items()} for c, s in self.sums.items()
+            },
+            "counts": {
+                c: {str(w): v for w, v in n.items()} for c, n in self.counts.items()
+            },
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "LogWindow":
+        return LogWindow(
+            tst=list(data["tst"]),
+            se=list(data["se"]),
+            sums={
+                c: {int(w): v for w, v in s.items()} for c, s in data["sums"].items()
+            },
+            counts={
+                c: {int(w): v for w, v in n.items()} for c, n in data["counts"].items()
+            },
+        )
+
+
+def week_start(d: date) -> date:
+    """Monday of the week d falls in."""
+    return d - timedelta(days=d.weekday())
+
+
+def effective_date(saved: date) -> date:
+    """
+    First night a plan saved on the day saved applies to: nights are logged
+    the morning after, so a plan made while logging on the 18th is first
+    followed the night logged on the 19th.
+    """
+    return saved + timedelta(days=1)
+
+
+def _mean(values: list) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _median(values: list) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return float(statistics.median(values)) if values else None
+
+
+# Report figures of a week, as returned by WeekSummary.row() after "week"
+WEEK_COLUMNS = (
+    "nights",
+    "tst_mean",
+    "tst_median",
+    "se_mean",
+    "se_median",
+    "tib_mean",
+    "bedtime_adherence",
+    "wake_adherence",
+)
+
+
+@dataclass
+class WeekSummary:
+    """
+    One user's week (Monday to Sunday) of logged nights, updated as entries
+    arrive. Keeps the week's values so medians stay exact.
+    """
+
+    week: date
+    tst: list = field(default_factory=list)  # per night, None where missing
+    se: list = field(default_factory=list)
+    tib: list = field(default_factory=list)
+    planned: int = 0  # nights logged while a plan was set
+    bedtime_on_plan: int = 0  # ... of which bedtime was within ADHERENCE_TOLERANCE
+    wake_on_plan: int = 0  # ... of which wake-up was within ADHERENCE_TOLERANCE
+
+    def push(self, entry: LogEntry, plan: Optional[SleepPlan]):
+        self.tst.append(entry.tst)
+        self.se.append(entry.se)
+        self.tib.append(entry.tib)
+        if plan is not None and plan.tib:
+            self.planned += 1
+            self.bedtime_on_plan += (
+                distance(entry.bedtime_min, plan.bedtime_min) <= ADHERENCE_TOLERANCE
+            )
+            self.wake_on_plan += (
+                distance(entry.wakeup_min, plan.wake_time_min) <= ADHERENCE_TOLERANCE
+            )
+
+    def extend(self, other: "WeekSummary"):
+        """Fold in nights of the same week summarized separately."""
+        self.tst += other.tst
+        self.se += other.se
+        self.tib += other.tib
+        self.planned += other.planned
+        self.bedtime_on_plan += other.bedtime_on_plan
+        self.wake_on_plan += other.wake_on_plan
+
+    def row(self) -> dict:
+        """The week's report figures (None where there's nothing to average)."""
+        return {
+            "week": self.week,
+            "nights": len(self.tst),
+            "tst_mean": _mean(self.tst),
+            "tst_median": _median(self.tst),
+            "se_mean": _mean(self.se),
+            "se_median": _median(self.se),
+            "tib_mean": _mean(self.tib),
+            "bedtime_adherence": (
+                self.bedtime_on_plan / self.planned if self.planned else None
+            ),
+            "wake_adherence": (
+                self.wake_on_plan / self.planned if self.planned else None
+            ),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "week": self.week.isoformat(),
+            "tst": self.tst,
+            "se": self.se,
+            "tib": self.tib,
+            "planned": self.planned,
+            "bedtime_on_plan": self.bedtime_on_plan,
+            "wake_on_plan": self.wake_on_plan,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "WeekSummary":
+        return WeekSummary(**{**data, "week": date.fromisoformat(data["week"])})
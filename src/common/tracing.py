@@ -0,0 +1,280 @@
+import argparse
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from src.common.config import TRACE_CHATS, TRACE_DIR, TRACE_PROFILE
+
+
+# Span traces of single /log conversations, for chats listed in TRACE_CHATS.
+# Each conversation is written to TRACE_DIR as Chrome-trace JSON (load it in
+# chrome://tracing or https://ui.perfetto.dev), optionally with cProfile stats.
+# With no chat listed, the decorators return the function unchanged.
+#
+# The active trace travels in a ContextVar: across awaits within a handler, and
+# into I/O threads via async_facade.run_io. Plan computation in a worker process
+# shows up as one span around the round trip.
+#
+# Profiles cover the synchronous calls (the traced storage, parse and compute
+# functions) only. A handler span encloses awaits, during which the event loop
+# runs other chats' handlers, so profiling it would mix them in.
+
+ENABLED = bool(TRACE_CHATS)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("shuteye_trace", default=None)
+_traces = {}  # chat id -> Trace of the conversation in progress
+_profiling = threading.local()  # one cProfile per thread at a time
+_NULL = nullcontext()
+
+
+class Trace:
+    """Spans (Chrome "complete" events) recorded for one chat's conversation."""
+
+    def __init__(self, chat_id: int, profile: bool = TRACE_PROFILE):
+        self.chat_id = chat_id
+        self.started = datetime.now()
+        self.origin = time.perf_counter()
+        self.profile = profile
+        self.events = []
+        self.profiles = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, cat: str, start: float, end: float, args: dict):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def write(self, directory: str = TRACE_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(
+            directory, f"trace-{self.chat_id}-{self.started:%Y%m%d-%H%M%S-%f}"
+        )
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in self.threads.items()
+        ]
+        other = {"chat_id": self.chat_id, "started": self.started.isoformat()}
+        if self.profiles:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(stem + ".prof")
+            other["profile"] = stem + ".prof"
+            other["profile_top"] = _top_functions(stats)
+        with open(stem + ".json", "w") as f:
+            json.dump(
+                {
+                    "traceEvents": metadata + self.events,
+                    "displayTimeUnit": "ms",
+                    "otherData": other,
+                },
+                f,
+            )
+        return stem + ".json"
+
+
+def _top_functions(stats: pstats.Stats, n: int = 25) -> list:
+    rows = []
+    for (path, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append(
+            {
+                "function": f"{func} ({os.path.basename(path)}:{line})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+            }
+        )
+    return sorted(rows, key=lambda r: r["tottime_ms"], reverse=True)[:n]
+
+
+@contextmanager
+def _span(trace: Trace, name: str, cat: str, args: dict, profile: bool = False):
+    profiler = None
+    if profile and trace.profile and not getattr(_profiling, "active", False):
+        # Outermost profiled call on this thread: profile everything under it
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            _profiling.active = True
+        except ValueError:
+            # Python 3.12+ allows one profiler at a time across all threads
+            profiler = None
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        if profiler is not None:
+            profiler.disable()
+            _profiling.active = False
+            with trace._lock:
+                trace.profiles.append(profiler)
+        trace.add(name, cat, start, end, args)
+
+
+def span(name: str, cat: str = "app", **args):
+    """Context manager recording a span if this call belongs to a traced conversation."""
+    trace = _current.get()
+    return _NULL if trace is None else _span(trace, name, cat, args)
+
+
+def traced(cat: str):
+    """Decorator: record every call of fn made inside a traced conversation."""
+
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            # fn runs start to finish on this thread, so it alone is profiled
+            with _span(trace, fn.__name__, cat, {}, profile=True):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def conversation_step(state_names: dict, start: bool = False):
+    """
+    Decorator for async conversation handlers of traced chats: start a trace
+    (start=True, the entry point), record the step, and write the trace out
+    when the conversation ends.
+    """
+
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(update, context, *args, **kwargs):
+            chat_id = update.effective_chat.id
+            if chat_id not in TRACE_CHATS:
+                return await fn(update, context, *args, **kwargs)
+
+            trace = _traces.get(chat_id)
+            if start or trace is None:
+                if trace is not None:
+                    print(f"Trace written: {trace.write()} (conversation not finished)")
+                trace = _traces[chat_id] = Trace(chat_id)
+
+            token = _current.set(trace)
+            result = None
+            try:
+                with _span(trace, fn.__name__, "handler", {}) as span_args:
+                    result = await fn(update, context, *args, **kwargs)
+                    span_args["next_state"] = state_names.get(result, str(result))
+                return result
+            finally:
+                _current.reset(token)
+                if state_names.get(result) == "END":
+                    del _traces[chat_id]
+                    print(f"Trace written: {trace.write()}")
+
+        return wrapper
+
+    return decorate
+
+
+def summarize(path: str, top: int = 15) -> str:
+    """Total and self time per span name in a trace file, plus the top profiled functions."""
+    with open(path) as f:
+        data = json.load(f)
+    events = [e for e in data["traceEvents"] if e.get("ph") == "X"]
+
+    # Self time: a span's duration minus its direct children on the same thread
+    by_thread = defaultdict(list)
+    for e in events:
+        by_thread[e["tid"]].append(e)
+    self_time = {id(e): e["dur"] for e in events}
+    for thread_events in by_thread.values():
+        stack = []
+        for e in sorted(thread_events, key=lambda e: (e["ts"], -e["dur"])):
+            while stack and stack[-1]["ts"] + stack[-1]["dur"] <= e["ts"]:
+                stack.pop()
+            if stack:
+                self_time[id(stack[-1])] -= e["dur"]
+            stack.append(e)
+
+    totals = defaultdict(lambda: [0, 0.0, 0.0])  # (cat, name) -> calls, total, self
+    for e in events:
+        t = totals[(e["cat"], e["name"])]
+        t[0] += 1
+        t[1] += e["dur"]
+        t[2] += self_time[id(e)]
+    wall = max((e["ts"] + e["dur"] for e in events), default=0) - min(
+        (e["ts"] for e in events), default=0
+    )
+
+    out = io.StringIO()
+    other = data.get("otherData", {})
+    out.write(f"chat {other.get('chat_id')}  started {other.get('started')}  ")
+    out.write(f"wall {wall / 1000:.2f} ms  spans {len(events)}\n\n")
+    out.write(
+        f"{'span':<45} {'cat':<9} {'calls':>5} {'total ms':>10} {'self ms':>10}\n"
+    )
+    rows = sorted(totals.items(), key=lambda kv: kv[1][2], reverse=True)
+    for (cat, name), (calls, total, own) in rows[:top]:
+        out.write(
+            f"{name:<45} {cat:<9} {calls:>5} {total / 1000:>10.2f} {own / 1000:>10.2f}\n"
+        )
+
+    if other.get("profile_top"):
+        out.write(
+            f"\n{'function':<60} {'calls':>7} {'tottime ms':>11} {'cumtime ms':>11}\n"
+        )
+        for r in other["profile_top"][:top]:
+            out.write(
+                f"{r['function'][:60]:<60} {r['calls']:>7} "
+                f"{r['tottime_ms']:>11.2f} {r['cumtime_ms']:>11.2f}\n"
+            )
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize conversation traces.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summarize", help="top costs in one or more trace files")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        print(f"== {path}")
+        print(summarize(path, args.top))
+
+
+if __name__ == "__main__":
+    main()
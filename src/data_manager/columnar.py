@@ -0,0 +1,188 @@
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.common.minutes import hhmm_table, time_table
+from src.data_manager.log_utils import cols
+
+
+# One .npy file per log column inside a directory, so every column can be
+# memory-mapped on its own: dates as days since 1970-01-01, clock times as
+# minutes after midnight, durations in minutes and SE in percent.
+DTYPES = {
+    "date": np.int32,
+    "bedtime": np.int16,
+    "wakeup": np.int16,
+    "onset": np.int16,
+    "awake": np.int16,
+    "tib": np.int16,
+    "tst": np.int16,
+    "se": np.int16,
+}
+
+# Stored in place of missing or unparsable values
+MISSING = {c: np.iinfo(dtype).min for c, dtype in DTYPES.items()}
+
+CSV_CHUNK_ROWS = 1_000_000
+
+
+def _count_rows(csv_path: str) -> int:
+    with open(csv_path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _encode_chunk(df: pd.DataFrame) -> dict:
+    """
+    Raw CSV columns → integer arrays, with MISSING for anything unparsable or
+    out of the column's range.
+    """
+    out = {}
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    days = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    out["date"] = np.where(dates.isna(), MISSING["date"], days)
+
+    for c in ("bedtime", "wakeup"):
+        t = pd.to_datetime(df[c], format="%H:%M", errors="coerce")
+        minutes = (t.dt.hour * 60 + t.dt.minute).to_numpy(dtype=float, na_value=np.nan)
+        out[c] = np.where(np.isnan(minutes), MISSING[c], minutes)
+
+    for c in ("onset", "awake", "tib", "tst", "se"):
+        values = pd.to_numeric(df[c], errors="coerce").to_numpy(
+            dtype=float, na_value=np.nan
+        )
+        out[c] = np.where(np.isnan(values), MISSING[c], values)
+
+    # Values the column's type can't hold (e.g. awake=40000) would wrap around
+    # in the cast; they are stored as missing instead. The type's minimum is
+    # MISSING itself, so it is taken as out of range too
+    encoded = {}
+    for c, v in out.items():
+        info = np.iinfo(DTYPES[c])
+        in_range = (v > info.min) & (v <= info.max)
+        encoded[c] = np.where(in_range, v, MISSING[c]).astype(DTYPES[c])
+    return encoded
+
+
+def csv_to_columnar(csv_path: str, out_dir: str):
+    """
+    Convert a log CSV to the columnar layout.
+    The CSV is streamed in chunks, so memory stays bounded for any log length.
+    """
+    n_rows = _count_rows(csv_path)
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    arrays = {
+        c: np.lib.format.open_memmap(
+            os.path.join(tmp_dir, f"{c}.npy"),
+            mode="w+",
+            dtype=DTYPES[c],
+            shape=(n_rows,),
+        )
+        for c in cols
+    }
+    offset = 0
+    if n_rows:
+        chunks = pd.read_csv(
+            csv_path, header=None, names=cols, dtype=str, chunksize=CSV_CHUNK_ROWS
+        )
+        for chunk in chunks:
+            for c, values in _encode_chunk(chunk).items():
+                arrays[c][offset : offset + len(chunk)] = values
+            offset += len(chunk)
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    # Swap in the finished directory so readers never see a half-written log
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+
+
+def load_log_columns(path: str) -> dict:
+    """Memory-map every column of a columnar log, without parsing or copying."""
+    return {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in cols}
+
+
+def read_log_columnar(path: str) -> pd.DataFrame:
+    """Read a columnar log into the same typed frame read_log_csv returns."""
+    columns = load_log_columns(path)
+    data = {}
+
+    days = np.asarray(columns["date"])
+    missing = days == MISSING["date"]
+    dates = days.astype("datetime64[D]").astype(object)
+    dates[missing] = pd.NaT
+    data["date"] = dates
+
+    for c in ("bedtime", "wakeup"):
+        minutes = np.asarray(columns[c])
+        missing = minutes == MISSING[c]
+        times = time_table()[np.where(missing, 0, minutes)]
+        times[missing] = pd.NaT
+        data[c] = times
+
+    for c in ("onset", "awake", "tib", "tst", "se"):
+        values = np.asarray(columns[c])
+        data[c] = pd.arrays.IntegerArray(values.astype(np.int64), values == MISSING[c])
+
+    return pd.DataFrame(data, columns=cols)
+
+
+def columnar_to_csv(path: str, csv_path: str):
+    """Convert a columnar log back to the log.csv format (no header, no trailing newline)."""
+    columns = load_log_columns(path)
+    n_rows = len(columns["date"])
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for start in range(0, n_rows, CSV_CHUNK_ROWS):
+            end = min(start + CSV_CHUNK_ROWS, n_rows)
+            text = {}
+
+            days = np.asarray(columns["date"][start:end])
+            text["date"] = np.where(
+                days == MISSING["date"], "", days.astype("datetime64[D]").astype(str)
+            )
+            for c in ("bedtime", "wakeup"):
+                minutes = np.asarray(columns[c][start:end])
+                text[c] = np.where(
+                    minutes == MISSING[c],
+                    "",
+                    hhmm_table()[np.where(minutes < 0, 0, minutes)],
+                )
+            for c in ("onset", "awake", "tib", "tst", "se"):
+                values = np.asarray(columns[c][start:end])
+                text[c] = np.where(values == MISSING[c], "", values.astype(str))
+
+            chunk = pd.DataFrame(text, columns=cols).to_csv(
+                header=False, index=False, lineterminator="\n"
+            )
+            f.write(("\n" if start else "") + chunk.rstrip("\n"))
+    os.replace(tmp_path, csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert sleep logs between log.csv and the columnar layout."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    to_col = sub.add_parser("to-columnar", help="log CSV → columnar directory")
+    to_col.add_argument("csv_path")
+    to_col.add_argument("out_dir")
+    to_csv = sub.add_parser("to-csv", help="columnar directory → log CSV")
+    to_csv.add_argument("path")
+    to_csv.add_argument("csv_path")
+    args = parser.parse_args()
+
+    if args.command == "to-columnar":
+        csv_to_columnar(args.csv_path, args.out_dir)
+    else:
+        columnar_to_csv(args.path, args.csv_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import argparse
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.common.minutes import hhmm_table, span
+from src.data_manager import storage
+from src.data_manager.log_utils import cols
+
+
+# Bulk import of sleep histories exported from wearables or spreadsheets.
+# The input is streamed in chunks of CHUNK_ROWS rows. Each chunk is mapped to
+# the log columns, its TIB/TST/SE computed with array arithmetic (bedtimes
+# before midnight included), bad rows set aside with a reason, nights that are
+# already logged or repeated dropped, and the rest appended to the store in
+# one write. Memory depends on the chunk size, not on the size of the input.
+
+CHUNK_ROWS = 100_000
+
+# Accepted input column names per field, compared lower-case with runs of
+# anything but letters and digits replaced by "_"
+ALIASES = {
+    "chat_id": ("chat_id", "chat", "user_id"),
+    "date": ("date", "day", "night", "sleep_date"),
+    "bedtime": ("bedtime", "bed_time", "in_bed", "went_to_bed", "start"),
+    "wakeup": ("wakeup", "wake_up", "wake_time", "wake", "out_of_bed", "end"),
+    "onset": ("onset", "sleep_onset", "latency", "sleep_latency"),
+    "awake": ("awake", "minutes_awake", "waso", "awakenings"),
+}
+REQUIRED = ("date", "bedtime", "wakeup")
+
+# HH:MM, optionally with seconds and after a date ("2024-03-01 23:10:00")
+_CLOCK = re.compile(r"(\d{1,2}):(\d{2})(?::\d{2}(?:\.\d*)?)?\s*$")
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0  # data rows read
+    imported: int = 0  # rows written to the log
+    rejected: Counter = field(default_factory=Counter)  # reason -> rows
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+
+def resolve_columns(header: list, overrides: Optional[dict] = None) -> dict:
+    """Map each field to the input column holding it; raises ValueError if one is missing."""
+    overrides = overrides or {}
+    by_name = {_normalize(name): name for name in header}
+    columns = {}
+    for name, aliases in ALIASES.items():
+        if name in overrides:
+            if overrides[name] not in header:
+                raise ValueError(f"no column {overrides[name]!r} for {name}")
+            columns[name] = overrides[name]
+            continue
+        source = next((by_name[a] for a in aliases if a in by_name), None)
+        if source is not None:
+            columns[name] = source
+    missing = [name for name in REQUIRED if name not in columns]
+    if missing:
+        raise ValueError(
+            f"no column for {', '.join(missing)} (found {', '.join(header)}); "
+            "name it with --column FIELD=COLUMN"
+        )
+    return columns
+
+
+def _clock(values: pd.Series) -> np.ndarray:
+    """Clock times → minutes after midnight (NaN if unparsable)."""
+    # Plain HH:MM parses in C; only the rest goes through the regex
+    t = pd.to_datetime(values, format="%H:%M", errors="coerce")
+    minutes = (t.dt.hour * 60 + t.dt.minute).to_numpy(dtype=float, na_value=np.nan)
+    other = np.isnan(minutes) & values.notna().to_numpy()
+    if other.any():
+        parts = values[other].str.extract(_CLOCK).astype(float)
+        hours, mins = parts[0].to_numpy(), parts[1].to_numpy()
+        parsed = hours * 60 + mins
+        parsed[(hours > 23) | (mins > 59)] = np.nan
+        minutes[other] = parsed
+    return minutes
+
+
+def _minutes(values: Optional[pd.Series], n: int) -> np.ndarray:
+    """Whole non-negative minutes (NaN if not); 0 for a column the input doesn't have."""
+    if values is None:
+        return np.zeros(n)
+    m = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+    m[(m < 0) | (m != np.floor(m))] = np.nan
+    return m
+
+
+def prepare(
+    chunk: pd.DataFrame,
+    columns: dict,
+    chat_id: Optional[int],
+    date_format: Optional[str] = None,
+    today: Optional[date] = None,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Map a chunk of input rows to log rows with their metrics computed.
+    Returns the rows (chat_id plus the log columns, formatted as the log
+    stores them) and each row's rejection reason (None for a valid row).
+    """
+    n = len(chunk)
+    today = today or date.today()
+    dates = pd.to_datetime(
+        chunk[columns["date"]], format=date_format or "ISO8601", errors="coerce"
+    )
+    bedtime = _clock(chunk[columns["bedtime"]])
+    wakeup = _clock(chunk[columns["wakeup"]])
+    onset = _minutes(chunk.get(columns.get("onset")), n)
+    awake = _minutes(chunk.get(columns.get("awake")), n)
+    if chat_id is None and "chat_id" in columns:
+        chat = pd.to_numeric(chunk[columns["chat_id"]], errors="coerce").to_numpy()
+    else:
+        chat = np.full(n, storage.chat_key(chat_id), dtype=float)
+
+    tib = span(np.nan_to_num(bedtime), np.nan_to_num(wakeup))
+    tst = tib - np.nan_to_num(onset) - np.nan_to_num(awake)
+
+    # The first rule a row breaks is its reason
+    reasons = np.full(n, None, dtype=object)
+    for reason, bad in (
+        ("bad chat_id", np.isnan(chat) | (chat != np.floor(chat))),
+        ("bad date", dates.isna().to_numpy()),
+        ("date in the future", (dates > pd.Timestamp(today)).to_numpy()),
+        ("bad bedtime", np.isnan(bedtime)),
+        ("bad wakeup", np.isnan(wakeup)),
+        ("bad onset", np.isnan(onset)),
+        ("bad awake", np.isnan(awake)),
+        ("onset + awake exceed time in bed", tst < 0),
+    ):
+        reasons[bad & (reasons == None)] = reason  # noqa: E711
+
+    valid = reasons == None  # noqa: E711
+    clocks = hhmm_table()
+    rows = pd.DataFrame(
+        {
+            "chat_id": np.nan_to_num(chat).astype(np.int64),
+            "date": np.datetime_as_string(
+                dates.to_numpy(dtype="datetime64[D]"), unit="D"
+            ).astype(object),
+            "bedtime": clocks[np.nan_to_num(bedtime).astype(np.int64)],
+            "wakeup": clocks[np.nan_to_num(wakeup).astype(np.int64)],
+            "onset": np.nan_to_num(onset).astype(np.int64),
+            "awake": np.nan_to_num(awake).astype(np.int64),
+            "tib": tib.astype(np.int64),
+            "tst": tst.astype(np.int64),
+            # Same float expression as LogEntry.compute_metrics' int(tst / tib * 100)
+            # (integer division would round e.g. 406/700 up to 58, not 57)
+            "se": np.where(valid, np.trunc(tst / tib * 100), 0).astype(np.int64),
+        },
+        index=chunk.index,
+    )
+
+    # Nights repeated within the chunk: the first valid one counts
+    repeated = np.zeros(n, dtype=bool)
+    repeated[valid] = rows[valid].duplicated(["chat_id", "date"]).to_numpy()
+    reasons[repeated] = "duplicate date"
+    return rows, reasons
+
+
+def _write_rejected(path: str, chunk: pd.DataFrame, reasons: np.ndarray, first: bool):
+    bad = reasons != None  # noqa: E711
+    rejected = chunk[bad].copy()
+    rejected.insert(0, "reason", reasons[bad])
+    rejected.insert(0, "row", rejected.index + 1)
+    rejected.to_csv(path, mode="w" if first else "a", header=first, index=False)
+
+
+def import_csv(
+    path: str,
+    store=None,
+    chat_id: Optional[int] = None,
+    columns: Optional[dict] = None,
+    header: bool = True,
+    date_format: Optional[str] = None,
+    chunk_rows: int = CHUNK_ROWS,
+    rejected_path: Optional[str] = None,
+) -> ImportResult:
+    """
+    Import a CSV file of nights into store (the configured one by default).
+    Input columns are matched to fields by name (see ALIASES; columns maps
+    fields to other names); without a header they are taken in log order.
+    chat_id, if given, is used for every row instead of a chat_id column.
+    Bad rows are counted by reason and, with rejected_path, written there
+    with their row number (1 = first data row).
+    """
+    store = store or storage.get_store()
+    if header:
+        names = pd.read_csv(path, nrows=0).columns.tolist()
+        mapping = resolve_columns(names, columns)
+        reader = pd.read_csv(
+            path,
+            usecols=sorted(set(mapping.values())),
+            dtype=str,
+            chunksize=chunk_rows,
+        )
+    else:
+        mapping = {name: name for name in cols[:5]}
+        reader = pd.read_csv(
+            path,
+            header=None,
+            names=cols,
+            usecols=cols[:5],
+            dtype=str,
+            chunksize=chunk_rows,
+        )
+    if isinstance(store, storage.CsvStore):
+        # A single log: every row belongs to it, whatever its chat
+        mapping.pop("chat_id", None)
+        chat_id = 0
+    elif chat_id is None and "chat_id" not in mapping:
+        try:
+            chat_id = storage.chat_key(None)
+        except KeyError:
+            raise ValueError(
+                "no chat for the rows: pass --chat-id, add a chat_id column "
+                "or set TELEGRAM_CHAT_ID"
+            ) from None
+
+    result = ImportResult()
+    chats = set()
+    for chunk in reader:
+        rows, reasons = prepare(chunk, mapping, chat_id, date_format)
+        valid = reasons == None  # noqa: E711
+        candidates = rows[valid]
+        logged = store.already_logged(candidates)
+        reasons[np.flatnonzero(valid)[logged]] = "date already logged"
+
+        new = candidates[~logged].sort_values(["chat_id", "date"], kind="stable")
+        store.import_rows(new)
+        chats.update(new["chat_id"].unique().tolist())
+
+        result.rows += len(chunk)
+        result.imported += len(new)
+        rejected = reasons != None  # noqa: E711
+        if rejected_path and rejected.any():
+            _write_rejected(rejected_path, chunk, reasons, first=not result.rejected)
+        result.rejected.update(reasons[rejected].tolist())
+    if chats:
+        store.finish_import(sorted(chats))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import a CSV export of past nights into the sleep log."
+    )
+    parser.add_argument("path", help="CSV file to import")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--db", help="SQLite store to import into")
+    target.add_argument("--log", help="log CSV to import into")
+    parser.add_argument("--plan", default=None, help="plan JSON of the log CSV")
+    parser.add_argument(
+        "--chat-id", type=int, default=None, help="chat of every row (SQLite only)"
+    )
+    parser.add_argument(
+        "--column",
+        action="append",
+        default=[],
+        metavar="FIELD=COLUMN",
+        help=f"input column holding a field ({', '.join(ALIASES)})",
+    )
+    parser.add_argument(
+        "--no-header",
+        action="store_true",
+        help="the input has no header; columns are in log order (a shuteye log)",
+    )
+    parser.add_argument(
+        "--date-format", help="strftime format of the dates (default ISO)"
+    )
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--rejected", help="write rejected rows and reasons here")
+    args = parser.parse_args()
+
+    columns = dict(c.split("=", 1) for c in args.column)
+    if args.db:
+        store = storage.SqliteStore(args.db)
+    elif args.log:
+        plan = args.plan or os.path.join(os.path.dirname(args.log), "plan.json")
+        store = storage.CsvStore(args.log, plan)
+    else:
+        store = storage.get_store()
+
+    try:
+        result = import_csv(
+            args.path,
+            store,
+            chat_id=args.chat_id,
+            columns=columns,
+            header=not args.no_header,
+            date_format=args.date_format,
+            chunk_rows=args.chunk_rows,
+            rejected_path=args.rejected,
+        )
+    except ValueError as e:
+        parser.exit(1, f"ImportError: {e}\n")
+    print(f"{result.imported} of {result.rows} rows imported")
+    for reason, n in result.rejected.most_common():
+        print(f"  {n} rejected: {reason}")
+    if args.rejected and result.rejected:
+        print(f"Rejected rows written to {args.rejected}")
+
+
+if __name__ == "__main__":
+    main()
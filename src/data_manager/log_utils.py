@@ -1,17 +1,39 @@
+import gzip
+import io
 import os
-import pandas as pd
+import threading
+from collections import Counter, OrderedDict
 from datetime import datetime, time
+from typing import TYPE_CHECKING, Optional
 
-from src.common.config import LOG_PATH, INIT_WINDOW, UPDATE_WINDOW
+from src.common.config import (
+    INIT_WINDOW,
+    LOG_CACHE_ROWS,
+    ROLLING_WINDOWS,
+    UPDATE_WINDOW,
+)
+from src.common import metrics, tracing
 from src.common.exceptions import EntrySaveError
-from src.common.models import LogEntry
+from src.common.models import LogEntry, LogMeta, LogWindow
+from src.data_manager import log_writer, storage
+
+# pandas is imported where a log is parsed: recording an entry or checking the
+# counters doesn't need it, which keeps the bot's startup fast
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 cols = ["date", "bedtime", "wakeup", "onset", "awake", "tib", "tst", "se"]
 
+# Bytes read per backwards step in read_log_tail (a row is ~40 bytes)
+TAIL_BLOCK_SIZE = 4096
+
+
+@tracing.traced("parse")
+def to_log_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Coerce raw log columns (as read from CSV or the database) to typed values."""
+    import pandas as pd
 
-def read_log_csv(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, header=None, names=cols)
     df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
     df["bedtime"] = pd.to_datetime(
         df["bedtime"], format="%H:%M", errors="coerce"
@@ -22,43 +44,238 @@ def read_log_csv(path: str) -> pd.DataFrame:
     return df
 
 
-def enough_data_for_first_plan() -> bool:
-    if not os.path.exists(LOG_PATH):
-        return False
-    df = read_log_csv(LOG_PATH)
-    return len(df) == INIT_WINDOW
+@metrics.timed
+@tracing.traced("parse")
+def parse_log_csv(source) -> "pd.DataFrame":
+    """Parse a log CSV (a path or a file object) into a typed frame."""
+    import pandas as pd
+
+    df = pd.read_csv(source, header=None, names=cols)
+    return to_log_frame(df)
+
+
+class _CachedLog:
+    __slots__ = ("ino", "size", "mtime_ns", "edge", "frame")
+
+    def __init__(self, stat: os.stat_result, edge: bytes, frame: "pd.DataFrame"):
+        self.ino = stat.st_ino
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.edge = edge  # the file's last bytes when parsed
+        self.frame = frame
+
+
+class LogCache:
+    """
+    Parsed log frames by path, reused while the file's (inode, size, mtime)
+    is unchanged. A file that only grew by appends (same inode, same bytes
+    before the old end, new bytes starting on a new line) has just the new
+    bytes parsed onto the cached frame. Gzipped files (sealed log segments)
+    are decompressed. The least recently read logs are dropped once the
+    frames hold more than max_rows rows in all.
+    """
+
+    def __init__(self, max_rows: int = LOG_CACHE_ROWS):
+        self.max_rows = max_rows
+        self.counts = Counter()  # lookups by result: hit, extend or miss
+        self.rows = 0
+        self._logs = OrderedDict()  # absolute path -> _CachedLog
+        self._lock = threading.Lock()
+        metrics.gauge("shuteye_log_cache_rows", lambda: self.rows)
+
+    def read(self, path: str) -> "pd.DataFrame":
+        """The parsed log at path; a copy, so callers may change it."""
+        import pandas as pd
+
+        key = os.path.abspath(path)
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            with self._lock:
+                cached = self._logs.get(key)
+            if cached is not None and cached.ino == stat.st_ino:
+                if (cached.size, cached.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    self._count("hit")
+                    self._keep(key, cached)
+                    return cached.frame.copy()
+                if stat.st_size > cached.size and not path.endswith(".gz"):
+                    f.seek(cached.size - len(cached.edge))
+                    data = f.read(stat.st_size - f.tell())
+                    new = data[len(cached.edge) :]
+                    if data.startswith(cached.edge) and (
+                        new.startswith(b"\n") or cached.edge.endswith(b"\n")
+                    ):
+                        frame = cached.frame
+                        if new.strip():
+                            frame = pd.concat(
+                                [frame, parse_log_csv(io.BytesIO(new))],
+                                ignore_index=True,
+                            )
+                        self._count("extend")
+                        self._keep(key, _CachedLog(stat, data[-_EDGE:], frame))
+                        return frame.copy()
+            # Not just appended to: parse it all again, from the start
+            f.seek(0)
+            data = f.read(stat.st_size)
+        if path.endswith(".gz"):
+            data = gzip.decompress(data)
+        frame = parse_log_csv(io.BytesIO(data))
+        self._count("miss")
+        self._keep(key, _CachedLog(stat, data[-_EDGE:], frame))
+        return frame.copy()
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+            self.rows = 0
+
+    def _count(self, result: str):
+        with self._lock:
+            self.counts[result] += 1
+        metrics.count("shuteye_log_cache_total", result=result)
+
+    def _keep(self, key: str, cached: _CachedLog):
+        with self._lock:
+            old = self._logs.pop(key, None)
+            if old is not None:
+                self.rows -= len(old.frame)
+            if len(cached.frame) > self.max_rows:
+                return  # would push out everything else
+            self._logs[key] = cached
+            self.rows += len(cached.frame)
+            while self.rows > self.max_rows:
+                _, evicted = self._logs.popitem(last=False)
+                self.rows -= len(evicted.frame)
+
+
+# Bytes kept from the end of a cached log to check that it was only appended to
+_EDGE = 64
+
+_log_cache = None
+_log_cache_lock = threading.Lock()
+
+
+def get_log_cache() -> LogCache:
+    global _log_cache
+    with _log_cache_lock:
+        if _log_cache is None:
+            _log_cache = LogCache()
+        return _log_cache
+
+
+def read_log_csv(path: str) -> "pd.DataFrame":
+    """Parse a log CSV, reusing the cached frame if the file is unchanged or only grew."""
+    if LOG_CACHE_ROWS <= 0:
+        # pandas decompresses .gz paths itself
+        return parse_log_csv(path)
+    return get_log_cache().read(path)
+
+
+@metrics.timed
+@tracing.traced("parse")
+def read_log_tail(path: str, n: int) -> "pd.DataFrame":
+    """
+    Parse only the last n records of a log CSV.
+    Reads the file backwards in blocks, so cost doesn't depend on the log length.
+    """
+    import pandas as pd
+
+    lines = []
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0 and len(lines) <= n:
+            step = min(TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            # Unless we reached the start, the first line may be cut mid-row
+            lines = [line for line in buf.split(b"\n") if line.strip()]
+
+    rows = [line.decode().strip().split(",") for line in lines[-n:]] if n > 0 else []
+    return to_log_frame(pd.DataFrame(rows, columns=cols))
+
+
+def to_log_window(df: "pd.DataFrame") -> LogWindow:
+    """Rolling window over the last nights of a typed log frame."""
+    import pandas as pd
+
+    df = df.tail(ROLLING_WINDOWS[-1])
+    return LogWindow(
+        tst=[None if v is pd.NA else int(v) for v in df["tst"]],
+        se=[None if v is pd.NA else int(v) for v in df["se"]],
+    )
+
+
+@metrics.timed
+@tracing.traced("storage")
+def read_log(chat_id: Optional[int] = None, n: Optional[int] = None) -> "pd.DataFrame":
+    """Read a user's log, or only its last n entries."""
+    return storage.get_store().read_log(chat_id, n)
+
+
+@tracing.traced("storage")
+def read_log_meta(chat_id: Optional[int] = None) -> LogMeta:
+    """Entry count and last entry date, maintained on every append (no log scan)."""
+    return storage.get_store().log_meta(chat_id)
+
+
+@tracing.traced("storage")
+def read_log_window(chat_id: Optional[int] = None) -> LogWindow:
+    """A user's last nights of TST and SE with rolling sums, maintained on every append."""
+    return storage.get_store().log_window(chat_id)
+
+
+def sleep_stats(chat_id: Optional[int] = None) -> dict:
+    """Average TST and SE over each of ROLLING_WINDOWS nights, without reading the log."""
+    window = read_log_window(chat_id)
+    return {
+        w: {
+            "nights": min(len(window.tst), w),
+            "avg_tst": window.mean("tst", w),
+            "avg_se": window.mean("se", w),
+        }
+        for w in ROLLING_WINDOWS
+    }
+
+
+def enough_data_for_first_plan(chat_id: Optional[int] = None) -> bool:
+    n = read_log_meta(chat_id).n_entries
+    return n == INIT_WINDOW
+
+
+def ready_for_new_plan(chat_id: Optional[int] = None) -> bool:
+    n = read_log_meta(chat_id).n_entries
+    return n > INIT_WINDOW and (n - INIT_WINDOW) % UPDATE_WINDOW == 0
+
+
+def new_entry(t_bed: time, t_wake: time, onset: int, awake: int) -> LogEntry:
+    """Build tonight's entry with its metrics computed."""
+    log_entry = LogEntry(
+        date=datetime.now().date(),
+        bedtime=t_bed,
+        wakeup=t_wake,
+        onset=onset,
+        awake=awake,
+    )
+    log_entry.compute_metrics
+    return log_entry
 
 
-def ready_for_new_plan() -> bool:
-    if not os.path.exists(LOG_PATH):
-        return False
-    df = read_log_csv(LOG_PATH)
-    return len(df) > INIT_WINDOW and (len(df) - INIT_WINDOW) % UPDATE_WINDOW == 0
+def entry_saved_message(log_entry: LogEntry) -> str:
+    hours, minutes = divmod(log_entry.tst, 60)
+    return f"✅ New entry added — you slept for {hours}h {minutes}m with an efficiency of {log_entry.se}%"
 
 
-def add_new_entry(t_bed: time, t_wake: time, onset: int, awake: int) -> str:
+@metrics.timed
+@tracing.traced("storage")
+def add_new_entry(
+    t_bed: time, t_wake: time, onset: int, awake: int, chat_id: Optional[int] = None
+) -> str:
     try:
-        log_entry = LogEntry(
-            date=datetime.now().date(),
-            bedtime=t_bed,
-            wakeup=t_wake,
-            onset=onset,
-            awake=awake,
-        )
-
-        log_entry.compute_metrics
-        new_row = log_entry.to_csv_row()
-
-        # Create file with header if not exists
-        if not os.path.exists(LOG_PATH):
-            with open(LOG_PATH, "w") as f:
-                f.write(new_row)
-        else:
-            with open(LOG_PATH, "a") as f:
-                f.write("\n" + new_row)
-
-        hours, minutes = divmod(log_entry.tst, 60)
-        return f"✅ New entry added — you slept for {hours}h {minutes}m with an efficiency of {log_entry.se}%"
+        log_entry = new_entry(t_bed, t_wake, onset, awake)
+        # Blocks until the writer has committed the batch holding this entry
+        log_writer.get_log_writer().submit(chat_id, log_entry).result()
+        return entry_saved_message(log_entry)
 
     except Exception as e:
         raise EntrySaveError(f"❌ Failed to save entry: {e}")
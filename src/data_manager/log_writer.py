@@ -0,0 +1,129 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from src.common import metrics
+from src.common.config import LOG_BATCH_LATENCY, LOG_BATCH_SIZE
+from src.common.models import LogEntry
+from src.data_manager import plan_repository, storage
+
+
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Single writer thread in front of a storage backend.
+    Entries submitted from any thread are group-committed: each batch is
+    appended and synced once, then every submitter's future is resolved.
+    """
+
+    def __init__(
+        self,
+        store,
+        batch_size: int = LOG_BATCH_SIZE,
+        max_latency: float = LOG_BATCH_LATENCY,
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="shuteye-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, chat_id: Optional[int], entry: LogEntry) -> Future:
+        """Queue an entry; the future resolves once it is durable (or fails)."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("log writer is closed")
+            self._queue.put((chat_id, entry, future))
+        return future
+
+    def close(self):
+        """Commit everything queued so far and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> tuple[list, bool]:
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_latency
+        while item is not _STOP:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _plans(self, batch: list) -> Optional[dict]:
+        """Plans in force for the batch's chats, for the weekly summaries."""
+        repository = plan_repository.get_plan_repository()
+        if repository.store is not self.store:
+            return None  # the store reads its own
+        return {
+            storage.chat_key(chat_id): repository.get(chat_id)
+            for chat_id in {chat_id for chat_id, _, _ in batch}
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if not batch:
+                continue
+            try:
+                with metrics.timer("append_entries"):
+                    self.store.append_entries(
+                        [(chat_id, entry) for chat_id, entry, _ in batch],
+                        self._plans(batch),
+                    )
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    future.set_result(None)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer() -> LogWriter:
+    """Return the process-wide log writer for the current storage backend."""
+    global _writer
+    store = storage.get_store()
+    with _writer_lock:
+        if _writer is None or _writer.store is not store:
+            if _writer is not None:
+                _writer.close()
+            _writer = LogWriter(store)
+        return _writer
+
+
+def close_log_writer():
+    """Commit queued entries and stop the writer (called on shutdown)."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+
+atexit.register(close_log_writer)
+metrics.queue_depth("log_writer", lambda: _writer._queue.qsize() if _writer else 0)
@@ -0,0 +1,121 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.common.minutes import parse_hhmm, time_table
+from src.common.models import SleepPlan
+
+
+# Plan history: every plan saved is kept with the date of the first night it
+# applies to (models.effective_date). The plan in force for a night is the
+# last one effective on or before the night's date.
+#
+# PlanHistory holds the plans of any number of chats as parallel arrays sorted
+# by (chat, effective date), so finding the plan of n nights among m plans is
+# one binary search each: O(n log m), vectorized.
+
+
+def _days(dates) -> np.ndarray:
+    """Dates (date objects, "YYYY-MM-DD" strings or datetime64) → days since 1970."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+class PlanHistory:
+    """Plans by chat and effective date, with as-of lookups by binary search."""
+
+    def __init__(
+        self,
+        chat: np.ndarray,
+        day: np.ndarray,
+        tib: np.ndarray,
+        bedtime: np.ndarray,
+        wake_time: np.ndarray,
+    ):
+        # Stable: plans saved for the same chat and date stay in save order,
+        # and the last of them wins
+        order = np.lexsort((day, chat))
+        self.chat = chat[order]
+        self.day = day[order]
+        self.tib = tib[order]
+        self.bedtime = bedtime[order]  # minutes after midnight
+        self.wake_time = wake_time[order]
+        self._chats = np.unique(self.chat)
+        # Chat rank * span + day sorts like (chat, day), so one searchsorted
+        # finds every (chat, night) pair at once
+        self._lo = int(self.day.min()) if len(self.day) else 0
+        self._span = int(self.day.max()) - self._lo + 2 if len(self.day) else 1
+        ranks = np.searchsorted(self._chats, self.chat)
+        self._keys = ranks * self._span + (self.day - self._lo)
+
+    @staticmethod
+    def from_rows(rows: Iterable[tuple]) -> "PlanHistory":
+        """From (chat_id, effective date, tib, bedtime "HH:MM", wake_time "HH:MM") in save order."""
+        rows = list(rows)
+        return PlanHistory(
+            np.array([r[0] for r in rows], dtype=np.int64),
+            _days([r[1] for r in rows]),
+            np.array([r[2] for r in rows], dtype=np.int64),
+            np.array([parse_hhmm(r[3]) for r in rows], dtype=np.int64),
+            np.array([parse_hhmm(r[4]) for r in rows], dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.chat)
+
+    def has(self, chat_ids) -> np.ndarray:
+        """Mask of the chat ids with at least one plan in the history."""
+        chat_ids = np.asarray(chat_ids, dtype=np.int64)
+        if not len(self._chats):
+            return np.zeros(len(chat_ids), dtype=bool)
+        at = np.minimum(np.searchsorted(self._chats, chat_ids), len(self._chats) - 1)
+        return self._chats[at] == chat_ids
+
+    def lookup(self, chat_ids, dates) -> np.ndarray:
+        """
+        Index of the plan in force for each (chat, night) pair, or -1 for a
+        night before the chat's first plan. chat_ids may be one id for all.
+        """
+        days = _days(dates)
+        chat_ids = np.broadcast_to(np.asarray(chat_ids, dtype=np.int64), days.shape)
+        if not len(self):
+            return np.full(len(days), -1, dtype=np.int64)
+        ranks = np.searchsorted(self._chats, chat_ids)
+        # Nights outside the history's range are clipped to its edges: before
+        # the first plan stays before it, after the last is still after it
+        offsets = np.clip(days, self._lo - 1, self._lo + self._span - 1) - self._lo
+        at = np.searchsorted(self._keys, ranks * self._span + offsets, side="right") - 1
+        found = self.has(chat_ids) & (at >= 0)
+        found[found] &= self.chat[at[found]] == chat_ids[found]
+        return np.where(found, at, -1)
+
+    def plan(self, i: int) -> SleepPlan:
+        return SleepPlan.from_minutes(
+            int(self.tib[i]), int(self.bedtime[i]), int(self.wake_time[i])
+        )
+
+    def as_of(self, day, chat_id: int = 0) -> Optional[SleepPlan]:
+        """The plan in force for the night logged on day, or None."""
+        i = self.lookup(chat_id, [day])[0]
+        return None if i < 0 else self.plan(i)
+
+    def join(self, log: pd.DataFrame, chat_id: int = 0) -> pd.DataFrame:
+        """
+        A copy of a chat's log (as read_log returns it) with the plan in force
+        each night: plan_tib, plan_bedtime and plan_wake_time (missing before
+        the first plan).
+        """
+        at = self.lookup(chat_id, log["date"].to_numpy(dtype="datetime64[D]"))
+        found = at >= 0
+        log = log.copy()
+        log["plan_tib"] = pd.Series(
+            np.where(found, self.tib[at], 0), index=log.index, dtype="Int64"
+        ).mask(~found)
+        for column, minutes in (
+            ("plan_bedtime", self.bedtime),
+            ("plan_wake_time", self.wake_time),
+        ):
+            times = time_table()[np.where(found, minutes[at], 0)]
+            times[~found] = None
+            log[column] = times
+        return log
@@ -0,0 +1,181 @@
+import atexit
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+from src.common import metrics
+from src.common.config import PLAN_CACHE_SIZE, PLAN_FLUSH_INTERVAL
+from src.common.models import SleepPlan, effective_date
+from src.data_manager import storage
+
+
+class PlanRepository:
+    """
+    In-process LRU cache of plans in front of a storage backend.
+    Saved plans are marked dirty and written back together, at most once per
+    flush interval, instead of one store round-trip per change. Every saved
+    plan is also appended to the store's plan history on the next flush, even
+    one replaced again before it. Only flushes write to the store: a dirty
+    plan pushed out of the LRU is kept aside until then.
+    """
+
+    def __init__(
+        self,
+        store,
+        capacity: int = PLAN_CACHE_SIZE,
+        flush_interval: float = PLAN_FLUSH_INTERVAL,
+    ):
+        self.store = store
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._plans = OrderedDict()  # chat key -> SleepPlan, least recently used first
+        # Dirty plans pushed out of the LRU, held until a flush writes them
+        self._evicted = {}
+        self._dirty = set()  # keys whose plan (cached or evicted) isn't written yet
+        self._history = []  # (chat key, effective date, plan) not yet appended
+        self._writes = 0  # plans written to the store so far
+        self._lock = threading.RLock()
+        # Only flush writes to the store, one flush at a time, so an older
+        # plan can never be written over a newer one
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def get(self, chat_id: Optional[int]) -> Optional[SleepPlan]:
+        key = storage.chat_key(chat_id)
+        while True:
+            with self._lock:
+                plan = self._cached(key)
+                if plan is not None:
+                    return plan.copy()
+                writes = self._writes
+
+            plan = self.store.load_plan(key)
+            with self._lock:
+                # A save may have raced the load; the cached (newer) plan wins
+                cached = self._cached(key)
+                if cached is not None:
+                    return cached.copy()
+                if self._writes != writes:
+                    # ... or have been saved, evicted and written meanwhile
+                    continue
+                if plan is None:
+                    return None
+                self._plans[key] = plan
+                self._evict()
+                return plan.copy()
+
+    def put(self, chat_id: Optional[int], plan: SleepPlan):
+        key = storage.chat_key(chat_id)
+        with self._lock:
+            self._evicted.pop(key, None)
+            self._plans[key] = plan.copy()
+            self._plans.move_to_end(key)
+            self._dirty.add(key)
+            self._history.append((key, effective_date(date.today()), plan.copy()))
+            self._evict()
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._start_flusher()
+
+    def flush(self):
+        """Append the saved plans to the history, then write every dirty plan to the store."""
+        with self._flush_lock:
+            with self._lock:
+                history, self._history = self._history, []
+                # Cached plans are replaced on save, never changed in place,
+                # so each snapshot entry is the exact object saved
+                dirty = [
+                    (key, self._plans.get(key) or self._evicted[key])
+                    for key in self._dirty
+                ]
+            try:
+                self.store.append_plan_history(history)
+            except Exception:
+                with self._lock:
+                    self._history[:0] = history
+                raise
+            for key, plan in dirty:
+                # A failed write leaves the rest dirty for the next flush to retry
+                self.store.save_plan(key, plan)
+                with self._lock:
+                    self._writes += 1
+                    # Clean now unless a newer plan was saved meanwhile
+                    if self._plans.get(key) is plan:
+                        self._dirty.discard(key)
+                    elif self._evicted.get(key) is plan:
+                        del self._evicted[key]
+                        self._dirty.discard(key)
+
+    def close(self):
+        """Stop the background flusher and write out pending plans."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _cached(self, key: int) -> Optional[SleepPlan]:
+        """The plan in memory for key, evicted but unwritten ones included (lock held)."""
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            return plan
+        return self._evicted.get(key)
+
+    def _evict(self):
+        while len(self._plans) > self.capacity:
+            key, plan = self._plans.popitem(last=False)
+            if key in self._dirty:
+                self._evicted[key] = plan
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None or self._stop.is_set():
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="shuteye-plan-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                metrics.count_error("PlanFlushError")
+                print(f"PlanFlushError: {e}")
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_plan_repository() -> PlanRepository:
+    """Return the process-wide plan repository for the current storage backend."""
+    global _repository
+    store = storage.get_store()
+    with _repository_lock:
+        if _repository is None or _repository.store is not store:
+            if _repository is not None:
+                _repository.close()
+            _repository = PlanRepository(store)
+        return _repository
+
+
+def close_plan_repository():
+    """Flush pending plans and stop the flusher (called on shutdown)."""
+    global _repository
+    with _repository_lock:
+        if _repository is not None:
+            _repository.close()
+            _repository = None
+
+
+atexit.register(close_plan_repository)
+metrics.queue_depth("plan_flush", lambda: len(_repository._dirty) if _repository else 0)
+metrics.queue_depth(
+    "plan_history", lambda: len(_repository._history) if _repository else 0
+)
@@ -1,9 +1,10 @@
-import os
-import json
 from datetime import time
+from numbers import Integral
+from typing import Optional
 
-from src.common.config import PLAN_PATH
+from src.common import metrics, tracing
 from src.common.models import SleepPlan
+from src.data_manager.plan_repository import get_plan_repository
 
 
 default_plan = SleepPlan(
@@ -13,29 +14,42 @@ default_plan = SleepPlan(
 )
 
 
-def load_plan(path: str = PLAN_PATH) -> SleepPlan:
-    if not os.path.exists(path):
-        save_plan(default_plan, path)
-        return default_plan
+def _check_chat(chat_id):
+    # These functions used to take a plan file path in this position
+    if chat_id is not None and not isinstance(chat_id, Integral):
+        raise TypeError(
+            f"chat_id must be an int or None, not {type(chat_id).__name__} "
+            "(plans are found by chat, not by file path)"
+        )
 
-    with open(path, "r") as f:
-        data = json.load(f)
 
-    return SleepPlan.from_dict(data)
+@metrics.timed
+@tracing.traced("storage")
+def load_plan(chat_id: Optional[int] = None) -> SleepPlan:
+    _check_chat(chat_id)
+    plan = get_plan_repository().get(chat_id)
+    if plan is None:
+        # Hand out a copy so callers can't mutate the shared default
+        plan = default_plan.copy()
+        save_plan(plan, chat_id)
+    return plan
 
 
-def save_plan(plan: SleepPlan, path: str = PLAN_PATH):
-    with open(path, "w") as f:
-        json.dump(plan.to_dict(), f, indent=4)
+@metrics.timed
+@tracing.traced("storage")
+def save_plan(plan: SleepPlan, chat_id: Optional[int] = None):
+    """Cache the plan; it's written to storage by the next flush (see plan_repository)."""
+    _check_chat(chat_id)
+    get_plan_repository().put(chat_id, plan)
 
 
-def update_wake_time(new_wake_time: time, path: str = PLAN_PATH):
-    plan = load_plan(path)
+def update_wake_time(new_wake_time: time, chat_id: Optional[int] = None):
+    plan = load_plan(chat_id)
     plan.wake_time = new_wake_time
-    save_plan(plan, path)
+    save_plan(plan, chat_id)
 
 
-def update_bedtime(new_bedtime: time, path: str = PLAN_PATH):
-    plan = load_plan(path)
+def update_bedtime(new_bedtime: time, chat_id: Optional[int] = None):
+    plan = load_plan(chat_id)
     plan.bedtime = new_bedtime
-    save_plan(plan, path)
+    save_plan(plan, chat_id)
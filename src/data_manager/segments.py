@@ -0,0 +1,560 @@
+import argparse
+import contextlib
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date
+from typing import TYPE_CHECKING, Optional
+
+from src.common.config import LOG_PATH, LOG_SEGMENT_BYTES, LOG_SEGMENTS
+from src.data_manager import log_utils, storage
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Log segments (CSV storage): the log at log_path is the active segment, the
+# only file ever appended to. Older nights are sealed into gzipped segments in
+# a directory next to it (log.csv.segments/), never changed again, and listed
+# oldest first in manifest.json with their row count, date range and the sum
+# and count of TST, SE and TIB. Recent nights are read from the active log
+# alone; stats over long ranges add up the manifest and only decompress the
+# segments the range cuts through.
+#
+# Sealing writes the segments, then the manifest with the size and digest of
+# the active log's sealed prefix as "pending", then cuts that prefix off the
+# active log and clears it. After a crash in between the cut is finished on
+# the next read of the manifest, if the active log still starts with it.
+#
+# Nights appended out of date order (a back-dated import) are put back in
+# order by reorder: the segments from the earliest of them on and the active
+# log are merged a line at a time into new segments and a new active log
+# (log.csv.merged). The manifest lists the new segments and the old ones to
+# "drop"; then the new active log replaces the old one and the old segments
+# are removed, which is finished on the next read after a crash.
+
+MANIFEST = "manifest.json"
+# Columns aggregated per segment in the manifest
+AGGREGATES = ("tst", "se", "tib")
+
+_UNSAFE = re.compile(r"[^0-9A-Za-z-]")
+
+
+@dataclass
+class Segment:
+    file: str  # name in the segments directory
+    rows: int
+    first_date: Optional[date]  # None if no row has a valid date
+    last_date: Optional[date]
+    sums: dict  # column -> sum of its values
+    counts: dict  # column -> rows with a value
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "rows": self.rows,
+            "first_date": self.first_date.isoformat() if self.first_date else None,
+            "last_date": self.last_date.isoformat() if self.last_date else None,
+            "sums": self.sums,
+            "counts": self.counts,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "Segment":
+        first, last = data.get("first_date"), data.get("last_date")
+        return Segment(
+            file=data["file"],
+            rows=int(data["rows"]),
+            first_date=date.fromisoformat(first) if first else None,
+            last_date=date.fromisoformat(last) if last else None,
+            sums=dict(data["sums"]),
+            counts=dict(data["counts"]),
+        )
+
+
+def segments_dir(log_path: str) -> str:
+    return log_path + ".segments"
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _lines(data: bytes) -> tuple[list[bytes], list[int]]:
+    """Non-empty lines of data, and the offset just past each one's newline."""
+    lines, ends, pos = [], [], 0
+    for line in data.split(b"\n"):
+        pos += len(line) + 1
+        if line.strip():
+            lines.append(line)
+            ends.append(min(pos, len(data)))
+    return lines, ends
+
+
+def _iter_lines(f, end: Optional[int] = None):
+    """Non-empty lines of f from where it is up to offset end, without newlines."""
+    pos = f.tell()
+    for line in f:
+        if end is not None and pos >= end:
+            break
+        pos += len(line)
+        line = line.rstrip(b"\n")
+        if line.strip():
+            yield line
+
+
+def _aggregate(names: list[str], groups: list[list[bytes]]) -> list["Segment"]:
+    """The segments holding groups of lines, parsed together in one frame."""
+    import pandas as pd
+
+    frame = log_utils.parse_log_csv(
+        io.BytesIO(b"\n".join(line for rows in groups for line in rows))
+    )
+    by = frame.assign(date=pd.to_datetime(frame["date"])).groupby(
+        [i for i, rows in enumerate(groups) for _ in rows]
+    )
+    first, last = by["date"].min(), by["date"].max()
+    sums, counts = by[list(AGGREGATES)].sum(), by[list(AGGREGATES)].count()
+    return [
+        Segment(
+            file=name,
+            rows=len(rows),
+            first_date=None if pd.isna(first[i]) else first[i].date(),
+            last_date=None if pd.isna(last[i]) else last[i].date(),
+            sums={c: int(sums.at[i, c]) for c in AGGREGATES},
+            counts={c: int(counts.at[i, c]) for c in AGGREGATES},
+        )
+        for i, (name, rows) in enumerate(zip(names, groups))
+    ]
+
+
+class SegmentedLog:
+    """
+    A log CSV and the segments sealed from it. policy is "monthly", "size"
+    (segments of up to max_bytes) or "off" (never sealed on append; an
+    existing segments directory is still read).
+    """
+
+    def __init__(
+        self,
+        log_path: str = LOG_PATH,
+        policy: str = LOG_SEGMENTS,
+        max_bytes: int = LOG_SEGMENT_BYTES,
+    ):
+        if policy not in ("off", "monthly", "size"):
+            raise ValueError(f"unknown log segment policy {policy!r}")
+        self.log_path = log_path
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.dir = segments_dir(log_path)
+        self.manifest_path = os.path.join(self.dir, MANIFEST)
+        # Held while sealing and while reading more than the active log, so a
+        # read never sees rows both sealed and still active
+        self._lock = threading.RLock()
+
+    # -- manifest ---------------------------------------------------------
+
+    def segments(self) -> list[Segment]:
+        """The sealed segments, oldest first."""
+        if not os.path.exists(self.manifest_path):
+            return []
+        with self._lock:
+            manifest = self._load()
+            if manifest.get("pending"):
+                self._finish_cut(manifest)
+            if manifest.get("drop") is not None:
+                self._finish_reorder(manifest)
+            return [Segment.from_dict(s) for s in manifest["segments"]]
+
+    def paths(self, segments: Optional[list[Segment]] = None) -> list[str]:
+        if segments is None:
+            segments = self.segments()
+        return [os.path.join(self.dir, s.file) for s in segments]
+
+    def _load(self) -> dict:
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def _save(self, manifest: dict):
+        _write_atomic(self.manifest_path, json.dumps(manifest, indent=1).encode())
+
+    def _finish_cut(self, manifest: dict):
+        """Cut the pending sealed prefix off the active log if it is still there."""
+        pending = manifest["pending"]
+        data = b""
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+        prefix = data[: pending["size"]]
+        if len(prefix) == pending["size"] and _digest(prefix) == pending["digest"]:
+            _write_atomic(self.log_path, data[pending["size"] :].lstrip(b"\n"))
+        manifest["pending"] = None
+        self._save(manifest)
+
+    def _finish_reorder(self, manifest: dict):
+        """Put the merged active log in place and remove the segments it replaced."""
+        if os.path.exists(self.log_path + ".merged"):
+            os.replace(self.log_path + ".merged", self.log_path)
+        for name in manifest["drop"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.dir, name))
+        manifest["drop"] = None
+        self._save(manifest)
+
+    # -- sealing ----------------------------------------------------------
+
+    def due(self, last_date: Optional[date], days: list[date], size: int = 0) -> bool:
+        """
+        Whether appending a batch of nights of days, size bytes in all, calls
+        for sealing: "monthly" if any of them is in another month than
+        last_date (the log's latest night), "size" if the batch takes the log
+        past max_bytes.
+        """
+        if self.policy == "monthly":
+            return last_date is not None and any(
+                (day.year, day.month) != (last_date.year, last_date.month)
+                for day in days
+            )
+        if self.policy == "size":
+            active = (
+                os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+            )
+            return active > 0 and active + size > self.max_bytes
+        return False
+
+    def _groups(self, lines: list[bytes]) -> list[tuple[str, list[bytes]]]:
+        """Lines split into segments: by month, or in runs of up to max_bytes."""
+        if self.policy == "size":
+            return list(self._runs(lines))
+        months = {}
+        for line in lines:
+            months.setdefault(line[:7].decode(errors="replace"), []).append(line)
+        return sorted(months.items())
+
+    def _runs(self, lines):
+        """
+        Lines in date order split into segments as they come: by month, or in
+        runs of up to max_bytes. Only the segment being filled is held.
+        """
+        key, rows, size = None, [], 0
+        for line in lines:
+            if self.policy == "size":
+                new = not rows or size + len(line) + 1 > self.max_bytes
+            else:
+                new = line[:7] != key
+            if new:
+                if rows:
+                    yield key.decode(errors="replace"), rows
+                key = line[:10] if self.policy == "size" else line[:7]
+                rows, size = [], 0
+            rows.append(line)
+            size += len(line) + 1
+        if rows:
+            yield key.decode(errors="replace"), rows
+
+    def _keep(self, lines: list[bytes]) -> int:
+        """Lines at the end of the log to leave active when compacting it."""
+        if not lines:
+            return 0
+        if self.policy == "size":
+            last = self._groups(lines)[-1][1]
+            full = sum(len(line) + 1 for line in last) >= self.max_bytes
+            return 0 if full else len(last)
+        month = lines[-1][:7]
+        kept = 0
+        while kept < len(lines) and lines[-kept - 1][:7] == month:
+            kept += 1
+        return kept
+
+    def seal(self, keep_last: bool = False) -> list[Segment]:
+        """
+        Seal the active log into new segments. keep_last leaves the rows of
+        its last month (or of its last, partly filled segment) active.
+        Returns the new segments.
+        """
+        with self._lock:
+            segments = self.segments()
+            if not os.path.exists(self.log_path):
+                return []
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+            lines, ends = _lines(data)
+            cut = len(lines) - (self._keep(lines) if keep_last else 0)
+            if cut <= 0:
+                return []
+
+            os.makedirs(self.dir, exist_ok=True)
+            seq = int(segments[-1].file.split("-", 1)[0]) if segments else 0
+            names, groups = [], []
+            for key, rows in self._groups(lines[:cut]):
+                seq += 1
+                names.append(f"{seq:05d}-{_UNSAFE.sub('_', key) or 'x'}.csv.gz")
+                groups.append(rows)
+                _write_atomic(
+                    os.path.join(self.dir, names[-1]),
+                    gzip.compress(b"\n".join(rows), mtime=0),
+                )
+            new = _aggregate(names, groups)
+
+            prefix = data[: ends[cut - 1]]
+            manifest = {
+                "segments": [s.to_dict() for s in segments + new],
+                "pending": {"size": len(prefix), "digest": _digest(prefix)},
+            }
+            self._save(manifest)
+            self._finish_cut(manifest)
+            return new
+
+    def reorder(self, since: date, starts: list[int]):
+        """
+        Put the log back in date order after nights back to since were
+        appended out of order. starts are the offsets in the active log where
+        each run of lines in date order after the first begins. The segments
+        from since on and the active log are merged a line at a time, then
+        sealed again as the policy says ("off" leaves them all active); the
+        segments before since are left as they are.
+        """
+        with self._lock:
+            segments = self.segments()
+            kept = 0
+            while (
+                kept < len(segments)
+                and segments[kept].last_date is not None
+                and segments[kept].last_date < since
+            ):
+                kept += 1
+            redo = segments[kept:]
+            seq = int(segments[-1].file.split("-", 1)[0]) if segments else 0
+            bounds = [0, *starts, os.path.getsize(self.log_path)]
+            merged_path = self.log_path + ".merged"
+            new, names = [], []
+
+            with contextlib.ExitStack() as stack:
+                runs = []
+                for path in self.paths(redo):
+                    runs.append(_iter_lines(stack.enter_context(gzip.open(path, "rb"))))
+                for start, end in zip(bounds, bounds[1:]):
+                    f = stack.enter_context(open(self.log_path, "rb"))
+                    f.seek(start)
+                    runs.append(_iter_lines(f, end))
+                lines = heapq.merge(*runs, key=lambda line: line[:10])
+
+                out = stack.enter_context(open(merged_path, "wb"))
+                groups = self._runs(lines) if self.policy != "off" else []
+                last = None
+                for key, rows in groups:
+                    if last is not None:
+                        new.append(self._write_segment(seq + len(new) + 1, *last))
+                    last = key, rows
+                if last is not None:
+                    full = sum(len(line) + 1 for line in last[1]) >= self.max_bytes
+                    if self.policy == "size" and full:
+                        new.append(self._write_segment(seq + len(new) + 1, *last))
+                    else:
+                        out.write(b"\n".join(last[1]))
+                if self.policy == "off":
+                    for i, line in enumerate(lines):
+                        out.write(b"\n" + line if i else line)
+                out.flush()
+                os.fsync(out.fileno())
+
+            if not segments and not new:
+                os.replace(merged_path, self.log_path)
+                return
+            os.makedirs(self.dir, exist_ok=True)
+            manifest = {
+                "segments": [s.to_dict() for s in segments[:kept] + new],
+                "pending": None,
+                "drop": [s.file for s in redo],
+            }
+            self._save(manifest)
+            self._finish_reorder(manifest)
+
+    def _write_segment(self, seq: int, key: str, rows: list[bytes]) -> Segment:
+        name = f"{seq:05d}-{_UNSAFE.sub('_', key) or 'x'}.csv.gz"
+        _write_atomic(
+            os.path.join(self.dir, name), gzip.compress(b"\n".join(rows), mtime=0)
+        )
+        return _aggregate([name], [rows])[0]
+
+    # -- reading ----------------------------------------------------------
+
+    def read(self) -> "pd.DataFrame":
+        """Every night, sealed then active, as read_log_csv returns them."""
+        import pandas as pd
+
+        with self._lock:
+            paths = self.paths()
+            if not paths:
+                return log_utils.read_log_csv(self.log_path)
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+                paths.append(self.log_path)
+            frames = [log_utils.read_log_csv(path) for path in paths]
+        return pd.concat(frames, ignore_index=True)
+
+    def tail(self, n: int) -> "pd.DataFrame":
+        """The last n nights; segments are read only if the active log has fewer."""
+        import pandas as pd
+
+        active = self._active_tail(n)
+        if len(active) >= n or not os.path.exists(self.manifest_path):
+            return active
+        with self._lock:
+            frames = [self._active_tail(n)]
+            have = len(frames[0])
+            for path in reversed(self.paths()):
+                if have >= n:
+                    break
+                frames.insert(0, log_utils.read_log_csv(path))
+                have += len(frames[0])
+        frames = [frame for frame in frames if len(frame)] or frames[-1:]
+        return pd.concat(frames, ignore_index=True).tail(n).reset_index(drop=True)
+
+    def _active_tail(self, n: int) -> "pd.DataFrame":
+        import pandas as pd
+
+        # No active log yet (fresh install) is an empty one
+        if not os.path.exists(self.log_path):
+            return log_utils.to_log_frame(pd.DataFrame([], columns=log_utils.cols))
+        return log_utils.read_log_tail(self.log_path, n)
+
+    def rows(self) -> int:
+        """Rows in the sealed segments."""
+        return sum(s.rows for s in self.segments())
+
+    def last_date(self) -> Optional[date]:
+        """Latest night in the sealed segments."""
+        dates = [s.last_date for s in self.segments() if s.last_date is not None]
+        return max(dates) if dates else None
+
+    def dates(self, lo: date, hi: date) -> list["pd.Series"]:
+        """
+        Dates logged (as "YYYY-MM-DD") in the active log and in the segments
+        whose range overlaps lo..hi.
+        """
+        import pandas as pd
+
+        with self._lock:
+            segments = self.segments()
+            paths = [
+                path
+                for segment, path in zip(segments, self.paths(segments))
+                if segment.first_date is None
+                or (segment.first_date <= hi and segment.last_date >= lo)
+            ]
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+                paths.append(self.log_path)
+            return [
+                pd.read_csv(path, header=None, usecols=[0], dtype=str).iloc[:, 0]
+                for path in paths
+            ]
+
+    def stats(self, since: Optional[date] = None, until: Optional[date] = None) -> dict:
+        """
+        Nights logged from since to until (inclusive, open-ended if None) and
+        their mean TST, SE and TIB (NaN if none). Segments wholly inside the
+        range are counted from the manifest; only the others that overlap it,
+        and the active log, are read.
+        """
+        lo, hi = since or date.min, until or date.max
+        nights, read = 0, 0
+        sums = dict.fromkeys(AGGREGATES, 0)
+        counts = dict.fromkeys(AGGREGATES, 0)
+        frames = []
+        with self._lock:
+            segments = self.segments()
+            for segment, path in zip(segments, self.paths(segments)):
+                if segment.first_date is not None and (
+                    segment.last_date < lo or segment.first_date > hi
+                ):
+                    continue
+                if segment.first_date is not None and (
+                    lo <= segment.first_date and segment.last_date <= hi
+                ):
+                    nights += segment.rows
+                    for c in AGGREGATES:
+                        sums[c] += segment.sums[c]
+                        counts[c] += segment.counts[c]
+                    continue
+                frames.append(log_utils.read_log_csv(path))
+                read += 1
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+                frames.append(log_utils.read_log_csv(self.log_path))
+        for frame in frames:
+            dates = frame["date"]
+            inside = dates.notna() & (dates >= lo) & (dates <= hi)
+            frame = frame[inside]
+            nights += len(frame)
+            for c in AGGREGATES:
+                sums[c] += int(frame[c].sum())
+                counts[c] += int(frame[c].count())
+        return {
+            "nights": nights,
+            **{
+                c: sums[c] / counts[c] if counts[c] else float("nan")
+                for c in AGGREGATES
+            },
+            "segments": len(segments),
+            "segments_read": read,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compact a log CSV into gzipped segments, or show stats from them."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact = sub.add_parser(
+        "compact", help="seal a log's complete months (or full segments)"
+    )
+    compact.add_argument("log", nargs="?", default=LOG_PATH)
+    compact.add_argument("--plan", default=None, help="plan JSON of the log")
+    compact.add_argument(
+        "--policy",
+        choices=("monthly", "size"),
+        default=LOG_SEGMENTS if LOG_SEGMENTS != "off" else "monthly",
+    )
+    compact.add_argument("--max-bytes", type=int, default=LOG_SEGMENT_BYTES)
+    stats = sub.add_parser("stats", help="nights and mean TST/SE/TIB over a range")
+    stats.add_argument("log", nargs="?", default=LOG_PATH)
+    stats.add_argument("--since", type=date.fromisoformat, default=None)
+    stats.add_argument("--until", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        plan = args.plan or os.path.join(os.path.dirname(args.log), "plan.json")
+        store = storage.CsvStore(args.log, plan)
+        store.segments = SegmentedLog(args.log, args.policy, args.max_bytes)
+        new = store.compact_log()
+        print(f"{sum(s.rows for s in new)} rows sealed into {len(new)} segments")
+        for segment in new:
+            print(
+                f"  {segment.file}: {segment.rows} rows, "
+                f"{segment.first_date} to {segment.last_date}"
+            )
+    else:
+        s = SegmentedLog(args.log, "off").stats(args.since, args.until)
+        print(
+            f"{s['nights']} nights: mean TST {s['tst']:.1f} min, SE {s['se']:.1f}%, "
+            f"TIB {s['tib']:.1f} min ({s['segments_read']} of {s['segments']} "
+            "segments read)"
+        )
+
+
+if __name__ == "__main__":
+    main()
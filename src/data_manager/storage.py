@@ -0,0 +1,973 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import date
+from typing import TYPE_CHECKING, Optional
+
+from src.common import config
+from src.common.config import (
+    DB_PATH,
+    LOG_PATH,
+    PLAN_PATH,
+    ROLLING_WINDOWS,
+    STORAGE_BACKEND,
+)
+from src.common.minutes import format_hhmm, parse_hhmm
+from src.common.models import (
+    LogEntry,
+    LogMeta,
+    LogWindow,
+    WEEK_COLUMNS,
+    SleepPlan,
+    WeekSummary,
+    week_start,
+)
+from src.data_manager import log_utils, segments
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from src.data_manager.plan_history import PlanHistory
+
+
+def chat_key(chat_id: Optional[int]) -> int:
+    """Resolve the chat a call refers to, defaulting to the configured CHAT_ID."""
+    return int(chat_id if chat_id is not None else config.CHAT_ID)
+
+
+def _last_line(path: str) -> Optional[bytes]:
+    """Last non-empty line of a file, read backwards from the end."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0:
+            step = min(log_utils.TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = [line for line in buf.split(b"\n") if line.strip()]
+            if len(lines) > 1 or (lines and pos == 0):
+                return lines[-1]
+    return None
+
+
+class CsvStore:
+    """
+    Single-user backend: one log CSV and one plan JSON.
+    The chat id is accepted for API compatibility but ignored.
+    """
+
+    def __init__(self, log_path: str = LOG_PATH, plan_path: str = PLAN_PATH):
+        self.log_path = log_path
+        self.plan_path = plan_path
+        # Entry count, last date and rolling window live next to the log,
+        # stamped with the log size
+        self.meta_path = log_path + ".meta.json"
+        # Weekly summaries: one JSON line per update of a week (the last line
+        # for a week wins), each stamped with the log size after the update
+        self.weeks_path = log_path + ".weeks.jsonl"
+        # Reminder subscription: {chat id: timezone}
+        self.reminders_path = os.path.join(os.path.dirname(plan_path), "reminders.json")
+        # Every plan saved, one JSON line each with its effective date
+        self.history_path = os.path.join(
+            os.path.dirname(plan_path), "plan_history.jsonl"
+        )
+        # log_path is the active segment; older nights may be sealed next to it
+        self.segments = segments.SegmentedLog(log_path)
+        # Set by import_rows until finish_import: the latest night so far, the
+        # earliest back-dated one and where each run of rows in date order
+        # after the first starts in the active log
+        self._import = None
+
+    def append_entry(self, chat_id: Optional[int], entry: LogEntry):
+        self.append_entries([(chat_id, entry)])
+
+    def append_entries(
+        self,
+        entries: list[tuple[Optional[int], LogEntry]],
+        plans: Optional[dict] = None,
+    ):
+        """
+        Append a batch of entries with one write and one fsync.
+        plans maps chat keys to the plan in force, for the weekly summaries;
+        without it the stored plan is read.
+        """
+        if not entries:
+            return
+        meta, window = self._read_meta()
+        weeks = self._weeks_to_update(entries)
+        rows = "\n".join(entry.to_csv_row() for _, entry in entries)
+        seal = self.segments.due(
+            meta.last_date, [entry.date for _, entry in entries], len(rows) + 1
+        )
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > 0:
+            rows = "\n" + rows
+        with open(self.log_path, "a") as f:
+            f.write(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        if seal:
+            # Everything before the batch's last month (or last, partly filled
+            # segment) is sealed. The sidecars don't change, only the size
+            # they are stamped with, which is taken when they are written below
+            self.segments.seal(keep_last=True)
+
+        meta.n_entries += len(entries)
+        meta.last_date = entries[-1][1].date
+        for _, entry in entries:
+            window.push(entry.tst, entry.se)
+        self._write_meta(meta, window)
+
+        if plans is not None:
+            plan = plans.get(chat_key(entries[0][0]))
+        else:
+            plan = self.load_plan(None)
+        restart = not weeks
+        touched = {}
+        for _, entry in entries:
+            week = week_start(entry.date)
+            touched[week] = weeks.setdefault(week, WeekSummary(week))
+            touched[week].push(entry, plan)
+        # Written in week order and ending with the latest week, so that the
+        # last line is always the latest week
+        updates = [touched[week] for week in sorted(touched)]
+        if max(weeks) not in touched:
+            updates.append(weeks[max(weeks)])
+        self._append_weeks(updates, restart)
+
+    def read_log(
+        self, chat_id: Optional[int], n: Optional[int] = None
+    ) -> "pd.DataFrame":
+        if n is not None:
+            return self.segments.tail(n)
+        return self.segments.read()
+
+    def log_meta(self, chat_id: Optional[int]) -> LogMeta:
+        return self._read_meta()[0]
+
+    def log_window(self, chat_id: Optional[int]) -> LogWindow:
+        return self._read_meta()[1]
+
+    def _read_meta(self) -> tuple[LogMeta, LogWindow]:
+        if not os.path.exists(self.log_path):
+            return LogMeta(), LogWindow()
+        try:
+            with open(self.meta_path, "r") as f:
+                data = json.load(f)
+            if data["size"] == os.path.getsize(self.log_path):
+                return LogMeta.from_dict(data), LogWindow.from_dict(data["window"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # Missing or stale (e.g. the log was edited by hand): rebuild it once
+        meta = self._scan_meta()
+        window = log_utils.to_log_window(self.segments.tail(ROLLING_WINDOWS[-1]))
+        self._write_meta(meta, window)
+        return meta, window
+
+    def _scan_meta(self) -> LogMeta:
+        meta = LogMeta(n_entries=self.segments.rows())
+        meta.last_date = self.segments.last_date()
+        last_row = None
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    meta.n_entries += 1
+                    last_row = line
+        if last_row is not None:
+            try:
+                meta.last_date = date.fromisoformat(last_row.split(b",")[0].decode())
+            except ValueError:
+                meta.last_date = None
+        return meta
+
+    def _write_meta(self, meta: LogMeta, window: LogWindow):
+        data = meta.to_dict()
+        data["window"] = window.to_dict()
+        data["size"] = os.path.getsize(self.log_path)
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def weekly_summaries(self, chat_id: Optional[int]) -> list[WeekSummary]:
+        return sorted(self._read_weeks().values(), key=lambda s: s.week)
+
+    def _weeks_fresh(self) -> bool:
+        try:
+            last = _last_line(self.weeks_path)
+            return last is not None and json.loads(last)["size"] == os.path.getsize(
+                self.log_path
+            )
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _weeks_to_update(self, entries: list) -> dict:
+        """
+        Current summaries of the latest week and of any earlier week an entry
+        is back-dated to, read before the log changes.
+        """
+        last_week = self._last_week()
+        if last_week is None:
+            return {}
+        weeks = {last_week.week: last_week}
+        if any(week_start(entry.date) < last_week.week for _, entry in entries):
+            weeks = self._read_weeks()
+        return weeks
+
+    def _last_week(self) -> Optional[WeekSummary]:
+        """The latest week, rebuilding the summaries if stale."""
+        if not os.path.exists(self.log_path):
+            return None
+        if not self._weeks_fresh():
+            self._rebuild_weeks()
+        data = json.loads(_last_line(self.weeks_path))
+        return WeekSummary.from_dict(data["summary"]) if "summary" in data else None
+
+    def _read_weeks(self) -> dict:
+        if not os.path.exists(self.log_path):
+            return {}
+        if not self._weeks_fresh():
+            return {s.week: s for s in self._rebuild_weeks()}
+        weeks = {}
+        with open(self.weeks_path, "r") as f:
+            for line in f:
+                data = json.loads(line) if line.strip() else {}
+                if "summary" in data:
+                    summary = WeekSummary.from_dict(data["summary"])
+                    weeks[summary.week] = summary
+        return weeks
+
+    def _rebuild_weeks(self) -> list[WeekSummary]:
+        # Missing or stale: recompute from the whole log and start a compact file.
+        # Adherence is measured against the plan in force each night (the
+        # current plan if the history is empty)
+        from src.processing import reports
+
+        summaries = reports.summarize_csv(
+            self.segments.paths() + [self.log_path],
+            self.load_plan(None),
+            self.plan_history(),
+        )
+        self._write_weeks(summaries)
+        return summaries
+
+    def _write_weeks(self, summaries: list[WeekSummary]):
+        size = os.path.getsize(self.log_path)
+        tmp_path = self.weeks_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"size": size}) + "\n")
+            for summary in summaries:
+                f.write(json.dumps({"size": size, "summary": summary.to_dict()}) + "\n")
+        os.replace(tmp_path, self.weeks_path)
+
+    def _append_weeks(self, summaries, restart: bool = False):
+        size = os.path.getsize(self.log_path)
+        lines = "".join(
+            json.dumps({"size": size, "summary": s.to_dict()}) + "\n" for s in summaries
+        )
+        # restart: the log was just created, drop whatever a previous log left
+        with open(self.weeks_path, "w" if restart else "a") as f:
+            f.write(lines)
+
+    def already_logged(self, rows: "pd.DataFrame") -> "np.ndarray":
+        """Mask of the rows (with a date column, as "YYYY-MM-DD") whose date is in the log."""
+        import pandas as pd
+
+        if not os.path.exists(self.log_path) or rows.empty:
+            return pd.Series(False, index=rows.index).to_numpy()
+        # Only segments whose dates overlap the rows' are read
+        logged = self.segments.dates(
+            date.fromisoformat(rows["date"].min()),
+            date.fromisoformat(rows["date"].max()),
+        )
+        if not logged:
+            return pd.Series(False, index=rows.index).to_numpy()
+        return rows["date"].isin(pd.concat(logged)).to_numpy()
+
+    def import_rows(self, rows: "pd.DataFrame"):
+        """
+        Bulk-append validated rows (the log columns, already formatted) with
+        one write and one fsync. The meta and weekly summaries are brought up
+        to date, and back-dated rows put in order, by finish_import.
+        """
+        if rows.empty:
+            return
+        if self._import is None:
+            last = self._read_meta()[0].last_date
+            self._import = {
+                "last": last.isoformat() if last else "",
+                "since": None,
+                "starts": [],
+            }
+        rows = rows.sort_values("date", kind="stable")
+        first = rows["date"].iloc[0]
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if first < self._import["last"]:
+            self._import["starts"].append(size)
+            self._import["since"] = min(self._import["since"] or first, first)
+        self._import["last"] = max(self._import["last"], rows["date"].iloc[-1])
+
+        text = rows[log_utils.cols].to_csv(
+            header=False, index=False, lineterminator="\n"
+        )
+        if size > 0:
+            text = "\n" + text
+        with open(self.log_path, "a") as f:
+            f.write(text.rstrip("\n"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish_import(self, chat_ids):
+        """
+        Put the log back in date order if the import was back-dated (before
+        the log's last night, or before an earlier chunk's), then rebuild the
+        sidecars.
+        """
+        imported, self._import = self._import, None
+        if not os.path.exists(self.log_path):
+            return
+        if imported is not None and imported["starts"]:
+            # Merged with the segments it reaches back into, never read whole
+            self.segments.reorder(
+                date.fromisoformat(imported["since"]), imported["starts"]
+            )
+        if self.segments.policy != "off":
+            # Imported months before the latest are sealed right away
+            self.segments.seal(keep_last=True)
+        # Stale sidecars are rebuilt from the log on the next read; do it now
+        for path in (self.meta_path, self.weeks_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._read_meta()
+        self._read_weeks()
+
+    def compact_log(self) -> list["segments.Segment"]:
+        """
+        Seal every month of the log but the latest (or every full segment)
+        into segments, e.g. a log kept in a single file so far. The sidecars
+        stay as they are. Returns the new segments.
+        """
+        if not os.path.exists(self.log_path):
+            return []
+        meta, window = self._read_meta()
+        weeks = self.weekly_summaries(None)
+        new = self.segments.seal(keep_last=True)
+        self._write_meta(meta, window)
+        self._write_weeks(weeks)
+        return new
+
+    def load_plan(self, chat_id: Optional[int]) -> Optional[SleepPlan]:
+        if not os.path.exists(self.plan_path):
+            return None
+        with open(self.plan_path, "r") as f:
+            data = json.load(f)
+        return SleepPlan.from_dict(data)
+
+    def reminders(self) -> list[tuple[int, str, Optional[int]]]:
+        """(chat id, timezone, planned wake-up in minutes or None) per subscriber."""
+        if not os.path.exists(self.reminders_path):
+            return []
+        with open(self.reminders_path, "r") as f:
+            subscribers = json.load(f)
+        plan = self.load_plan(None)
+        wake = plan.wake_time_min if plan is not None and plan.tib else None
+        return [(int(chat_id), tz, wake) for chat_id, tz in subscribers.items()]
+
+    def set_reminder(self, chat_id: Optional[int], tz: Optional[str]):
+        """Subscribe a chat to reminders in timezone tz, or unsubscribe it (None)."""
+        subscribers = {}
+        if os.path.exists(self.reminders_path):
+            with open(self.reminders_path, "r") as f:
+                subscribers = json.load(f)
+        key = str(chat_key(chat_id))
+        if tz is None:
+            subscribers.pop(key, None)
+        else:
+            subscribers[key] = tz
+        tmp_path = self.reminders_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(subscribers, f)
+        os.replace(tmp_path, self.reminders_path)
+
+    def save_plan(self, chat_id: Optional[int], plan: SleepPlan):
+        # Write a temp file and rename it over the plan, so a crash mid-write
+        # leaves either the old or the new plan on disk, never a truncated one
+        tmp_path = self.plan_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(plan.to_dict(), f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.plan_path)
+
+    def append_plan_history(self, rows: list[tuple[Optional[int], date, SleepPlan]]):
+        """Append (chat id, effective date, plan) rows to the plan history."""
+        if not rows:
+            return
+        lines = "".join(
+            json.dumps({"effective": effective.isoformat(), **plan.to_dict()}) + "\n"
+            for _, effective, plan in rows
+        )
+        with open(self.history_path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def plan_history(self, chat_id: Optional[int] = None) -> "PlanHistory":
+        """Every plan saved, as chat 0 (the log's chat in weekly summaries)."""
+        from src.data_manager.plan_history import PlanHistory
+
+        rows = []
+        if os.path.exists(self.history_path):
+            with open(self.history_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        data = json.loads(line)
+                        rows.append(
+                            (
+                                0,
+                                data["effective"],
+                                data["tib"],
+                                data["bedtime"],
+                                data["wake_time"],
+                            )
+                        )
+        return PlanHistory.from_rows(rows)
+
+    def plan_as_of(self, chat_id: Optional[int], day: date) -> Optional[SleepPlan]:
+        """The plan in force for the night logged on day."""
+        return self.plan_history(chat_id).as_of(day)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS log (
+    chat_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    bedtime TEXT NOT NULL,
+    wakeup TEXT NOT NULL,
+    onset INTEGER,
+    awake INTEGER,
+    tib INTEGER,
+    tst INTEGER,
+    se INTEGER
+);
+CREATE INDEX IF NOT EXISTS log_chat_date ON log (chat_id, date);
+
+CREATE TABLE IF NOT EXISTS log_meta (
+    chat_id INTEGER PRIMARY KEY,
+    n_entries INTEGER NOT NULL,
+    last_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS log_window (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL  -- LogWindow as JSON
+);
+
+CREATE TABLE IF NOT EXISTS weekly_summary (
+    chat_id INTEGER NOT NULL,
+    week TEXT NOT NULL,  -- Monday
+    nights INTEGER NOT NULL,
+    tst_mean REAL,
+    tst_median REAL,
+    se_mean REAL,
+    se_median REAL,
+    tib_mean REAL,
+    bedtime_adherence REAL,
+    wake_adherence REAL,
+    data TEXT NOT NULL,  -- WeekSummary as JSON
+    PRIMARY KEY (chat_id, week)
+);
+
+CREATE TABLE IF NOT EXISTS reminder (
+    chat_id INTEGER PRIMARY KEY,
+    tz TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS plan (
+    chat_id INTEGER PRIMARY KEY,
+    tib INTEGER NOT NULL,
+    bedtime TEXT NOT NULL,
+    wake_time TEXT NOT NULL
+);
+
+-- Every plan saved, in save order (rowid); never updated
+CREATE TABLE IF NOT EXISTS plan_history (
+    chat_id INTEGER NOT NULL,
+    effective TEXT NOT NULL,  -- first night the plan applies to
+    tib INTEGER NOT NULL,
+    bedtime TEXT NOT NULL,
+    wake_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plan_history_chat_effective
+    ON plan_history (chat_id, effective);
+"""
+
+
+# Tables with rows per chat
+_CHAT_TABLES = (
+    "log",
+    "log_meta",
+    "log_window",
+    "weekly_summary",
+    "reminder",
+    "plan",
+    "plan_history",
+)
+
+
+class SqliteStore:
+    """
+    Multi-user backend: every chat's log and plan in one embedded SQLite file.
+    Rows are indexed on (chat_id, date), so appends and "last N nights" reads
+    only touch the calling user's slice of the index.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            tables = {
+                name
+                for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )
+            }
+            conn.executescript(_SQLITE_SCHEMA)
+            # Databases created before log_meta/log_window existed: backfill once
+            if "log_meta" not in tables:
+                conn.execute(
+                    "INSERT INTO log_meta "
+                    "SELECT chat_id, COUNT(*), MAX(date) FROM log GROUP BY chat_id"
+                )
+            if "log_window" not in tables:
+                for (chat_id,) in conn.execute(
+                    "SELECT DISTINCT chat_id FROM log"
+                ).fetchall():
+                    window = log_utils.to_log_window(
+                        self.read_log(chat_id, ROLLING_WINDOWS[-1])
+                    )
+                    self._save_window(conn, chat_id, window)
+            if "weekly_summary" not in tables:
+                # Adherence is measured against the plan in force each night
+                # (each chat's current plan if it has no history)
+                from src.processing import reports
+
+                self._save_weeks(conn, reports.summarize_sqlite(conn))
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shareable across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL syncs the WAL on every commit; appends are group-committed
+            # by log_writer, so that's one sync per batch rather than per entry
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def append_entry(self, chat_id: Optional[int], entry: LogEntry):
+        self.append_entries([(chat_id, entry)])
+
+    def append_entries(
+        self,
+        entries: list[tuple[Optional[int], LogEntry]],
+        plans: Optional[dict] = None,
+    ):
+        """
+        Append a batch of entries, possibly for many chats, in one transaction.
+        plans maps chat keys to the plan in force, for the weekly summaries;
+        without it the stored plans are read.
+        """
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO log VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        chat_key(chat_id),
+                        entry.date.isoformat(),
+                        format_hhmm(entry.bedtime_min),
+                        format_hhmm(entry.wakeup_min),
+                        entry.onset,
+                        entry.awake,
+                        entry.tib,
+                        entry.tst,
+                        entry.se,
+                    )
+                    for chat_id, entry in entries
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO log_meta VALUES (?, 1, ?) ON CONFLICT (chat_id) DO UPDATE "
+                "SET n_entries = n_entries + 1, last_date = excluded.last_date",
+                [
+                    (chat_key(chat_id), entry.date.isoformat())
+                    for chat_id, entry in entries
+                ],
+            )
+            windows = {}
+            for chat_id, entry in entries:
+                key = chat_key(chat_id)
+                if key not in windows:
+                    windows[key] = self._load_window(conn, key)
+                windows[key].push(entry.tst, entry.se)
+            for key, window in windows.items():
+                self._save_window(conn, key, window)
+
+            weeks = {}
+            for chat_id, entry in entries:
+                key = chat_key(chat_id)
+                week = week_start(entry.date)
+                if (key, week) not in weeks:
+                    weeks[(key, week)] = self._load_week(conn, key, week)
+                plan = plans.get(key) if plans is not None else self.load_plan(key)
+                weeks[(key, week)].push(entry, plan)
+            self._save_weeks(conn, weeks.items())
+
+    def already_logged(self, rows: "pd.DataFrame") -> "np.ndarray":
+        """Mask of the rows (chat_id and date columns) whose chat already logged that date."""
+        import pandas as pd
+
+        ranges = rows.groupby("chat_id")["date"].agg(["min", "max"])
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS import_range "
+                "(chat_id INTEGER, lo TEXT, hi TEXT)"
+            )
+            conn.execute("DELETE FROM import_range")
+            conn.executemany(
+                "INSERT INTO import_range VALUES (?, ?, ?)",
+                zip(ranges.index.tolist(), ranges["min"], ranges["max"]),
+            )
+            # One range scan of the (chat_id, date) index per chat; an import
+            # of new nights finds nothing
+            logged = conn.execute(
+                "SELECT log.chat_id, log.date FROM import_range AS r JOIN log "
+                "ON log.chat_id = r.chat_id AND log.date BETWEEN r.lo AND r.hi"
+            ).fetchall()
+            conn.execute("DELETE FROM import_range")
+        if not logged:
+            return pd.Series(False, index=rows.index).to_numpy()
+        return pd.MultiIndex.from_arrays([rows["chat_id"], rows["date"]]).isin(logged)
+
+    def import_rows(self, rows: "pd.DataFrame"):
+        """
+        Bulk-insert validated rows (chat_id plus the log columns, already
+        formatted) in one transaction, updating the meta and weekly summaries.
+        Rolling windows are recomputed by finish_import.
+        """
+        if rows.empty:
+            return
+        from src.processing import reports
+
+        columns = ["chat_id"] + log_utils.cols
+        counts = rows.groupby("chat_id")["date"].agg(["size", "max"])
+        chat_ids = counts.index.tolist()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO log VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                zip(*(rows[c].tolist() for c in columns)),
+            )
+            conn.executemany(
+                "INSERT INTO log_meta VALUES (?, ?, ?) ON CONFLICT (chat_id) DO UPDATE "
+                "SET n_entries = n_entries + excluded.n_entries, "
+                "last_date = MAX(COALESCE(last_date, ''), excluded.last_date)",
+                zip(chat_ids, counts["size"].tolist(), counts["max"].tolist()),
+            )
+            plans = {}
+            for i in range(0, len(chat_ids), 500):
+                part = chat_ids[i : i + 500]
+                plans.update(
+                    (
+                        chat_id,
+                        SleepPlan.from_dict(
+                            {"tib": tib, "bedtime": bedtime, "wake_time": wake_time}
+                        ),
+                    )
+                    for chat_id, tib, bedtime, wake_time in conn.execute(
+                        "SELECT chat_id, tib, bedtime, wake_time FROM plan "
+                        f"WHERE chat_id IN ({', '.join('?' * len(part))})",
+                        part,
+                    )
+                )
+            weeks = reports.summarize_nights(rows, plans, self.plan_histories(chat_ids))
+            for (key, week), summary in weeks.items():
+                stored = self._load_week(conn, key, week)
+                stored.extend(summary)
+                weeks[(key, week)] = stored
+            self._save_weeks(conn, weeks.items())
+
+    def finish_import(self, chat_ids):
+        """Recompute the rolling windows of chats that received imported nights."""
+        with self._conn() as conn:
+            for key in chat_ids:
+                rows = conn.execute(
+                    "SELECT tst, se FROM log WHERE chat_id = ? "
+                    "ORDER BY date DESC, rowid DESC LIMIT ?",
+                    (key, ROLLING_WINDOWS[-1]),
+                ).fetchall()[::-1]
+                window = LogWindow(
+                    tst=[tst for tst, _ in rows], se=[se for _, se in rows]
+                )
+                self._save_window(conn, key, window)
+
+    def read_log(
+        self, chat_id: Optional[int], n: Optional[int] = None
+    ) -> "pd.DataFrame":
+        import pandas as pd
+
+        select = f"SELECT {', '.join(log_utils.cols)} FROM log WHERE chat_id = ?"
+        if n is None:
+            rows = (
+                self._conn()
+                .execute(select + " ORDER BY date, rowid", (chat_key(chat_id),))
+                .fetchall()
+            )
+        else:
+            # Walk the (chat_id, date) index backwards and stop after n rows
+            rows = (
+                self._conn()
+                .execute(
+                    select + " ORDER BY date DESC, rowid DESC LIMIT ?",
+                    (chat_key(chat_id), n),
+                )
+                .fetchall()[::-1]
+            )
+        return log_utils.to_log_frame(pd.DataFrame(rows, columns=log_utils.cols))
+
+    def log_meta(self, chat_id: Optional[int]) -> LogMeta:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT n_entries, last_date FROM log_meta WHERE chat_id = ?",
+                (chat_key(chat_id),),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return LogMeta()
+        return LogMeta.from_dict(dict(zip(("n_entries", "last_date"), row)))
+
+    def log_window(self, chat_id: Optional[int]) -> LogWindow:
+        return self._load_window(self._conn(), chat_key(chat_id))
+
+    def _load_window(self, conn: sqlite3.Connection, key: int) -> LogWindow:
+        row = conn.execute(
+            "SELECT data FROM log_window WHERE chat_id = ?", (key,)
+        ).fetchone()
+        return LogWindow() if row is None else LogWindow.from_dict(json.loads(row[0]))
+
+    def _save_window(self, conn: sqlite3.Connection, key: int, window: LogWindow):
+        conn.execute(
+            "INSERT OR REPLACE INTO log_window VALUES (?, ?)",
+            (key, json.dumps(window.to_dict())),
+        )
+
+    def weekly_summaries(self, chat_id: Optional[int]) -> list[WeekSummary]:
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT data FROM weekly_summary WHERE chat_id = ? ORDER BY week",
+                (chat_key(chat_id),),
+            )
+            .fetchall()
+        )
+        return [WeekSummary.from_dict(json.loads(data)) for (data,) in rows]
+
+    def _load_week(self, conn: sqlite3.Connection, key: int, week: date) -> WeekSummary:
+        row = conn.execute(
+            "SELECT data FROM weekly_summary WHERE chat_id = ? AND week = ?",
+            (key, week.isoformat()),
+        ).fetchone()
+        return (
+            WeekSummary(week)
+            if row is None
+            else WeekSummary.from_dict(json.loads(row[0]))
+        )
+
+    def _save_weeks(self, conn: sqlite3.Connection, summaries):
+        """Write ((chat key, week), WeekSummary) pairs with their report figures."""
+        rows = []
+        for (key, week), summary in summaries:
+            figures = summary.row()
+            rows.append(
+                (key, week.isoformat())
+                + tuple(figures[c] for c in WEEK_COLUMNS)
+                + (json.dumps(summary.to_dict()),)
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO weekly_summary "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def replace_weekly_summaries(self, summaries):
+        """Replace every chat's weekly summaries, e.g. after recomputing them."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM weekly_summary")
+            self._save_weeks(conn, summaries)
+
+    def load_plan(self, chat_id: Optional[int]) -> Optional[SleepPlan]:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT tib, bedtime, wake_time FROM plan WHERE chat_id = ?",
+                (chat_key(chat_id),),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return SleepPlan.from_dict(dict(zip(("tib", "bedtime", "wake_time"), row)))
+
+    def reminders(self) -> list[tuple[int, str, Optional[int]]]:
+        """(chat id, timezone, planned wake-up in minutes or None) per subscriber."""
+        rows = (
+            self._conn()
+            .execute(
+                "SELECT reminder.chat_id, tz, "
+                "CASE WHEN tib > 0 THEN wake_time END "
+                "FROM reminder LEFT JOIN plan USING (chat_id)"
+            )
+            .fetchall()
+        )
+        return [
+            (chat_id, tz, None if wake is None else parse_hhmm(wake))
+            for chat_id, tz, wake in rows
+        ]
+
+    def set_reminder(self, chat_id: Optional[int], tz: Optional[str]):
+        """Subscribe a chat to reminders in timezone tz, or unsubscribe it (None)."""
+        with self._conn() as conn:
+            if tz is None:
+                conn.execute(
+                    "DELETE FROM reminder WHERE chat_id = ?", (chat_key(chat_id),)
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reminder VALUES (?, ?)",
+                    (chat_key(chat_id), tz),
+                )
+
+    def save_plan(self, chat_id: Optional[int], plan: SleepPlan):
+        data = plan.to_dict()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plan VALUES (?, ?, ?, ?)",
+                (chat_key(chat_id), data["tib"], data["bedtime"], data["wake_time"]),
+            )
+
+    def append_plan_history(self, rows: list[tuple[Optional[int], date, SleepPlan]]):
+        """Append (chat id, effective date, plan) rows to the plan history."""
+        if not rows:
+            return
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO plan_history VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        chat_key(chat_id),
+                        effective.isoformat(),
+                        *plan.to_dict().values(),
+                    )
+                    for chat_id, effective, plan in rows
+                ],
+            )
+
+    def plan_history(self, chat_id: Optional[int] = None) -> "PlanHistory":
+        """Every plan saved for a chat."""
+        return self.plan_histories([chat_key(chat_id)])
+
+    def plan_histories(self, chat_ids: list[int]) -> "PlanHistory":
+        """Every plan saved for any of chat_ids, in one PlanHistory."""
+        from src.data_manager.plan_history import PlanHistory
+
+        conn = self._conn()
+        rows = []
+        for i in range(0, len(chat_ids), 500):
+            batch = chat_ids[i : i + 500]
+            rows += conn.execute(
+                "SELECT * FROM plan_history "
+                f"WHERE chat_id IN ({', '.join('?' * len(batch))}) ORDER BY rowid",
+                batch,
+            ).fetchall()
+        return PlanHistory.from_rows(rows)
+
+    def plan_as_of(self, chat_id: Optional[int], day: date) -> Optional[SleepPlan]:
+        """The plan in force for the night logged on day (one index probe)."""
+        row = (
+            self._conn()
+            .execute(
+                "SELECT tib, bedtime, wake_time FROM plan_history "
+                "WHERE chat_id = ? AND effective <= ? "
+                "ORDER BY effective DESC, rowid DESC LIMIT 1",
+                (chat_key(chat_id), day.isoformat()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return SleepPlan.from_dict(dict(zip(("tib", "bedtime", "wake_time"), row)))
+
+    def chat_ids(self) -> list[int]:
+        """Every chat with anything stored."""
+        sql = " UNION ".join(f"SELECT chat_id FROM {t}" for t in _CHAT_TABLES)
+        return [chat_id for (chat_id,) in self._conn().execute(sql)]
+
+    def move_chats(self, chat_ids: list[int], dest_path: str):
+        """
+        Move everything stored for chat_ids to the store at dest_path (e.g.
+        when shards are rebalanced). The rows are first copied over, replacing
+        any the destination has for these chats, then deleted here: an
+        interrupted move leaves them in both places and can simply be rerun.
+        """
+        SqliteStore(dest_path)  # creates the schema
+        conn = self._conn()
+        conn.execute("ATTACH DATABASE ? AS dest", (dest_path,))
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS moving (chat_id INTEGER)")
+            conn.execute("DELETE FROM moving")
+            conn.executemany("INSERT INTO moving VALUES (?)", [(c,) for c in chat_ids])
+            moving = "chat_id IN (SELECT chat_id FROM moving)"
+            with conn:
+                for table in _CHAT_TABLES:
+                    conn.execute(f"DELETE FROM dest.{table} WHERE {moving}")
+                    # rowid order keeps nights of the same date in log order
+                    conn.execute(
+                        f"INSERT INTO dest.{table} "
+                        f"SELECT * FROM main.{table} WHERE {moving} ORDER BY rowid"
+                    )
+            with conn:
+                for table in _CHAT_TABLES:
+                    conn.execute(f"DELETE FROM main.{table} WHERE {moving}")
+        finally:
+            conn.commit()
+            conn.execute("DETACH DATABASE dest")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORAGE_BACKEND == "sqlite":
+                _store = SqliteStore(DB_PATH)
+            elif STORAGE_BACKEND == "csv":
+                _store = CsvStore(LOG_PATH, PLAN_PATH)
+            else:
+                raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND!r}")
+        return _store
+
+
+def set_store(store):
+    """Replace the process-wide backend, e.g. to point benchmarks at synthetic data."""
+    global _store
+    with _store_lock:
+        _store = store
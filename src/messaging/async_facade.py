@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import time
+from functools import partial
+from typing import TYPE_CHECKING, Optional, Union
+
+from src.common import metrics, tracing
+from src.common.config import COMPUTE_PROCESSES, IO_THREADS
+from src.common.exceptions import EntrySaveError, PlanUpdateError
+from src.common.models import LogMeta, LogWindow, SleepPlan
+from src.data_manager import log_utils, log_writer, plan_utils, storage
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Awaitable versions of the storage and plan functions used by the handlers.
+# Storage calls run on a bounded thread pool and plan computation on a process
+# pool, so a slow disk or a large parse never blocks the event loop.
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_compute_pool: Optional[ProcessPoolExecutor] = None
+_pools_lock = threading.Lock()
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    with _pools_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(
+                max_workers=IO_THREADS, thread_name_prefix="shuteye-io"
+            )
+        return _io_pool
+
+
+def _get_compute_pool():
+    global _compute_pool
+    if COMPUTE_PROCESSES <= 0:
+        return _get_io_pool()
+    with _pools_lock:
+        if _compute_pool is None:
+            # spawn: forking a process that already runs I/O threads is unsafe
+            _compute_pool = ProcessPoolExecutor(
+                max_workers=COMPUTE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _compute_pool
+
+
+def _drop_compute_pool(pool: ProcessPoolExecutor):
+    """Forget a broken compute pool; the next computation starts a new one."""
+    global _compute_pool
+    with _pools_lock:
+        if _compute_pool is pool:
+            _compute_pool = None
+    pool.shutdown(wait=False)
+
+
+def _import_compute():
+    from src.processing import compute_sleep_plan  # noqa: F401
+
+
+def warm_up():
+    """Start the compute workers in the background, so the first plan doesn't wait for them."""
+    _get_compute_pool().submit(_import_compute)
+
+
+async def run_io(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs)
+    if tracing.ENABLED:
+        # Executors don't carry context variables; take the active trace along
+        call = partial(contextvars.copy_context().run, call)
+    return await loop.run_in_executor(_get_io_pool(), call)
+
+
+async def run_compute(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    pool = _get_compute_pool()
+    if pool is _io_pool:
+        # Runs in this process, where fn times and traces itself
+        return await run_io(fn, *args, **kwargs)
+    # Worker processes can't report metrics or spans, so time the round trip here
+    with metrics.timer(fn.__name__), tracing.span(fn.__name__, "compute"):
+        try:
+            return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+        except BrokenProcessPool as e:
+            # A worker died (out of memory, crash): the pool refuses all work
+            # from now on, so replace it rather than fail every later plan
+            _drop_compute_pool(pool)
+            metrics.count_error("BrokenProcessPool")
+            raise PlanUpdateError(f"Plan computation worker died: {e}") from e
+
+
+# ThreadPoolExecutor has no public queue length; _work_queue holds pending calls
+metrics.queue_depth("io_pool", lambda: _io_pool._work_queue.qsize() if _io_pool else 0)
+
+
+def shutdown(wait: bool = True):
+    """Stop the pools, waiting for queued writes to finish."""
+    global _io_pool, _compute_pool
+    with _pools_lock:
+        if _compute_pool is not None:
+            _compute_pool.shutdown(wait=wait)
+            _compute_pool = None
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=wait)
+            _io_pool = None
+
+
+@metrics.timed
+async def add_new_entry(
+    t_bed: time, t_wake: time, onset: int, awake: int, chat_id: Optional[int] = None
+) -> str:
+    # Await the group commit directly instead of parking an I/O thread on it
+    try:
+        log_entry = log_utils.new_entry(t_bed, t_wake, onset, awake)
+        with tracing.span("add_new_entry", "storage"):
+            future = log_writer.get_log_writer().submit(chat_id, log_entry)
+            await asyncio.wrap_future(future)
+    except Exception as e:
+        raise EntrySaveError(f"❌ Failed to save entry: {e}")
+    return log_utils.entry_saved_message(log_entry)
+
+
+async def read_log(
+    chat_id: Optional[int] = None, n: Optional[int] = None
+) -> "pd.DataFrame":
+    return await run_io(log_utils.read_log, chat_id, n)
+
+
+async def read_log_meta(chat_id: Optional[int] = None) -> LogMeta:
+    return await run_io(log_utils.read_log_meta, chat_id)
+
+
+async def read_log_window(chat_id: Optional[int] = None) -> LogWindow:
+    return await run_io(log_utils.read_log_window, chat_id)
+
+
+async def sleep_stats(chat_id: Optional[int] = None) -> dict:
+    return await run_io(log_utils.sleep_stats, chat_id)
+
+
+async def enough_data_for_first_plan(chat_id: Optional[int] = None) -> bool:
+    return await run_io(log_utils.enough_data_for_first_plan, chat_id)
+
+
+async def ready_for_new_plan(chat_id: Optional[int] = None) -> bool:
+    return await run_io(log_utils.ready_for_new_plan, chat_id)
+
+
+async def load_plan(chat_id: Optional[int] = None) -> SleepPlan:
+    return await run_io(plan_utils.load_plan, chat_id)
+
+
+async def update_wake_time(new_wake_time: time, chat_id: Optional[int] = None):
+    return await run_io(plan_utils.update_wake_time, new_wake_time, chat_id)
+
+
+async def update_bedtime(new_bedtime: time, chat_id: Optional[int] = None):
+    return await run_io(plan_utils.update_bedtime, new_bedtime, chat_id)
+
+
+async def set_reminder(tz: Optional[str], chat_id: Optional[int] = None):
+    return await run_io(storage.get_store().set_reminder, chat_id, tz)
+
+
+# Plans are computed in a worker process without touching storage, then saved
+# from the I/O pool, so compute workers never need a storage connection.
+# compute_sleep_plan (and with it NumPy/pandas) is imported on the first plan,
+# not at startup.
+
+
+async def initialize_sleep_plan(
+    df: Union["pd.DataFrame", LogWindow],
+    default_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+) -> SleepPlan:
+    from src.processing import compute_sleep_plan
+
+    plan = await run_compute(
+        compute_sleep_plan.initialize_sleep_plan, df, default_plan, save=False
+    )
+    await run_io(plan_utils.save_plan, plan, chat_id)
+    return plan
+
+
+async def adjust_sleep_plan_se_tst_clipped(
+    df: Union["pd.DataFrame", LogWindow],
+    current_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+) -> tuple[SleepPlan, float, float]:
+    from src.processing import compute_sleep_plan
+
+    new_plan, avg_se, avg_tst = await run_compute(
+        compute_sleep_plan.adjust_sleep_plan_se_tst_clipped,
+        df,
+        current_plan,
+        save=False,
+    )
+    await run_io(plan_utils.save_plan, new_plan, chat_id)
+    return new_plan, avg_se, avg_tst
+
+
+async def adjust_sleep_plan_se_tst_conservative(
+    df: Union["pd.DataFrame", LogWindow],
+    current_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+) -> tuple[SleepPlan, float, float]:
+    from src.processing import compute_sleep_plan
+
+    new_plan, avg_se, avg_tst = await run_compute(
+        compute_sleep_plan.adjust_sleep_plan_se_tst_conservative,
+        df,
+        current_plan,
+        save=False,
+    )
+    await run_io(plan_utils.save_plan, new_plan, chat_id)
+    return new_plan, avg_se, avg_tst
@@ -1,13 +1,33 @@
+import argparse
+import asyncio
+from typing import Optional
+
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     MessageHandler,
     filters,
     ConversationHandler,
     CommandHandler,
 )
+from telegram.request import BaseRequest
 
+from src.common import config, metrics
 from src.common.config import (
-    BOT_TOKEN,
+    BOT_API_URL,
+    CONCURRENT_UPDATES,
+    METRICS_PORT,
+    ONE_SHOT,
+    PERSISTENCE_PATH,
+    REMINDER_RATE,
+    REMINDERS,
+    WORKERS,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
     BEDTIME,
     EARLIEST_BEDTIME,
     WAKEUP,
@@ -16,6 +36,12 @@ from src.common.config import (
     EARLIEST_WAKE,
 )
 
+from src.data_manager import storage
+from src.data_manager.log_writer import close_log_writer
+from src.data_manager.plan_repository import close_plan_repository
+from src.messaging import async_facade
+from src.messaging.persistence import SqlitePersistence
+from src.messaging.reminders import ReminderService
 from src.messaging.handlers import (
     ask_earliest_wake,
     ask_earliest_bedtime,
@@ -25,35 +51,194 @@ from src.messaging.handlers import (
     get_sleep_onset,
     get_wakeup_time,
     cancel,
+    not_served,
+    reminders,
 )
 
+# A bare HH:MM outside a conversation answers the morning reminder's question
+_REMINDER_REPLY = filters.Regex(r"^\s*\d{1,2}:\d{2}\s*$") & (~filters.COMMAND)
+
+
+def served_chats() -> Optional[filters.BaseFilter]:
+    """
+    The chats the bot serves: None for all of them, or only the configured
+    CHAT_ID when the store is the single-user CSV log, which every chat
+    would otherwise share.
+    """
+    if not isinstance(storage.get_store(), storage.CsvStore):
+        return None
+    try:
+        return filters.Chat(chat_id=int(config.CHAT_ID))
+    except KeyError:
+        raise SystemExit(
+            "ConfigError: the CSV store keeps one chat's log; set TELEGRAM_CHAT_ID "
+            "or use SHUTEYE_STORAGE=sqlite"
+        ) from None
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at once, but never two of
+    the same chat: each chat's updates run one after another in the order
+    they arrived, so quick replies can't overtake each other mid-conversation.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # chat id -> [lock, updates holding or awaiting it]
+
+    async def do_process_update(self, update, coroutine):
+        chat = None
+        if isinstance(update, Update):
+            chat = update.effective_chat or update.effective_user
+        if chat is None:
+            await coroutine
+            return
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock is FIFO: waiters get it in arrival order
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+async def on_startup(app):
+    async_facade.warm_up()
+    metrics.start_server(port=app.bot_data.get("metrics_port", METRICS_PORT))
+    if "reminders" in app.bot_data:
+        await app.bot_data["reminders"].start()
+
+
+async def on_shutdown(app):
+    if "reminders" in app.bot_data:
+        await app.bot_data["reminders"].stop()
+    # Let queued storage writes finish, then commit pending entries and plans
+    async_facade.shutdown()
+    close_log_writer()
+    close_plan_repository()
+    metrics.stop_server()
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+
+def build_application(
+    one_shot: bool = ONE_SHOT,
+    persistence_path: Optional[str] = PERSISTENCE_PATH,
+    send_reminders: bool = REMINDERS,
+    reminder_rate: float = REMINDER_RATE,
+    request: Optional[BaseRequest] = None,
+):
+    """
+    The bot's Application. request, if given, carries its Bot API calls
+    instead of HTTP (the load test answers them in-process).
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .concurrent_updates(ChatOrderedProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    if request is not None:
+        builder = builder.request(request)
+    if persistence_path:
+        builder = builder.persistence(SqlitePersistence(persistence_path))
+    app = builder.build()
+    app.bot_data["one_shot"] = one_shot
+    if send_reminders:
+        app.bot_data["reminders"] = ReminderService(app.bot, rate=reminder_rate)
+
+    chats = served_chats()
+    text = filters.TEXT & (~filters.COMMAND)
+    reminder_reply = _REMINDER_REPLY
+    if chats is not None:
+        text, reminder_reply = chats & text, chats & reminder_reply
 
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("log", log)],
+        entry_points=[
+            CommandHandler("log", log, filters=chats),
+            MessageHandler(reminder_reply, get_bedtime),
+        ],
         states={
-            BEDTIME: [MessageHandler(filters.TEXT & (~filters.COMMAND), get_bedtime)],
-            WAKEUP: [
-                MessageHandler(filters.TEXT & (~filters.COMMAND), get_wakeup_time)
-            ],
-            ONSET: [MessageHandler(filters.TEXT & (~filters.COMMAND), get_sleep_onset)],
-            AWAKE: [MessageHandler(filters.TEXT & (~filters.COMMAND), get_awaken_time)],
-            EARLIEST_WAKE: [
-                MessageHandler(filters.TEXT & (~filters.COMMAND), ask_earliest_wake)
-            ],
-            EARLIEST_BEDTIME: [
-                MessageHandler(filters.TEXT & (~filters.COMMAND), ask_earliest_bedtime)
-            ],
+            BEDTIME: [MessageHandler(text, get_bedtime)],
+            WAKEUP: [MessageHandler(text, get_wakeup_time)],
+            ONSET: [MessageHandler(text, get_sleep_onset)],
+            AWAKE: [MessageHandler(text, get_awaken_time)],
+            EARLIEST_WAKE: [MessageHandler(text, ask_earliest_wake)],
+            EARLIEST_BEDTIME: [MessageHandler(text, ask_earliest_bedtime)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", cancel, filters=chats)],
+        name="log",
+        persistent=bool(persistence_path),
     )
 
     app.add_handler(conv_handler)
+    if send_reminders:
+        app.add_handler(CommandHandler("reminders", reminders, filters=chats))
+    if chats is not None:
+        app.add_handler(MessageHandler(~chats, not_served))
+    return app
+
 
+def main():
+    parser = argparse.ArgumentParser(description="Run the shuteye Telegram bot.")
+    parser.add_argument(
+        "--one-shot",
+        action="store_true",
+        default=ONE_SHOT,
+        help="stop after the first finished conversation",
+    )
+    parser.add_argument(
+        "--webhook",
+        metavar="URL",
+        default=WEBHOOK_URL,
+        help="receive updates on a local webhook server for this public URL",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="worker processes, each serving a shard of the chats (SQLite only)",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if args.one_shot:
+            parser.error("--one-shot needs a single worker")
+        from src.messaging import sharding
+
+        sharding.run(args.workers, webhook=args.webhook)
+        return
+
+    app = build_application(one_shot=args.one_shot)
     print("Bot ready to receive reply...")
-    app.run_polling()
+    run(app, args.webhook)
+
+
+def run(app, webhook: Optional[str] = None):
+    """Fetch updates for app by polling, or on a local webhook server for webhook."""
+    # Both runners stop on SIGINT/SIGTERM and then run post_shutdown
+    if webhook:
+        # Needs the webhooks extra: pip install "python-telegram-bot[webhooks]"
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
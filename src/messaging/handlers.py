@@ -9,38 +9,82 @@ from src.common.config import (
     BEDTIME,
     EARLIEST_WAKE,
     EARLIEST_BEDTIME,
-    LOG_PATH,
-    PLAN_PATH,
     WAKEUP,
     ONSET,
     AWAKE,
-    INIT_WINDOW,
+    REMINDER_TIMEZONE,
     UPDATE_WINDOW,
 )
+from src.common.minutes import format_hhmm
+from src.common import metrics, tracing
 from src.common.exceptions import EntrySaveError, PlanUpdateError
 
 from src.messaging.messages import Messages
+from src.messaging.reminders import wake_minutes, zone
 
-from src.data_manager.log_utils import (
+# Storage and plan computation run off the event loop
+from src.messaging.async_facade import (
     add_new_entry,
-    enough_data_for_first_plan,
-    read_log_csv,
-    ready_for_new_plan,
-)
-from src.data_manager.plan_utils import update_bedtime, update_wake_time, load_plan
-
-from src.processing.compute_sleep_plan import (
     adjust_sleep_plan_se_tst_clipped,
     adjust_sleep_plan_se_tst_conservative,
+    enough_data_for_first_plan,
     initialize_sleep_plan,
+    load_plan,
+    read_log_window,
+    ready_for_new_plan,
+    set_reminder,
+    update_bedtime,
+    update_wake_time,
 )
 
 
+# Labels for the per-step latency metrics
+_STATE_NAMES = {
+    BEDTIME: "BEDTIME",
+    WAKEUP: "WAKEUP",
+    ONSET: "ONSET",
+    AWAKE: "AWAKE",
+    EARLIEST_WAKE: "EARLIEST_WAKE",
+    EARLIEST_BEDTIME: "EARLIEST_BEDTIME",
+    ConversationHandler.END: "END",
+}
+
+
+def step(fn):
+    return metrics.transition(_STATE_NAMES)(tracing.conversation_step(_STATE_NAMES)(fn))
+
+
+def first_step(fn):
+    return metrics.transition(_STATE_NAMES)(
+        tracing.conversation_step(_STATE_NAMES, start=True)(fn)
+    )
+
+
+# Answers collected over a /log conversation
+_ANSWERS = ("bedtime", "wakeup", "onset", "awake")
+
+
+def drop_answers(context: ContextTypes.DEFAULT_TYPE):
+    """Forget the answers so they aren't kept (and persisted) until the next /log."""
+    for key in _ANSWERS:
+        context.user_data.pop(key, None)
+
+
+def end_conversation(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Finish the conversation; in one-shot mode, stop the bot too."""
+    drop_answers(context)
+    if context.bot_data.get("one_shot"):
+        context.application.stop_running()
+    return ConversationHandler.END
+
+
+@first_step
 async def log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(Messages.good_morning)
     return BEDTIME
 
 
+@step
 async def get_bedtime(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         bedtime = datetime.strptime(update.message.text.strip(), "%H:%M").time()
@@ -54,6 +98,7 @@ async def get_bedtime(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         return BEDTIME
 
 
+@step
 async def get_wakeup_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         wakeup = datetime.strptime(update.message.text.strip(), "%H:%M").time()
@@ -67,6 +112,7 @@ async def get_wakeup_time(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return WAKEUP
 
 
+@step
 async def get_sleep_onset(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         context.user_data["onset"] = int(update.message.text)
@@ -79,37 +125,37 @@ async def get_sleep_onset(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ONSET
 
 
+@step
 async def get_awaken_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         context.user_data["awake"] = int(update.message.text)
+        chat_id = update.effective_chat.id
 
-        # Save entry to CSV
-        response = add_new_entry(
+        # Save entry to the log
+        response = await add_new_entry(
             context.user_data["bedtime"],
             context.user_data["wakeup"],
             context.user_data["onset"],
             context.user_data["awake"],
+            chat_id,
         )
 
         await update.message.reply_text(response)
 
         # Check if enough data for plan generation
-        if enough_data_for_first_plan():
+        if await enough_data_for_first_plan(chat_id):
             await update.message.reply_text(Messages.first_sleep_plan_prompt)
 
             return EARLIEST_WAKE
 
-        if ready_for_new_plan():
+        if await ready_for_new_plan(chat_id):
             await update.message.reply_text(Messages.ready_for_next_plan)
 
             return EARLIEST_WAKE
 
         await update.message.reply_text(Messages.thats_it)
 
-        # Stop the bot after final response
-        context.application.stop_running()
-
-        return ConversationHandler.END
+        return end_conversation(context)
 
     except ValueError:
         await update.message.reply_text(
@@ -118,17 +164,21 @@ async def get_awaken_time(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return AWAKE
     except EntrySaveError as e:
         # optional: log to file or console for debugging
+        metrics.count_error("EntrySaveError")
         print(f"EntrySaveError: {e}")
         await update.message.reply_text(
             "❌ Failed to save entry. Please retry with /log"
         )
+        drop_answers(context)
         return ConversationHandler.END
 
 
+@step
 async def ask_earliest_wake(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         earliest_wake = datetime.strptime(update.message.text.strip(), "%H:%M").time()
-        update_wake_time(earliest_wake)
+        chat_id = update.effective_chat.id
+        await update_wake_time(earliest_wake, chat_id)
 
         await update.message.reply_text(
             Messages.new_plan_being_generated.format(
@@ -137,10 +187,11 @@ async def ask_earliest_wake(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
         # Compute new plan
-        df = read_log_csv(LOG_PATH)
-        curr_plan = load_plan(PLAN_PATH)
-        if len(df) == INIT_WINDOW:
-            new_plan = initialize_sleep_plan(df, curr_plan)
+        # The rolling window holds the last nights, so the log isn't read
+        curr_plan = await load_plan(chat_id)
+        window = await read_log_window(chat_id)
+        if await enough_data_for_first_plan(chat_id):
+            new_plan = await initialize_sleep_plan(window, curr_plan, chat_id)
 
             hours, minutes = divmod(new_plan.tib, 60)
 
@@ -153,8 +204,8 @@ async def ask_earliest_wake(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 )
             )
         else:
-            new_plan, avg_se, avg_tst = adjust_sleep_plan_se_tst_clipped(
-                df.tail(UPDATE_WINDOW), curr_plan
+            new_plan, avg_se, avg_tst = await adjust_sleep_plan_se_tst_clipped(
+                window, curr_plan, chat_id
             )
 
             hours, minutes = divmod(new_plan.tib, 60)
@@ -173,24 +224,20 @@ async def ask_earliest_wake(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 )
             )
 
-        # Stop the bot after final response
-        context.application.stop_running()
-
-        return ConversationHandler.END
+        return end_conversation(context)
     except ValueError as e:
         await update.message.reply_text(
             f"⚠️ Error parsing time. Please enter your earliest desired wake-up time (HH:MM): {e}"
         )
         return EARLIEST_WAKE
     except PlanUpdateError as e:
+        metrics.count_error("PlanUpdateError")
         print(f"PlanUpdateError: {e}")
         await update.message.reply_text(Messages.internal_error)
-        # Stop the bot after final response
-        context.application.stop_running()
-
-        return ConversationHandler.END
+        return end_conversation(context)
 
 
+@step
 async def ask_earliest_bedtime(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
@@ -198,7 +245,8 @@ async def ask_earliest_bedtime(
         earliest_bedtime = datetime.strptime(
             update.message.text.strip(), "%H:%M"
         ).time()
-        update_bedtime(earliest_bedtime)
+        chat_id = update.effective_chat.id
+        await update_bedtime(earliest_bedtime, chat_id)
 
         await update.message.reply_text(
             Messages.new_plan_being_generated_bedtime.format(
@@ -207,10 +255,10 @@ async def ask_earliest_bedtime(
         )
 
         # Compute new plan
-        df = read_log_csv(LOG_PATH)
-        curr_plan = load_plan(PLAN_PATH)
-        new_plan, avg_se, avg_tst = adjust_sleep_plan_se_tst_conservative(
-            df.tail(UPDATE_WINDOW), curr_plan
+        window = await read_log_window(chat_id)
+        curr_plan = await load_plan(chat_id)
+        new_plan, avg_se, avg_tst = await adjust_sleep_plan_se_tst_conservative(
+            window, curr_plan, chat_id
         )
 
         hours, minutes = divmod(new_plan.tib, 60)
@@ -229,24 +277,59 @@ async def ask_earliest_bedtime(
             )
         )
 
-        # Stop the bot after final response
-        context.application.stop_running()
-
-        return ConversationHandler.END
+        return end_conversation(context)
     except ValueError as e:
         await update.message.reply_text(
             f"⚠️ Error parsing time. Please enter your earliest desired wake-up time (HH:MM): {e}"
         )
         return EARLIEST_BEDTIME
     except PlanUpdateError as e:
+        metrics.count_error("PlanUpdateError")
         print(f"PlanUpdateError: {e}")
         await update.message.reply_text(Messages.internal_error)
-        # Stop the bot after final response
-        context.application.stop_running()
-
-        return ConversationHandler.END
+        return end_conversation(context)
 
 
+@step
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(Messages.bye)
+    drop_answers(context)
     return ConversationHandler.END
+
+
+async def reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reminders on [timezone] | off: a good-morning message at the planned wake-up time."""
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    service = context.bot_data.get("reminders")
+
+    if args == ["off"]:
+        await set_reminder(None, chat_id)
+        if service is not None:
+            service.unsubscribe(chat_id)
+        await update.message.reply_text(Messages.reminders_off)
+        return
+
+    if not args or args[0] != "on" or len(args) > 2:
+        await update.message.reply_text(Messages.reminders_usage)
+        return
+
+    tz = args[1] if len(args) == 2 else REMINDER_TIMEZONE
+    try:
+        zone(tz)
+    except ValueError:
+        await update.message.reply_text(Messages.unknown_timezone.format(tz=tz))
+        return
+    clock = wake_minutes(await load_plan(chat_id))
+    await set_reminder(tz, chat_id)
+    if service is not None:
+        service.subscribe(chat_id, tz, clock)
+    await update.message.reply_text(
+        Messages.reminders_on.format(time=format_hhmm(clock), tz=tz)
+    )
+
+
+async def not_served(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer chats other than the owner's when the store keeps a single log."""
+    if update.effective_message is not None:
+        await update.effective_message.reply_text(Messages.single_user)
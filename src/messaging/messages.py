@@ -46,6 +46,19 @@ Wishing you sweet dreams and gentle mornings. 😴✨"""
 
 Keep it up — you’re doing wonderfully! 🌟"""
 
+    reminders_on = """⏰ Got it! I'll check in every morning at {time} ({tz}) so you can log your night.
+The time follows your plan's wake-up time. Turn it off any time with /reminders off."""
+
+    reminders_off = (
+        """🔕 Morning reminders are off. Turn them back on with /reminders on."""
+    )
+
+    reminders_usage = """Usage: /reminders on [timezone], e.g. /reminders on Europe/Berlin, or /reminders off"""
+
+    unknown_timezone = """⚠️ I don't know the timezone {tz}. Please use a name like Europe/Berlin or America/New_York."""
+
+    single_user = """🔒 Sorry, this bot keeps a single sleep log and only serves its owner's chat."""
+
     bye = """Bye for now! 👋 Hope to see you again soon. Wishing you rest and energy. 😊"""
 
     internal_error = """❌ Failed to update sleep plan due to an internal error.
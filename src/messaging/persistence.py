@@ -0,0 +1,258 @@
+import asyncio
+import itertools
+import json
+import pickle
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from src.common import metrics
+from src.common.config import PERSISTENCE_INTERVAL, PERSISTENCE_PATH
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,  -- conversation key as JSON, e.g. [chat_id, user_id]
+    state TEXT NOT NULL,  -- as JSON
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,  -- pickled
+    PRIMARY KEY (user_id, key)
+) WITHOUT ROWID;
+"""
+
+_SET_STATE = "INSERT OR REPLACE INTO conversation VALUES (?, ?, ?)"
+_DROP_STATE = "DELETE FROM conversation WHERE name = ? AND key = ?"
+_SET_VALUE = "INSERT OR REPLACE INTO user_data VALUES (?, ?, ?)"
+_DROP_VALUE = "DELETE FROM user_data WHERE user_id = ? AND key = ?"
+_DROP_USER = "DELETE FROM user_data WHERE user_id = ?"
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Conversation states and user_data kept in an embedded SQLite file, so that
+    half-finished /log conversations survive restarts and deploys.
+
+    Each user_data key is its own row and only keys whose value changed since
+    the last save are written, so a save costs the same however many
+    conversations are in flight. Writes run in order on one background thread;
+    whatever is queued when it gets to them is committed in one transaction.
+    """
+
+    def __init__(
+        self,
+        path: str = PERSISTENCE_PATH,
+        update_interval: float = PERSISTENCE_INTERVAL,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.path = path
+        # user id -> {key: pickled value} as last written (None: unknown, after
+        # a failed write)
+        self._saved = {}
+        self._pending = []  # (sql, params) not yet committed
+        self._commit_job = None  # commit that hasn't taken the pending ops yet
+        self._lock = threading.Lock()
+        self._conn = None  # used only on the writer thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shuteye-persistence"
+        )
+        metrics.queue_depth("persistence", lambda: len(self._pending))
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # NORMAL survives a crash or kill of the bot; only a power loss can
+            # roll back the last few saves
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    async def _write(self, ops: list):
+        """Queue ops and wait until they're committed, along with everything queued meanwhile."""
+        with self._lock:
+            self._pending.extend(ops)
+            if self._commit_job is None:
+                self._commit_job = asyncio.wrap_future(
+                    self._executor.submit(self._commit)
+                )
+            job = self._commit_job
+        # Shared by every caller queued meanwhile: don't let one cancel it
+        await asyncio.shield(job)
+
+    def _commit(self):
+        with self._lock:
+            ops, self._pending = self._pending, []
+            self._commit_job = None
+        if not ops:
+            return
+        try:
+            with metrics.timer("persistence_commit"):
+                with self._connection() as conn:
+                    # Runs of the same statement go in one executemany
+                    for sql, run in itertools.groupby(ops, key=lambda op: op[0]):
+                        conn.executemany(sql, [params for _, params in run])
+        except Exception:
+            # Rewrite these users in full on their next save
+            for sql, params in ops:
+                if sql in (_SET_VALUE, _DROP_VALUE):
+                    self._saved[params[0]] = None
+            raise
+
+    def _select(self, sql: str, params: tuple = ()) -> list:
+        return self._connection().execute(sql, params).fetchall()
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self._run(
+            self._select, "SELECT key, state FROM conversation WHERE name = ?", (name,)
+        )
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(
+        self, name: str, key: tuple, new_state: Optional[object]
+    ):
+        key = json.dumps(list(key))
+        if new_state is None:
+            await self._write([(_DROP_STATE, (name, key))])
+        else:
+            await self._write([(_SET_STATE, (name, key, json.dumps(new_state)))])
+
+    async def get_user_data(self) -> dict:
+        rows = await self._run(
+            self._select, "SELECT user_id, key, value FROM user_data"
+        )
+        data = {}
+        for user_id, key, value in rows:
+            self._saved.setdefault(user_id, {})[key] = value
+            # Only this bot writes the file, so unpickling it is as safe as
+            # the bot's own memory
+            data.setdefault(user_id, {})[key] = pickle.loads(value)
+        return data
+
+    async def update_user_data(self, user_id: int, data: dict):
+        current = {
+            key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            for key, value in data.items()
+        }
+        saved = self._saved.get(user_id, {})
+        if saved is None:
+            # Rewrite the user from scratch
+            ops = [(_DROP_USER, (user_id,))]
+            saved = {}
+        else:
+            ops = [(_DROP_VALUE, (user_id, key)) for key in saved if key not in current]
+        ops += [
+            (_SET_VALUE, (user_id, key, value))
+            for key, value in current.items()
+            if saved.get(key) != value
+        ]
+        if not ops:
+            return
+        if current:
+            self._saved[user_id] = current
+        else:
+            self._saved.pop(user_id, None)
+        await self._write(ops)
+
+    async def drop_user_data(self, user_id: int):
+        self._saved.pop(user_id, None)
+        await self._write([(_DROP_USER, (user_id,))])
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass  # nothing else writes the file
+
+    # Chat data, bot data and callback data are not kept (see store_data)
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        """Commit anything still queued and close the file (called on shutdown)."""
+        await self._run(self._commit)
+        await self._run(self._close)
+        self._executor.shutdown()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def chat_ids(path: str) -> list[int]:
+    """Chats with a conversation or user_data saved in the file at path."""
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript(_SCHEMA)
+        rows = conn.execute(
+            "SELECT json_extract(key, '$[0]') FROM conversation "
+            "UNION SELECT user_id FROM user_data"
+        ).fetchall()
+    return [chat_id for (chat_id,) in rows]
+
+
+def move_chats(path: str, dest_path: str, chat_ids: list[int]):
+    """
+    Move the saved conversations of chat_ids, and the user_data of their
+    users (the same ids in private chats), from path to dest_path. Copied
+    first, then deleted, like SqliteStore.move_chats.
+    """
+    with closing(sqlite3.connect(dest_path)) as dest:
+        dest.executescript(_SCHEMA)
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript(_SCHEMA)
+        conn.execute("ATTACH DATABASE ? AS dest", (dest_path,))
+        conn.execute("CREATE TEMP TABLE moving (chat_id INTEGER)")
+        conn.executemany("INSERT INTO moving VALUES (?)", [(c,) for c in chat_ids])
+        conversations = "json_extract(key, '$[0]') IN (SELECT chat_id FROM moving)"
+        users = "user_id IN (SELECT chat_id FROM moving)"
+        with conn:
+            for table, where in (("conversation", conversations), ("user_data", users)):
+                conn.execute(f"DELETE FROM dest.{table} WHERE {where}")
+                conn.execute(
+                    f"INSERT INTO dest.{table} SELECT * FROM main.{table} WHERE {where}"
+                )
+        with conn:
+            conn.execute(f"DELETE FROM main.conversation WHERE {conversations}")
+            conn.execute(f"DELETE FROM main.user_data WHERE {users}")
@@ -0,0 +1,321 @@
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from telegram.error import Forbidden, RetryAfter
+
+from src.common import metrics
+from src.common.config import (
+    REMINDER_CHAT_RATE,
+    REMINDER_DEFAULT_TIME,
+    REMINDER_GRACE,
+    REMINDER_RATE,
+    REMINDER_SENDERS,
+)
+from src.common.minutes import parse_hhmm
+from src.data_manager import plan_repository, storage
+from src.messaging.async_facade import run_io
+from src.messaging.messages import Messages
+
+
+# Morning reminders: every subscribed chat gets Messages.good_morning at its
+# planned wake-up time in its own timezone.
+#
+# Pending reminders sit in one heap keyed by due time (O(log n) to schedule or
+# pop, however many chats there are). A dispatcher sleeps until the earliest
+# one is due and hands due chats to a few sender tasks, which share a global
+# and a per-chat token bucket so bursts (say, everyone waking at 07:00 UTC)
+# are spread out within Telegram's limits instead of being rejected.
+
+DEFAULT_TIME = parse_hhmm(REMINDER_DEFAULT_TIME)
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    """The timezone called name; raises ValueError for an unknown one."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"unknown timezone {name!r}") from e
+
+
+def wake_minutes(plan) -> int:
+    """Reminder time (minutes after midnight) for a plan, or the default without one."""
+    if plan is None or not plan.tib or plan.wake_time_min is None:
+        return DEFAULT_TIME
+    return plan.wake_time_min
+
+
+def next_occurrence(clock: int, tz: str, now: float) -> float:
+    """Timestamp of the first clock time (minutes after midnight, local to tz) after now."""
+    tzinfo = zone(tz)
+    local = datetime.fromtimestamp(now, tzinfo)
+    day = local.date()
+    while True:
+        due = datetime(
+            day.year, day.month, day.day, clock // 60, clock % 60, tzinfo=tzinfo
+        )
+        # Round-trip through UTC so a time skipped by a DST change moves forward
+        due = due.astimezone(timezone.utc).timestamp()
+        if due > now:
+            return due
+        day += timedelta(days=1)
+
+
+class ReminderScheduler:
+    """
+    Min-heap of (due time, chat id). Rescheduling or cancelling a chat leaves
+    its old heap entry behind; it is skipped when it reaches the top, and the
+    heap is rebuilt once stale entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}  # chat id -> due time of its live entry
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._due
+
+    def schedule(self, chat_id: int, due: float):
+        self._due[chat_id] = due
+        heapq.heappush(self._heap, (due, chat_id))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._rebuild()
+
+    def schedule_many(self, jobs: list[tuple[float, int]]):
+        """Schedule (due, chat id) pairs at once: O(n) instead of O(n log n)."""
+        for due, chat_id in jobs:
+            self._due[chat_id] = due
+        self._heap.extend(jobs)
+        self._rebuild()
+
+    def cancel(self, chat_id: int):
+        self._due.pop(chat_id, None)
+
+    def next_due(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int) -> list[tuple[float, int]]:
+        """Remove and return up to limit (due, chat id) pairs due by now, earliest first."""
+        due = []
+        while len(due) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            job = heapq.heappop(self._heap)
+            del self._due[job[1]]
+            due.append(job)
+        return due
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _rebuild(self):
+        self._heap = [(due, chat_id) for chat_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+
+class TokenBucket:
+    """Allows rate events per second on average, and bursts of up to burst."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        """Seconds until the next event is allowed (0: now)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Allow nothing for the next seconds (Telegram asked us to back off)."""
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class ReminderService:
+    """Sends the reminders of every subscribed chat through bot."""
+
+    def __init__(
+        self,
+        bot,
+        rate: float = REMINDER_RATE,
+        chat_rate: float = REMINDER_CHAT_RATE,
+        senders: int = REMINDER_SENDERS,
+        grace: float = REMINDER_GRACE,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.grace = grace
+        self.scheduler = ReminderScheduler()
+        # chat id -> (timezone, reminder time) it is scheduled for
+        self.subscribers = {}
+        self.sent = self.skipped = self.failed = 0
+        # No burst: any one-second window then holds at most rate + 1 sends
+        self._global = TokenBucket(rate, 1, time.monotonic())
+        self._chats = {}  # chat id -> TokenBucket, only while it may still limit
+        self._queue = asyncio.Queue(maxsize=senders * 4)
+        self._senders = senders
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        metrics.queue_depth("reminders", lambda: len(self.scheduler))
+
+    def subscribe(self, chat_id: int, tz: str, clock: int, now: Optional[float] = None):
+        """(Re)schedule chat_id's reminder for clock (minutes after midnight) in tz."""
+        now = time.time() if now is None else now
+        self.subscribers[chat_id] = (tz, clock)
+        due = next_occurrence(clock, tz, now)
+        next_due = self.scheduler.next_due()
+        self.scheduler.schedule(chat_id, due)
+        if next_due is None or due < next_due:
+            self._wakeup.set()
+
+    def unsubscribe(self, chat_id: int):
+        self.subscribers.pop(chat_id, None)
+        self.scheduler.cancel(chat_id)
+
+    def load(self, subscribers: list[tuple[int, str, Optional[int]]], now: float):
+        """Schedule (chat id, timezone, wake-up minutes or None) rows from the store."""
+        occurrences = {}  # (tz, clock) -> due; far fewer than subscribers
+        jobs = []
+        for chat_id, tz, wake in subscribers:
+            clock = DEFAULT_TIME if wake is None else wake
+            try:
+                due = occurrences.get((tz, clock))
+                if due is None:
+                    due = occurrences[(tz, clock)] = next_occurrence(clock, tz, now)
+            except ValueError as e:
+                print(f"ReminderError: chat {chat_id}: {e}")
+                continue
+            self.subscribers[chat_id] = (tz, clock)
+            jobs.append((due, chat_id))
+        self.scheduler.schedule_many(jobs)
+        self._wakeup.set()
+
+    async def start(self, load: bool = True):
+        """Load the subscribers from storage (unless load=False) and start sending."""
+        if load:
+            rows = await run_io(storage.get_store().reminders)
+            self.load(rows, time.time())
+        self._tasks = [asyncio.create_task(self._dispatch())] + [
+            asyncio.create_task(self._send_loop()) for _ in range(self._senders)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = self.scheduler.pop_due(now, self._queue.maxsize)
+            for job in due:
+                # Blocks while the senders are behind; the rest wait in the heap
+                await self._queue.put(job)
+            if due:
+                continue
+            next_due = self.scheduler.next_due()
+            timeout = None if next_due is None else max(next_due - now, 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_loop(self):
+        while True:
+            due, chat_id = await self._queue.get()
+            try:
+                await self._remind(due, chat_id)
+            except Exception as e:
+                self.failed += 1
+                metrics.count_error("ReminderError")
+                print(f"ReminderError: chat {chat_id}: {e}")
+
+    async def _remind(self, due: float, chat_id: int):
+        subscription = self.subscribers.get(chat_id)
+        if subscription is None:
+            return  # unsubscribed after being queued
+        tz, clock = subscription
+        plan = await run_io(plan_repository.get_plan_repository().get, chat_id)
+        if chat_id in self.scheduler or self.subscribers.get(chat_id) != subscription:
+            return  # resubscribed meanwhile, with its own reminder
+        current = wake_minutes(plan)
+        if current != clock:
+            # The plan moved the wake-up time: remind at the new time instead
+            self.subscribe(chat_id, tz, current)
+            return
+        try:
+            if time.time() - due <= self.grace:
+                await self._send(chat_id)
+            else:
+                self.skipped += 1
+        finally:
+            # Tomorrow's reminder, even if this one failed
+            if (
+                self.subscribers.get(chat_id) == subscription
+                and chat_id not in self.scheduler
+            ):
+                self.subscribe(chat_id, tz, clock, max(due, time.time()))
+
+    async def _send(self, chat_id: int):
+        while True:
+            await self._acquire(chat_id)
+            try:
+                with metrics.timer("send_reminder"):
+                    await self.bot.send_message(chat_id, Messages.good_morning)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._global.pause(retry_after)
+                continue
+            except Forbidden:
+                # The user blocked the bot or deleted the chat
+                self.unsubscribe(chat_id)
+                await run_io(storage.get_store().set_reminder, chat_id, None)
+                return
+            self.sent += 1
+            return
+
+    async def _acquire(self, chat_id: int):
+        """Wait for a token from both the global and chat_id's bucket, then take them."""
+        while True:
+            now = time.monotonic()
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) >= 10_000:
+                    self._prune_chats(now)
+                bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1, now)
+            delay = max(self._global.wait(now), bucket.wait(now))
+            if delay <= 0:
+                self._global.take()
+                bucket.take()
+                return
+            await asyncio.sleep(delay)
+
+    def _prune_chats(self, now: float):
+        # A bucket that has refilled behaves like a new one
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.wait(now)
+            if bucket.tokens >= bucket.burst:
+                del self._chats[chat_id]
@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from src.common import config, metrics
+from src.common.config import (
+    BOT_API_URL,
+    DB_PATH,
+    METRICS_PORT,
+    PERSISTENCE_PATH,
+    REMINDER_RATE,
+    SHARD_VNODES,
+    STORAGE_BACKEND,
+    WORKERS,
+)
+from src.data_manager import storage
+from src.messaging import bot, persistence
+
+
+# Worker mode: one dispatcher process fetches the updates (polling or webhook)
+# and forwards each one to the worker process owning its chat. Every worker
+# runs the usual Application (conversation, reminders, log writer, plan cache)
+# on its own SQLite shard, so plan computation and log parsing for different
+# chats run on different cores.
+#
+# Chats are assigned to workers by consistent hashing, so adding a worker only
+# moves the chats it takes over (about 1/n of them); their data is moved to
+# the new shard when the workers start. A chat's updates all travel through
+# one FIFO queue to one worker, which runs them in order (ChatOrderedProcessor).
+
+_SHARD_NAME = re.compile(r"shard\d+")
+
+
+def _point(name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of chat ids onto shards. Each shard owns vnodes points
+    of a 64-bit ring, and a chat belongs to the shard owning the first point
+    at or after the chat's own hash: adding a shard takes chats only from the
+    others, never moving any between the shards already there.
+    """
+
+    def __init__(self, shards: list[str], vnodes: int = SHARD_VNODES):
+        self.vnodes = vnodes
+        self.shards = []
+        self._points = []
+        self._owners = []
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard: str):
+        self.shards.append(shard)
+        self._build()
+
+    def remove(self, shard: str):
+        self.shards.remove(shard)
+        self._build()
+
+    def _build(self):
+        ring = sorted(
+            (_point(f"{shard}#{i}"), shard)
+            for shard in self.shards
+            for i in range(self.vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+
+    def shard_for(self, chat_id: int) -> str:
+        at = bisect.bisect_left(self._points, _point(str(chat_id)))
+        return self._owners[at % len(self._owners)]
+
+
+def shard_names(workers: int) -> list[str]:
+    return [f"shard{i}" for i in range(workers)]
+
+
+def shard_path(path: str, shard: str) -> str:
+    """data/shuteye.db → data/shuteye.shard0.db"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard}{ext}"
+
+
+def _existing(path: str) -> dict:
+    """Files of path's shards, plus path itself (shard None) if it exists."""
+    root, ext = os.path.splitext(path)
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(root) + "."
+    files = {}
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(ext):
+            shard = name[len(prefix) : len(name) - len(ext)]
+            if _SHARD_NAME.fullmatch(shard):
+                files[shard] = os.path.join(directory, name)
+    if os.path.exists(path):
+        files[None] = path  # written by a single bot before worker mode
+    return files
+
+
+def _moves(ring: HashRing, shard: Optional[str], chat_ids: list[int]) -> dict:
+    """shard → chats of chat_ids it should hold, for those not on shard now."""
+    moves = defaultdict(list)
+    for chat_id in chat_ids:
+        owner = ring.shard_for(chat_id)
+        if owner != shard:
+            moves[owner].append(chat_id)
+    return moves
+
+
+def rebalance(
+    shards: list[str],
+    db_path: str = DB_PATH,
+    persistence_path: Optional[str] = PERSISTENCE_PATH,
+) -> Counter:
+    """
+    Move every chat to the shard that owns it on the ring of shards (after
+    workers were added or removed, or from an unsharded database). Run while
+    no worker is serving the shards. Returns how many chats each shard got.
+    """
+    ring = HashRing(shards)
+    received = Counter()
+    for shard, path in _existing(db_path).items():
+        source = storage.SqliteStore(path)
+        for owner, chat_ids in _moves(ring, shard, source.chat_ids()).items():
+            source.move_chats(chat_ids, shard_path(db_path, owner))
+            received[owner] += len(chat_ids)
+    if persistence_path:
+        # Conversations move too, even for chats with nothing stored yet
+        for shard, path in _existing(persistence_path).items():
+            chat_ids = persistence.chat_ids(path)
+            for owner, moving in _moves(ring, shard, chat_ids).items():
+                dest = shard_path(persistence_path, owner)
+                persistence.move_chats(path, dest, moving)
+    return received
+
+
+def _take(inbox, limit: int = 256) -> list:
+    """Block for the next update, then take whatever else is already queued."""
+    batch = [inbox.get()]
+    while batch[-1] is not None and len(batch) < limit:
+        try:
+            batch.append(inbox.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def _serve(shard_id: int, workers: int, persistence_path, inbox, ready):
+    loop = asyncio.get_running_loop()
+    # SIGTERM (e.g. from a service manager) stops this worker like the dispatcher does
+    loop.add_signal_handler(signal.SIGTERM, inbox.put, None)
+    app = bot.build_application(
+        persistence_path=persistence_path,
+        # Telegram's global limit is shared by all workers
+        reminder_rate=REMINDER_RATE / workers,
+    )
+    if METRICS_PORT:
+        app.bot_data["metrics_port"] = METRICS_PORT + 1 + shard_id
+    async with app:
+        await bot.on_startup(app)
+        await app.start()
+        ready.set()
+        stopping = False
+        while not stopping:
+            for data in await loop.run_in_executor(None, _take, inbox):
+                if data is None:
+                    stopping = True
+                    break
+                await app.update_queue.put(Update.de_json(json.loads(data), app.bot))
+        # Finishes the updates already queued
+        await app.stop()
+    await bot.on_shutdown(app)
+
+
+def _watch_dispatcher(lifeline, inbox):
+    """Stop the worker once the dispatcher is gone, even if it was killed."""
+    try:
+        # Nothing is ever sent: this returns when the dispatcher's end closes
+        lifeline.recv()
+    except EOFError:
+        pass
+    inbox.put(None)
+
+
+def _worker(
+    shard_id: int,
+    workers: int,
+    db_path: str,
+    persistence_path,
+    inbox,
+    ready,
+    lifeline,
+):
+    # Ctrl+C reaches the whole process group; the dispatcher stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(
+        target=_watch_dispatcher,
+        args=(lifeline, inbox),
+        name="shuteye-lifeline",
+        daemon=True,
+    ).start()
+    storage.set_store(storage.SqliteStore(db_path))
+    asyncio.run(_serve(shard_id, workers, persistence_path, inbox, ready))
+
+
+class Cluster:
+    """One worker process per shard, and the routing of updates to them."""
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        db_path: str = DB_PATH,
+        persistence_path: Optional[str] = PERSISTENCE_PATH,
+    ):
+        self.shards = shard_names(workers)
+        self.ring = HashRing(self.shards)
+        self.db_path = db_path
+        self.persistence_path = persistence_path
+        self._inboxes = {}
+        self._processes = []
+        # Our ends of the pipes the workers watch to notice we're gone
+        self._lifelines = []
+
+    def start(self, timeout: float = 60):
+        """Rebalance the shards, start the workers and wait until they serve."""
+        received = rebalance(self.shards, self.db_path, self.persistence_path)
+        if received:
+            print(
+                f"Rebalanced {sum(received.values())} chats across "
+                f"{len(self.shards)} workers"
+            )
+        # spawn: each worker starts its own threads and compute pool
+        ctx = multiprocessing.get_context("spawn")
+        events = []
+        for shard_id, shard in enumerate(self.shards):
+            inbox = ctx.Queue()
+            ready = ctx.Event()
+            lifeline, keep = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    shard_id,
+                    len(self.shards),
+                    shard_path(self.db_path, shard),
+                    self.persistence_path and shard_path(self.persistence_path, shard),
+                    inbox,
+                    ready,
+                    lifeline,
+                ),
+                name=f"shuteye-{shard}",
+            )
+            process.start()
+            # Only the worker holds the reading end, so it sees EOF when we exit
+            lifeline.close()
+            self._lifelines.append(keep)
+            self._inboxes[shard] = inbox
+            self._processes.append(process)
+            events.append(ready)
+            metrics.queue_depth(f"shard_{shard}", inbox.qsize)
+        for shard, ready in zip(self.shards, events):
+            if not ready.wait(timeout):
+                self.stop()
+                raise RuntimeError(f"worker {shard} did not start")
+
+    def send(self, chat_id: int, data: str):
+        """Queue an update (as JSON) for the worker owning chat_id."""
+        self._inboxes[self.ring.shard_for(chat_id)].put(data)
+
+    def route(self, update: Update):
+        chat = update.effective_chat or update.effective_user
+        self.send(chat.id if chat else update.update_id, update.to_json())
+
+    def stop(self, timeout: float = 60):
+        """
+        Let every worker finish its queued updates and shut down, killing
+        those still running after timeout seconds.
+        """
+        for inbox in self._inboxes.values():
+            inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"ShardingError: {process.name} did not stop, killing it")
+                process.kill()
+                process.join()
+        for keep in self._lifelines:
+            keep.close()
+        self._inboxes = {}
+        self._processes = []
+        self._lifelines = []
+
+
+def run(workers: int = WORKERS, webhook: Optional[str] = None):
+    """Serve the bot from workers worker processes behind one dispatcher."""
+    if STORAGE_BACKEND != "sqlite":
+        raise SystemExit("ShardingError: worker mode needs SHUTEYE_STORAGE=sqlite")
+    cluster = Cluster(workers)
+    # Until the runner installs its own handlers, SIGTERM unwinds through the
+    # finally below like Ctrl+C, so the workers are stopped either way
+    signal.signal(signal.SIGTERM, _raise_exit)
+    try:
+        cluster.start()
+        _serve_dispatcher(cluster, webhook, workers)
+    finally:
+        cluster.stop()
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _serve_dispatcher(cluster: Cluster, webhook: Optional[str], workers: int):
+    async def route(update: Update, context):
+        cluster.route(update)
+
+    async def on_startup(app):
+        metrics.start_server()
+
+    async def on_shutdown(app):
+        metrics.stop_server()
+
+    builder = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    # Updates are routed one at a time, in the order they arrive
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, route))
+    print(f"Bot ready to receive reply ({workers} workers)...")
+    bot.run(app, webhook)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move chats to the shards that own them for a number of workers."
+    )
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--db", default=DB_PATH, help="unsharded SQLite path")
+    parser.add_argument(
+        "--persistence",
+        default=PERSISTENCE_PATH,
+        help="unsharded conversation persistence path",
+    )
+    args = parser.parse_args()
+
+    shards = shard_names(args.workers)
+    received = rebalance(shards, args.db, args.persistence)
+    print(f"{sum(received.values())} chats moved")
+    for shard in shards:
+        path = shard_path(args.db, shard)
+        chats = len(storage.SqliteStore(path).chat_ids())
+        print(f"  {shard}: {chats} chats ({received[shard]} moved in), {path}")
+
+
+if __name__ == "__main__":
+    main()
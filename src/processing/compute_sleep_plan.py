@@ -1,40 +1,213 @@
 import pandas as pd
 import numpy as np
+from dataclasses import dataclass
+from typing import Optional, Union
 
 from src.common.config import (
+    INIT_WINDOW,
+    UPDATE_WINDOW,
     MIN_TIB_CONSERVATIVE,
-    PLAN_PATH,
     DELTA_UP,
     DELTA_DOWN,
     BUFFER,
     MIN_TIB,
 )
-from src.common.models import SleepPlan
+from src.common import metrics, tracing
+from src.common.minutes import shift
+from src.common.models import LogWindow, SleepPlan
 from src.common.exceptions import PlanUpdateError
 from src.data_manager.plan_utils import save_plan
 
 
-def initialize_sleep_plan(df: pd.DataFrame, default_plan: SleepPlan) -> SleepPlan:
-    """Create the first sleep plan after baseline logs."""
-    try:
-        avg_tst = df["tst"].mean()
-        tib = int(max(avg_tst + 30, 330))  # minutes, min 5.5h (330m)
+@dataclass
+class PlanBatch:
+    """New plans for many users at once; times are minutes after midnight."""
 
-        plan = SleepPlan(
-            tib=tib,
-            wake_time=default_plan.wake_time,
+    tib: np.ndarray
+    bedtime: np.ndarray
+    wake_time: np.ndarray
+    avg_se: np.ndarray
+    avg_tst: np.ndarray
+
+    def plan(self, i: int) -> SleepPlan:
+        return SleepPlan.from_minutes(
+            tib=int(self.tib[i]),
+            bedtime=int(self.bedtime[i]),
+            wake_time=int(self.wake_time[i]),
         )
 
-        plan.update_bedtime
 
-        save_plan(plan, PLAN_PATH)
+def _window(values: pd.Series) -> np.ndarray:
+    """One user's log column as a (1, window) float row, NA as NaN."""
+    return values.to_numpy(dtype=float, na_value=np.nan)[np.newaxis, :]
+
+
+def _nights(log: Union[pd.DataFrame, LogWindow], col: str, n: int) -> np.ndarray:
+    """
+    One user's nights of a column as a (1, nights) row: every row of a log
+    DataFrame, or the last n nights kept in a LogWindow (no log read needed).
+    """
+    if isinstance(log, LogWindow):
+        return np.array([log.last(col, n)], dtype=float)
+    return _window(log[col])
+
+
+def _clipped_tst(tst: np.ndarray, tib: np.ndarray) -> np.ndarray:
+    """Average TST per user after clipping each night to [0.7, 1.2] x current TIB."""
+    clipped = np.clip(tst, 0.7 * tib[:, np.newaxis], 1.2 * tib[:, np.newaxis])
+    # FIXME: Simple unweighted average for now (recent nights could weigh more)
+    return np.nanmean(clipped, axis=1)
+
+
+def _check(tib: np.ndarray):
+    if not np.all(np.isfinite(tib)):
+        raise ValueError("missing or invalid TST/SE values in the log window")
+
+
+def initialize_sleep_plans(tst: np.ndarray, wake_time: np.ndarray) -> PlanBatch:
+    """
+    Batch form of initialize_sleep_plan.
+    tst has shape (users, nights), NaN for missing nights; wake_time holds
+    each user's anchor as minutes after midnight.
+    """
+    avg_tst = np.nanmean(tst, axis=1)
+    tib = np.maximum(avg_tst + 30, 330)  # minutes, min 5.5h (330m)
+    _check(tib)
+    tib = tib.astype(int)
+    wake_time = np.asarray(wake_time, dtype=int)
+
+    return PlanBatch(
+        tib=tib,
+        bedtime=shift(wake_time, -tib),
+        wake_time=wake_time,
+        avg_se=np.full(len(tib), np.nan),
+        avg_tst=avg_tst,
+    )
+
+
+def adjust_sleep_plans_se_tst_clipped(
+    se: np.ndarray,
+    tst: np.ndarray,
+    tib: np.ndarray,
+    wake_time: np.ndarray,
+    delta_up: int = DELTA_UP,
+    delta_down: int = DELTA_DOWN,
+    buffer: int = BUFFER,
+    min_tib: int = MIN_TIB,
+) -> PlanBatch:
+    """
+    Batch form of adjust_sleep_plan_se_tst_clipped: wake time stays, bedtime moves.
+    se and tst have shape (users, nights); tib and wake_time shape (users,).
+    """
+    tib = np.asarray(tib, dtype=float)
+    avg_se = np.nanmean(se, axis=1)
+    avg_tst = _clipped_tst(tst, tib)
+
+    new_tib = np.select(
+        [
+            avg_se > 90,
+            (85 <= avg_se) & (avg_se <= 90),
+            (70 <= avg_se) & (avg_se < 85),
+        ],
+        [
+            # Very good efficiency → allow slight extension, but never below TST
+            np.maximum(tib + delta_up, avg_tst),
+            # Good efficiency → maintain TIB, but bump up if consistently sleeping more
+            np.maximum(tib, avg_tst),
+            # Low efficiency → trim, cautiously when sleeping less than prescribed
+            np.where(
+                avg_tst > tib,
+                tib - delta_down,
+                np.minimum(tib - delta_down, avg_tst + buffer),
+            ),
+        ],
+        # Poor efficiency → restrict TIB close to actual sleep, add buffer, enforce floor
+        default=np.maximum(avg_tst + buffer, min_tib),
+    )
+    _check(new_tib)
+    new_tib = new_tib.astype(int)
+    wake_time = np.asarray(wake_time, dtype=int)
+
+    return PlanBatch(
+        tib=new_tib,
+        bedtime=shift(wake_time, -new_tib),
+        wake_time=wake_time,
+        avg_se=avg_se,
+        avg_tst=avg_tst,
+    )
+
+
+def adjust_sleep_plans_se_tst_conservative(
+    se: np.ndarray,
+    tst: np.ndarray,
+    tib: np.ndarray,
+    bedtime: np.ndarray,
+    delta_up: int = DELTA_UP,
+    delta_down: int = DELTA_DOWN,
+    buffer: int = BUFFER,
+    min_tib: int = MIN_TIB_CONSERVATIVE,
+) -> PlanBatch:
+    """
+    Batch form of adjust_sleep_plan_se_tst_conservative: bedtime stays, wake time moves.
+    se and tst have shape (users, nights); tib and bedtime shape (users,).
+    """
+    tib = np.asarray(tib, dtype=float)
+    avg_se = np.nanmean(se, axis=1)
+    avg_tst = _clipped_tst(tst, tib)
+
+    new_tib = np.select(
+        [
+            avg_se > 90,
+            (85 <= avg_se) & (avg_se <= 90),
+            (70 <= avg_se) & (avg_se < 85),
+        ],
+        [
+            np.maximum(tib + delta_up, avg_tst),
+            np.maximum(tib, avg_tst),
+            # Partial efficiency → trim TIB cautiously, enforce conservative floor
+            np.maximum(tib - delta_down, min_tib),
+        ],
+        default=np.maximum(avg_tst + buffer, min_tib),
+    )
+    _check(new_tib)
+    new_tib = new_tib.astype(int)
+    bedtime = np.asarray(bedtime, dtype=int)
+
+    return PlanBatch(
+        tib=new_tib,
+        bedtime=bedtime,
+        wake_time=shift(bedtime, new_tib),
+        avg_se=avg_se,
+        avg_tst=avg_tst,
+    )
+
+
+@metrics.timed
+@tracing.traced("compute")
+def initialize_sleep_plan(
+    df: Union[pd.DataFrame, LogWindow],
+    default_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+    save: bool = True,
+) -> SleepPlan:
+    """Create the first sleep plan after baseline logs (save=False skips storing it)."""
+    try:
+        batch = initialize_sleep_plans(
+            _nights(df, "tst", INIT_WINDOW), np.array([default_plan.wake_time_min])
+        )
+        plan = batch.plan(0)
+
+        if save:
+            save_plan(plan, chat_id)
         return plan
     except Exception as e:
         raise PlanUpdateError(f"Failed to initialize sleep plan: {e}")
 
 
+@metrics.timed
+@tracing.traced("compute")
 def adjust_sleep_plan_se_only(
-    df: pd.DataFrame, current_plan: SleepPlan
+    df: pd.DataFrame, current_plan: SleepPlan, chat_id: Optional[int] = None
 ) -> tuple[SleepPlan, float]:
     """
     Adjust plan based on last 5 days' average SE.
@@ -59,70 +232,47 @@ def adjust_sleep_plan_se_only(
         # recompute bedtime from wake time and updated TIB
         new_plan.update_bedtime
 
-        save_plan(new_plan, PLAN_PATH)
+        save_plan(new_plan, chat_id)
         return new_plan, avg_se
     except Exception as e:
         raise PlanUpdateError(f"Failed to update sleep plan: {e}")
 
 
+@metrics.timed
+@tracing.traced("compute")
 def adjust_sleep_plan_se_tst_clipped(
-    df: pd.DataFrame, current_plan: SleepPlan
+    df: Union[pd.DataFrame, LogWindow],
+    current_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+    save: bool = True,
 ) -> tuple[SleepPlan, float, float]:
     """
     Adjust plan based on last 5 days' average SE and clipped TST.
     Clips TST values to a window relative to current TIB before averaging.
     """
     try:
-        avg_se = df["se"].mean()
-
-        tib = current_plan.tib
-        lower_bound = 0.7 * tib
-        upper_bound = 1.2 * tib
-
-        # Clip TST values relative to TIB
-        clipped_tst = df["tst"].clip(lower=lower_bound, upper=upper_bound)
-
-        # Weighted average of clipped TST (recent nights weigh more)
-        # weights = np.linspace(1, 2, len(clipped_tst))
-        # weighted_tst = np.average(clipped_tst, weights=weights)
-        # FIXME: Attempt simpler unweighted average for now
-        avg_tst = np.average(clipped_tst)
-
-        # Adjust TIB based on SE and weighted TST
-        if avg_se > 90:
-            # Very good efficiency → allow slight extension, but never below weighted TST
-            tib = max(tib + DELTA_UP, avg_tst)
-        elif 85 <= avg_se <= 90:
-            # Good efficiency → maintain TIB, but bump up if consistently sleeping more
-            tib = max(tib, avg_tst)
-        elif 70 <= avg_se < 85:
-            if avg_tst > tib:
-                # Sleeping more than prescribed TIB but efficiency is low → trim
-                tib -= DELTA_DOWN
-            else:
-                # Sleeping less than prescribed TIB but still inefficient → trim cautiously
-                tib = min(tib - DELTA_DOWN, avg_tst + BUFFER)
-        else:  # avg_se < 70
-            # Poor efficiency → restrict TIB close to actual sleep, add buffer, enforce floor
-            tib = max(avg_tst + BUFFER, MIN_TIB)
-
-        tib = int(tib)
-
-        # Create new plan
-        new_plan = SleepPlan(
-            tib=tib,
-            wake_time=current_plan.wake_time,
+        batch = adjust_sleep_plans_se_tst_clipped(
+            _nights(df, "se", UPDATE_WINDOW),
+            _nights(df, "tst", UPDATE_WINDOW),
+            np.array([current_plan.tib]),
+            np.array([current_plan.wake_time_min]),
         )
-        new_plan.update_bedtime
+        new_plan = batch.plan(0)
 
-        save_plan(new_plan, PLAN_PATH)
-        return new_plan, avg_se, avg_tst
+        if save:
+            save_plan(new_plan, chat_id)
+        return new_plan, batch.avg_se[0], batch.avg_tst[0]
     except Exception as e:
         raise PlanUpdateError(f"Failed to update sleep plan: {e}")
 
 
+@metrics.timed
+@tracing.traced("compute")
 def adjust_sleep_plan_se_tst_conservative(
-    df: pd.DataFrame, current_plan: SleepPlan
+    df: Union[pd.DataFrame, LogWindow],
+    current_plan: SleepPlan,
+    chat_id: Optional[int] = None,
+    save: bool = True,
 ) -> tuple[SleepPlan, float, float]:
     """
     Adjust plan based on last 5 days' average SE and clipped TST.
@@ -130,43 +280,17 @@ def adjust_sleep_plan_se_tst_conservative(
     Minimum TIB enforced to 7 hours.
     """
     try:
-        avg_se = df["se"].mean()
-
-        tib = current_plan.tib
-        lower_bound = 0.7 * tib
-        upper_bound = 1.2 * tib
-
-        # Clip TST values relative to TIB
-        clipped_tst = df["tst"].clip(lower=lower_bound, upper=upper_bound)
-
-        # Average of clipped TST
-        avg_tst = np.average(clipped_tst)
-
-        # Adjust TIB based on SE and weighted TST
-        if avg_se > 90:
-            # Very good efficiency → allow slight extension, but never below weighted TST
-            tib = max(tib + DELTA_UP, avg_tst)
-        elif 85 <= avg_se <= 90:
-            # Good efficiency → maintain TIB, but bump up if consistently sleeping more
-            tib = max(tib, avg_tst)
-        elif 70 <= avg_se < 85:
-            # Partial efficiency → trim TIB cautiously, enforce conservative floor
-            tib = max(tib - DELTA_DOWN, MIN_TIB_CONSERVATIVE)
-        else:  # avg_se < 70
-            # Poor efficiency → restrict TIB close to actual sleep, add buffer, enforce floor
-            tib = max(avg_tst + BUFFER, MIN_TIB_CONSERVATIVE)
-
-        tib = int(tib)
-
-        # Create new plan
-        new_plan = SleepPlan(
-            tib=tib,
-            bedtime=current_plan.bedtime,
+        batch = adjust_sleep_plans_se_tst_conservative(
+            _nights(df, "se", UPDATE_WINDOW),
+            _nights(df, "tst", UPDATE_WINDOW),
+            np.array([current_plan.tib]),
+            np.array([current_plan.bedtime_min]),
         )
-        new_plan.update_wake_time
+        new_plan = batch.plan(0)
 
-        save_plan(new_plan, PLAN_PATH)
-        return new_plan, avg_se, avg_tst
+        if save:
+            save_plan(new_plan, chat_id)
+        return new_plan, batch.avg_se[0], batch.avg_tst[0]
     except Exception as e:
         raise PlanUpdateError(f"Failed to update sleep plan: {e}")
 
@@ -0,0 +1,408 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.common.config import ADHERENCE_TOLERANCE, LOG_PATH, PLAN_PATH
+from src.common.minutes import MINUTES_PER_DAY, distance
+from src.common.models import WEEK_COLUMNS, SleepPlan, WeekSummary
+from src.data_manager import storage
+from src.data_manager.log_utils import cols
+from src.data_manager.plan_history import PlanHistory
+
+
+# Weekly summaries per user (see WeekSummary) and the reports built from them.
+# The stores keep the summaries up to date on every append; the functions here
+# recompute them from raw logs (grouping every row at once) and render reports
+# for a whole cohort across a process pool.
+
+# Rows per chunk when reading raw logs, which keeps memory bounded
+CHUNK_ROWS = 1_000_000
+# TIB trend: slope over this many most recent weeks
+TREND_WEEKS = 8
+
+_EPOCH = date(1970, 1, 1)
+
+
+def _clock(values: pd.Series) -> np.ndarray:
+    """Clock times as "HH:MM" → minutes after midnight (NaN if unparsable)."""
+    t = pd.to_datetime(values, format="%H:%M", errors="coerce")
+    return (t.dt.hour * 60 + t.dt.minute).to_numpy(dtype=float, na_value=np.nan)
+
+
+def _number(values: pd.Series) -> np.ndarray:
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _split(values: np.ndarray, starts: np.ndarray) -> list:
+    """Per-group lists of ints, with None for NaN."""
+    missing = np.isnan(values)
+    out = np.where(missing, 0, values).astype(np.int64).astype(object)
+    out[missing] = None
+    return [part.tolist() for part in np.split(out, starts[1:])]
+
+
+def summarize_nights(
+    raw: pd.DataFrame, plans: dict, history: Optional[PlanHistory] = None
+) -> dict:
+    """
+    Group raw log rows (chat_id plus the log columns, as read from CSV or the
+    database) into {(chat_id, week): WeekSummary}, vectorized over all rows.
+    Adherence is measured against the plan in force each night, from history,
+    for chats it has plans of; plans maps the other chats to their plan.
+    """
+    dates = pd.to_datetime(raw["date"], errors="coerce")
+    valid = dates.notna().to_numpy()  # a row without a date has no week
+    raw, dates = raw[valid], dates[valid]
+    if raw.empty:
+        return {}
+
+    days = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    weeks = days - (days + 3) % 7  # 1970-01-01 was a Thursday
+    chat = raw["chat_id"].to_numpy(dtype=np.int64)
+    order = np.lexsort((weeks, chat))
+    chat, weeks = chat[order], weeks[order]
+    bedtime = _clock(raw["bedtime"])[order]
+    wakeup = _clock(raw["wakeup"])[order]
+
+    planned_chats = {k: p for k, p in plans.items() if p is not None and p.tib}
+    chat_series = pd.Series(chat)
+    plan_bedtime = chat_series.map(
+        {k: p.bedtime_min for k, p in planned_chats.items()}
+    ).to_numpy(dtype=float, na_value=np.nan)
+    plan_wake = chat_series.map(
+        {k: p.wake_time_min for k, p in planned_chats.items()}
+    ).to_numpy(dtype=float, na_value=np.nan)
+    if history is not None and len(history):
+        # Chats saved before the history was kept still use their current plan
+        known = history.has(chat)
+        at = history.lookup(chat[known], days[order][known])
+        found = (at >= 0) & (history.tib[at] > 0)
+        plan_bedtime[known] = np.where(found, history.bedtime[at], np.nan)
+        plan_wake[known] = np.where(found, history.wake_time[at], np.nan)
+    planned = ~np.isnan(plan_bedtime)
+    bedtime_on_plan = planned & (distance(bedtime, plan_bedtime) <= ADHERENCE_TOLERANCE)
+    wake_on_plan = planned & (distance(wakeup, plan_wake) <= ADHERENCE_TOLERANCE)
+
+    starts = np.flatnonzero(
+        np.r_[True, (chat[1:] != chat[:-1]) | (weeks[1:] != weeks[:-1])]
+    )
+    lists = {c: _split(_number(raw[c])[order], starts) for c in ("tst", "se", "tib")}
+    counts = {
+        "planned": np.add.reduceat(planned.astype(np.int64), starts),
+        "bedtime_on_plan": np.add.reduceat(bedtime_on_plan.astype(np.int64), starts),
+        "wake_on_plan": np.add.reduceat(wake_on_plan.astype(np.int64), starts),
+    }
+
+    summaries = {}
+    for i, start in enumerate(starts):
+        week = _EPOCH + timedelta(days=int(weeks[start]))
+        summaries[(int(chat[start]), week)] = WeekSummary(
+            week,
+            tst=lists["tst"][i],
+            se=lists["se"][i],
+            tib=lists["tib"][i],
+            **{name: int(values[i]) for name, values in counts.items()},
+        )
+    return summaries
+
+
+def _merge(into: dict, summaries: dict):
+    for key, summary in summaries.items():
+        if key in into:
+            into[key].extend(summary)
+        else:
+            into[key] = summary
+
+
+def summarize_csv(
+    paths: list[str], plan: Optional[SleepPlan], history: Optional[PlanHistory] = None
+) -> list[WeekSummary]:
+    """
+    Weekly summaries of a log CSV (chat 0 in history), read in chunks. paths
+    are its segments, oldest first (gzipped or not), ending with the log.
+    """
+    merged = {}
+    for path in paths:
+        if os.path.getsize(path) == 0:
+            continue
+        chunks = pd.read_csv(
+            path,
+            header=None,
+            names=cols,
+            # Numbers are left to the parser; anything unparsable is coerced later
+            dtype={"date": str, "bedtime": str, "wakeup": str},
+            chunksize=CHUNK_ROWS,
+        )
+        for chunk in chunks:
+            chunk["chat_id"] = 0
+            _merge(merged, summarize_nights(chunk, {0: plan}, history))
+    return [summary for _, summary in sorted(merged.items())]
+
+
+def summarize_sqlite(
+    conn: sqlite3.Connection, lo: Optional[int] = None, hi: Optional[int] = None
+) -> list[tuple[tuple[int, date], WeekSummary]]:
+    """((chat_id, week), WeekSummary) pairs for every chat, or chats lo..hi."""
+    where, params = "", ()
+    if lo is not None:
+        where, params = " WHERE chat_id BETWEEN ? AND ?", (lo, hi)
+    plans = {
+        chat_id: SleepPlan.from_dict(
+            {"tib": tib, "bedtime": bedtime, "wake_time": wake_time}
+        )
+        for chat_id, tib, bedtime, wake_time in conn.execute(
+            "SELECT chat_id, tib, bedtime, wake_time FROM plan" + where, params
+        )
+    }
+    history = PlanHistory.from_rows(
+        conn.execute(
+            "SELECT chat_id, effective, tib, bedtime, wake_time FROM plan_history"
+            + where
+            + " ORDER BY rowid",
+            params,
+        )
+    )
+    merged = {}
+    chunks = pd.read_sql_query(
+        "SELECT chat_id, date, bedtime, wakeup, tib, tst, se FROM log" + where,
+        conn,
+        params=params,
+        chunksize=CHUNK_ROWS,
+    )
+    for chunk in chunks:
+        _merge(merged, summarize_nights(chunk, plans, history))
+    return sorted(merged.items())
+
+
+def _summarize_range(args: tuple) -> list:
+    path, lo, hi = args
+    with sqlite3.connect(path) as conn:
+        return summarize_sqlite(conn, lo, hi)
+
+
+def _chat_ranges(chat_ids: list, n: int) -> list[tuple[int, int]]:
+    """Split sorted chat ids into up to n contiguous (lo, hi) ranges."""
+    return [
+        (int(part[0]), int(part[-1]))
+        for part in np.array_split(np.asarray(chat_ids), n)
+        if len(part)
+    ]
+
+
+def rebuild_sqlite(path: str, workers: Optional[int] = None):
+    """Recompute every chat's weekly summaries from the raw log, in parallel."""
+    store = storage.SqliteStore(path)
+    with sqlite3.connect(path) as conn:
+        chat_ids = [
+            c
+            for (c,) in conn.execute(
+                "SELECT DISTINCT chat_id FROM log ORDER BY chat_id"
+            )
+        ]
+    tasks = [
+        (path, lo, hi)
+        for lo, hi in _chat_ranges(chat_ids, 4 * (workers or os.cpu_count() or 1))
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        summaries = [
+            pair for part in pool.map(_summarize_range, tasks) for pair in part
+        ]
+    store.replace_weekly_summaries(summaries)
+
+
+def tib_trend(weeks: np.ndarray, tib_mean: np.ndarray) -> Optional[float]:
+    """Least-squares slope of weekly mean TIB, minutes per week, over TREND_WEEKS weeks."""
+    known = np.isfinite(tib_mean)
+    x = weeks.astype("datetime64[D]").astype(np.int64)[known][-TREND_WEEKS:] / 7
+    y = tib_mean[known][-TREND_WEEKS:]
+    if len(x) < 2:
+        return None
+    return float(np.polyfit(x - x[0], y, 1)[0])
+
+
+# Cell text by rounded value, so a report's table is formatted in a few array
+# lookups rather than one format call per cell
+_MISSING = "–"
+_DURATIONS = np.array(
+    [f"{m // 60}h {m % 60:02d}m" for m in range(MINUTES_PER_DAY + 1)], dtype=object
+)
+_CHANGES = np.array(
+    [f"{d:+d}m" for d in range(-MINUTES_PER_DAY, MINUTES_PER_DAY + 1)], dtype=object
+)
+_PERCENTS = np.array([f"{p}%" for p in range(101)], dtype=object)
+
+
+def _lookup(table: np.ndarray, values: np.ndarray, offset: int = 0) -> np.ndarray:
+    """table[round(value) + offset] for each value, "–" where NaN or out of range."""
+    index = np.rint(values) + offset
+    known = np.isfinite(index) & (index >= 0) & (index < len(table))
+    out = np.full(len(values), _MISSING, dtype=object)
+    out[known] = table[index[known].astype(np.int64)]
+    return out
+
+
+def render_report(chat_id, rows: pd.DataFrame) -> tuple[str, dict]:
+    """
+    One user's report as Markdown, from their weekly rows ordered by week,
+    plus the user's line of the cohort table.
+    """
+    weeks = rows["week"].to_numpy(dtype="datetime64[D]")
+    values = {c: rows[c].to_numpy(dtype=float, na_value=np.nan) for c in WEEK_COLUMNS}
+    tib_change = np.r_[np.nan, np.diff(values["tib_mean"])]
+    trend = tib_trend(weeks, values["tib_mean"])
+
+    lines = [
+        f"# Sleep report: {chat_id}",
+        "",
+        f"{len(rows)} weeks, {weeks[0]} to {weeks[-1]}, "
+        f"{int(values['nights'].sum())} nights logged.",
+        "Time in bed trend: "
+        + (
+            "not enough weeks yet."
+            if trend is None
+            else f"{trend:+.1f} min/week over the last {min(len(rows), TREND_WEEKS)} weeks."
+        ),
+        "",
+        "| Week | Nights | TST mean | TST median | SE mean | SE median "
+        "| TIB mean | TIB change | Bedtime on plan | Wake-up on plan |",
+        "|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    cells = zip(
+        weeks.astype(str),
+        values["nights"].astype(np.int64).astype(str),
+        _lookup(_DURATIONS, values["tst_mean"]),
+        _lookup(_DURATIONS, values["tst_median"]),
+        _lookup(_PERCENTS, values["se_mean"]),
+        _lookup(_PERCENTS, values["se_median"]),
+        _lookup(_DURATIONS, values["tib_mean"]),
+        _lookup(_CHANGES, tib_change, MINUTES_PER_DAY),
+        _lookup(_PERCENTS, values["bedtime_adherence"] * 100),
+        _lookup(_PERCENTS, values["wake_adherence"] * 100),
+    )
+    lines.extend("| " + " | ".join(row) + " |" for row in cells)
+
+    last = {c: values[c][-1] for c in WEEK_COLUMNS[1:]}
+    cohort_row = {
+        "chat_id": chat_id,
+        "weeks": len(rows),
+        "nights": int(values["nights"].sum()),
+        "first_week": str(weeks[0]),
+        "last_week": str(weeks[-1]),
+        **{f"last_{c}": v for c, v in last.items()},
+        "tib_trend": trend,
+    }
+    return "\n".join(lines) + "\n", cohort_row
+
+
+def _write_reports(rows: pd.DataFrame, out_dir: str) -> list[dict]:
+    cohort = []
+    for chat_id, user_rows in rows.groupby("chat_id", sort=False):
+        text, cohort_row = render_report(chat_id, user_rows)
+        with open(os.path.join(out_dir, f"{chat_id}.md"), "w") as f:
+            f.write(text)
+        cohort.append(cohort_row)
+    return cohort
+
+
+def _read_rows(
+    path: str, lo: Optional[int] = None, hi: Optional[int] = None
+) -> pd.DataFrame:
+    where, params = "", ()
+    if lo is not None:
+        where, params = " WHERE chat_id BETWEEN ? AND ?", (lo, hi)
+    with sqlite3.connect(path) as conn:
+        return pd.read_sql_query(
+            f"SELECT chat_id, week, {', '.join(WEEK_COLUMNS)} FROM weekly_summary"
+            + where
+            + " ORDER BY chat_id, week",
+            conn,
+            params=params,
+        )
+
+
+def _report_range(args: tuple) -> list[dict]:
+    path, lo, hi, out_dir = args
+    return _write_reports(_read_rows(path, lo, hi), out_dir)
+
+
+def report_sqlite(
+    path: str, out_dir: str, workers: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Render every chat's report into out_dir, each worker reading and rendering
+    its own range of chats. Returns the cohort table (also saved as cohort.csv).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    storage.SqliteStore(path)  # creates or backfills weekly_summary if needed
+    with sqlite3.connect(path) as conn:
+        chat_ids = [
+            c
+            for (c,) in conn.execute(
+                "SELECT DISTINCT chat_id FROM weekly_summary ORDER BY chat_id"
+            )
+        ]
+    tasks = [
+        (path, lo, hi, out_dir)
+        for lo, hi in _chat_ranges(chat_ids, 4 * (workers or os.cpu_count() or 1))
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        cohort = [row for part in pool.map(_report_range, tasks) for row in part]
+    return _write_cohort(cohort, out_dir)
+
+
+def report_csv(log_path: str, plan_path: str, out_dir: str) -> pd.DataFrame:
+    """Render the single-user report of a log CSV into out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    store = storage.CsvStore(log_path, plan_path)
+    name = os.path.splitext(os.path.basename(log_path))[0]
+    rows = pd.DataFrame([s.row() for s in store.weekly_summaries(None)])
+    cohort = []
+    if not rows.empty:
+        cohort = _write_reports(rows.assign(chat_id=name), out_dir)
+    return _write_cohort(cohort, out_dir)
+
+
+def _write_cohort(cohort: list, out_dir: str) -> pd.DataFrame:
+    df = pd.DataFrame(cohort)
+    df.to_csv(os.path.join(out_dir, "cohort.csv"), index=False)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render weekly sleep reports for one user or a whole cohort."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="SQLite store with every chat's log")
+    source.add_argument("--log", nargs="?", const=LOG_PATH, help="a log CSV file")
+    parser.add_argument("--plan", default=PLAN_PATH, help="plan JSON of the log CSV")
+    parser.add_argument("--out", default="reports", help="directory for the reports")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="recompute the weekly summaries from the raw logs first (--db only)",
+    )
+    args = parser.parse_args()
+
+    if args.db:
+        if args.rebuild:
+            rebuild_sqlite(args.db, args.workers)
+        cohort = report_sqlite(args.db, args.out, args.workers)
+    else:
+        weeks_path = storage.CsvStore(args.log, args.plan).weeks_path
+        if args.rebuild and os.path.exists(weeks_path):
+            # Summaries that don't match the log are recomputed on the next read
+            os.remove(weeks_path)
+        cohort = report_csv(args.log, args.plan, args.out)
+    print(f"{len(cohort)} reports written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
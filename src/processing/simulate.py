@@ -0,0 +1,320 @@
+import argparse
+import itertools
+import json
+import sqlite3
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.common.config import (
+    BUFFER,
+    DELTA_DOWN,
+    DELTA_UP,
+    INIT_WINDOW,
+    MIN_TIB,
+    MIN_TIB_CONSERVATIVE,
+    UPDATE_WINDOW,
+)
+from src.data_manager.log_utils import read_log_csv
+from src.processing.compute_sleep_plan import (
+    adjust_sleep_plans_se_tst_clipped,
+    adjust_sleep_plans_se_tst_conservative,
+    initialize_sleep_plans,
+)
+
+
+ALGORITHMS = ("clipped", "conservative")
+
+
+def default_params() -> dict:
+    """Tuning parameters as currently set in config.py."""
+    return {
+        "DELTA_UP": DELTA_UP,
+        "DELTA_DOWN": DELTA_DOWN,
+        "BUFFER": BUFFER,
+        "MIN_TIB": MIN_TIB,
+        "MIN_TIB_CONSERVATIVE": MIN_TIB_CONSERVATIVE,
+    }
+
+
+@dataclass
+class Cohort:
+    """Logged nights of many users, left-aligned and NaN-padded to (users, nights)."""
+
+    user_ids: list
+    tst: np.ndarray
+    se: np.ndarray
+    lengths: np.ndarray  # number of logged nights per user
+
+    @staticmethod
+    def from_frames(frames: dict) -> "Cohort":
+        """Build from {user_id: log DataFrame}, e.g. as returned by read_log_csv."""
+        lengths = np.array([len(df) for df in frames.values()], dtype=int)
+        n_nights = int(lengths.max()) if len(lengths) else 0
+        tst = np.full((len(frames), n_nights), np.nan)
+        se = np.full((len(frames), n_nights), np.nan)
+        for i, df in enumerate(frames.values()):
+            tst[i, : len(df)] = df["tst"].to_numpy(dtype=float, na_value=np.nan)
+            se[i, : len(df)] = df["se"].to_numpy(dtype=float, na_value=np.nan)
+        return Cohort(list(frames), tst, se, lengths)
+
+    @staticmethod
+    def from_csv(paths: list) -> "Cohort":
+        return Cohort.from_frames({path: read_log_csv(path) for path in paths})
+
+    @staticmethod
+    def from_sqlite(path: str) -> "Cohort":
+        """Load every chat's history from a SQLite store in a single query."""
+        with sqlite3.connect(path) as conn:
+            df = pd.read_sql_query(
+                "SELECT chat_id, tst, se FROM log ORDER BY chat_id, date, rowid", conn
+            )
+        user_ids, starts, lengths = np.unique(
+            df["chat_id"].to_numpy(), return_index=True, return_counts=True
+        )
+        n_nights = int(lengths.max()) if len(lengths) else 0
+        rows = np.repeat(np.arange(len(user_ids)), lengths)
+        nights = np.arange(len(df)) - np.repeat(starts, lengths)
+
+        tst = np.full((len(user_ids), n_nights), np.nan)
+        se = np.full((len(user_ids), n_nights), np.nan)
+        tst[rows, nights] = df["tst"].to_numpy(dtype=float, na_value=np.nan)
+        se[rows, nights] = df["se"].to_numpy(dtype=float, na_value=np.nan)
+        return Cohort(user_ids.tolist(), tst, se, lengths)
+
+
+@dataclass
+class SimulationResult:
+    """
+    Plans issued at each update step and how the nights under them went, all
+    shaped (users, steps). Step 0 is the first plan after INIT_WINDOW nights,
+    each later step comes UPDATE_WINDOW nights after the previous one.
+    NaN marks steps a user's history doesn't reach.
+    """
+
+    params: dict
+    algorithm: str
+    tib: np.ndarray
+    # Mean logged SE over the nights the plan was in force
+    observed_se: np.ndarray
+    # SE had the user spent exactly the prescribed TIB in bed: min(TST, TIB) / TIB
+    projected_se: np.ndarray
+
+    def summary(self) -> dict:
+        with _quiet_nanmean():
+            final_tib = _last_valid(self.tib)
+            changes = np.abs(np.diff(self.tib, axis=1))
+            return {
+                "params": self.params,
+                "algorithm": self.algorithm,
+                "users": int(self.tib.shape[0]),
+                "steps": int(self.tib.shape[1]),
+                "mean_tib_by_step": _rounded(np.nanmean(self.tib, axis=0)),
+                "mean_observed_se_by_step": _rounded(
+                    np.nanmean(self.observed_se, axis=0)
+                ),
+                "mean_projected_se_by_step": _rounded(
+                    np.nanmean(self.projected_se, axis=0)
+                ),
+                "final_tib_mean": _rounded(np.nanmean(final_tib)),
+                "final_tib_median": _rounded(np.nanmedian(final_tib)),
+                "mean_abs_tib_change": _rounded(np.nanmean(changes)),
+                "projected_se_mean": _rounded(np.nanmean(self.projected_se)),
+                "share_projected_se_at_least_85": _rounded(
+                    np.mean(self.projected_se[np.isfinite(self.projected_se)] >= 85)
+                ),
+            }
+
+
+@contextmanager
+def _quiet_nanmean():
+    """Silence 'mean of empty slice' warnings for users with short histories."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        yield
+
+
+def _last_valid(values: np.ndarray) -> np.ndarray:
+    """Last non-NaN value of each row (NaN for empty rows)."""
+    valid = np.isfinite(values)
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    last = values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    out = values[np.arange(values.shape[0]), last]
+    out[~valid.any(axis=1)] = np.nan
+    return out
+
+
+def _rounded(values):
+    if np.ndim(values) == 0:
+        return None if not np.isfinite(values) else round(float(values), 3)
+    return [_rounded(v) for v in values]
+
+
+def _n_steps(n_nights: int) -> int:
+    if n_nights < INIT_WINDOW:
+        return 0
+    return (n_nights - INIT_WINDOW) // UPDATE_WINDOW + 1
+
+
+def simulate(
+    cohort: Cohort, params: Optional[dict] = None, algorithm: str = "clipped"
+) -> SimulationResult:
+    """
+    Replay a cohort's logs through one plan algorithm, night by night.
+    Each step is vectorized across users; only the update steps are looped.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {algorithm!r}")
+    params = {**default_params(), **(params or {})}
+    if algorithm == "clipped":
+        adjust = adjust_sleep_plans_se_tst_clipped
+        min_tib = params["MIN_TIB"]
+    else:
+        adjust = adjust_sleep_plans_se_tst_conservative
+        min_tib = params["MIN_TIB_CONSERVATIVE"]
+
+    n_users, n_nights = cohort.tst.shape
+    n_steps = _n_steps(n_nights)
+    tib = np.full((n_users, n_steps), np.nan)
+    observed_se = np.full((n_users, n_steps), np.nan)
+    projected_se = np.full((n_users, n_steps), np.nan)
+    # Anchors only shift bedtime/wake time, they never change TIB
+    anchor = np.zeros(n_users, dtype=int)
+
+    with _quiet_nanmean():
+        for step in range(n_steps):
+            hi = INIT_WINDOW + step * UPDATE_WINDOW
+            lo = hi - (INIT_WINDOW if step == 0 else UPDATE_WINDOW)
+            tst_w = cohort.tst[:, lo:hi]
+            se_w = cohort.se[:, lo:hi]
+            users = np.flatnonzero(
+                (cohort.lengths >= hi)
+                & np.isfinite(tst_w).any(axis=1)
+                & np.isfinite(se_w).any(axis=1)
+            )
+            if step == 0:
+                batch = initialize_sleep_plans(tst_w[users], anchor[users])
+            else:
+                prev = tib[users, step - 1]
+                # Users whose previous step was skipped carry no plan to adjust
+                users = users[np.isfinite(prev)]
+                prev = prev[np.isfinite(prev)]
+                batch = adjust(
+                    se_w[users],
+                    tst_w[users],
+                    prev,
+                    anchor[users],
+                    delta_up=params["DELTA_UP"],
+                    delta_down=params["DELTA_DOWN"],
+                    buffer=params["BUFFER"],
+                    min_tib=min_tib,
+                )
+
+                # This window is what happened under the previous step's plan
+                observed_se[users, step - 1] = np.nanmean(se_w[users], axis=1)
+                projected_se[users, step - 1] = np.nanmean(
+                    np.minimum(tst_w[users], prev[:, np.newaxis])
+                    / prev[:, np.newaxis]
+                    * 100,
+                    axis=1,
+                )
+            tib[users, step] = batch.tib
+
+    return SimulationResult(params, algorithm, tib, observed_se, projected_se)
+
+
+def param_grid(grid: dict) -> list:
+    """Expand {"DELTA_UP": [5, 15], ...} into every parameter combination."""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+_worker_cohort = None
+
+
+def _init_worker(cohort: Cohort):
+    # The cohort is shipped once per worker instead of once per configuration
+    global _worker_cohort
+    _worker_cohort = cohort
+
+
+def _run_config(args: tuple) -> dict:
+    params, algorithm, keep_trajectories = args
+    result = simulate(_worker_cohort, params, algorithm)
+    out = result.summary()
+    if keep_trajectories:
+        out["tib"] = _rounded(result.tib)
+        out["projected_se"] = _rounded(result.projected_se)
+    return out
+
+
+def sweep(
+    cohort: Cohort,
+    grid: dict,
+    algorithm: str = "clipped",
+    workers: Optional[int] = None,
+    keep_trajectories: bool = False,
+) -> list:
+    """Simulate every combination in grid across a process pool, one summary each."""
+    tasks = [(params, algorithm, keep_trajectories) for params in param_grid(grid)]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(cohort,)
+    ) as pool:
+        return list(pool.map(_run_config, tasks, chunksize=max(1, len(tasks) // 64)))
+
+
+def _parse_grid(specs: list) -> dict:
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in default_params():
+            raise SystemExit(
+                f"Unknown parameter {name!r}, expected one of {list(default_params())}"
+            )
+        grid[name] = [int(v) for v in values.split(",")]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay sleep logs through the plan algorithms and sweep parameters."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="SQLite store with every chat's log")
+    source.add_argument("--log", nargs="+", help="one or more log CSV files")
+    parser.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        metavar="NAME=V1,V2,...",
+        help="parameter values to sweep, e.g. DELTA_UP=5,10,15 (repeatable)",
+    )
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="clipped")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--trajectories", action="store_true", help="include per-user arrays"
+    )
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    cohort = Cohort.from_sqlite(args.db) if args.db else Cohort.from_csv(args.log)
+    grid = {name: [value] for name, value in default_params().items()}
+    grid.update(_parse_grid(args.grid))
+    results = sweep(cohort, grid, args.algorithm, args.workers, args.trajectories)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env bash
 # run_bot.sh
-# Usage: ./src/scripts/run_bot.sh
+# Usage: ./src/scripts/run_bot.sh [--one-shot] [--webhook URL]
 # Make executable: chmod +x ./src/scripts/run_bot.sh
 
-python -m src.messaging.bot
\ No newline at end of file
+python -m src.messaging.bot "$@"
\ No newline at end of file
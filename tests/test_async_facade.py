@@ -0,0 +1,24 @@
+import asyncio
+import os
+
+import pytest
+
+from src.common.exceptions import PlanUpdateError
+from src.messaging import async_facade
+
+
+@pytest.fixture
+def compute_process(monkeypatch):
+    monkeypatch.setattr(async_facade, "COMPUTE_PROCESSES", 1)
+    yield
+    async_facade.shutdown()
+
+
+def test_dead_compute_worker_is_replaced(compute_process):
+    async def plans():
+        # The worker exits mid-call, as if killed for running out of memory
+        with pytest.raises(PlanUpdateError):
+            await async_facade.run_compute(os._exit, 1)
+        return await async_facade.run_compute(abs, -3)
+
+    assert asyncio.run(plans()) == 3
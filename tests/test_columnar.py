@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from src.data_manager import columnar
+from src.data_manager.log_utils import cols, parse_log_csv
+
+
+ROWS = [
+    "2024-03-01,23:00,07:00,10,20,480,450,93",
+    "2024-03-02,00:40,07:10,25,5,390,360,92",
+    "2024-03-03,,06:30,x,,,,",
+    "1969-12-31,23:59,00:00,0,0,1,1,100",
+]
+
+
+def _convert(tmp_path, rows: list[str]):
+    csv_path, out_dir = tmp_path / "log.csv", tmp_path / "log.cols"
+    csv_path.write_text("\n".join(rows))
+    columnar.csv_to_columnar(str(csv_path), str(out_dir))
+    return csv_path, out_dir
+
+
+def test_csv_round_trip(tmp_path, monkeypatch):
+    # Small chunks, so that the rows span several of them
+    monkeypatch.setattr(columnar, "CSV_CHUNK_ROWS", 3)
+    csv_path, out_dir = _convert(tmp_path, ROWS)
+    back = tmp_path / "back.csv"
+    columnar.columnar_to_csv(str(out_dir), str(back))
+    # Unparsable values come back empty
+    assert back.read_text().split("\n") == ROWS[:2] + [
+        "2024-03-03,,06:30,,,,,",
+        ROWS[3],
+    ]
+    with open(csv_path, "rb") as f:
+        expected = parse_log_csv(f)
+    pd.testing.assert_frame_equal(
+        columnar.read_log_columnar(str(out_dir)), expected, check_dtype=False
+    )
+
+
+def test_empty_log(tmp_path):
+    _, out_dir = _convert(tmp_path, [])
+    assert len(columnar.read_log_columnar(str(out_dir))) == 0
+
+
+def test_values_out_of_range_are_missing(tmp_path):
+    # awake=40000 gives tst=-39535; both would wrap around in int16
+    _, out_dir = _convert(tmp_path, ["2024-03-01,23:00,07:00,15,40000,480,-39535,0"])
+    columns = columnar.load_log_columns(str(out_dir))
+    assert columns["awake"][0] == columnar.MISSING["awake"]
+    assert columns["tst"][0] == columnar.MISSING["tst"]
+    assert columns["onset"][0] == 15
+    frame = columnar.read_log_columnar(str(out_dir))
+    assert frame["awake"].isna().all() and frame["tst"].isna().all()
+
+
+def test_limits_of_the_type():
+    info = np.iinfo(np.int16)
+    chunk = pd.DataFrame(
+        {c: ["2024-03-01", "2024-03-01", "2024-03-01"] for c in cols}
+    ).assign(
+        bedtime="23:00",
+        wakeup="07:00",
+        onset=[str(info.max), str(info.max + 1), str(info.min)],
+    )
+    onset = columnar._encode_chunk(chunk)["onset"]
+    missing = columnar.MISSING["onset"]
+    assert onset.tolist() == [info.max, missing, missing]
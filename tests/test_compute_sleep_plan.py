@@ -0,0 +1,261 @@
+import math
+from datetime import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.common.config import (
+    BUFFER,
+    DELTA_DOWN,
+    DELTA_UP,
+    MIN_TIB,
+    MIN_TIB_CONSERVATIVE,
+)
+from src.common.exceptions import PlanUpdateError
+from src.common.models import LogWindow, SleepPlan
+from src.processing.compute_sleep_plan import (
+    adjust_sleep_plan_se_tst_clipped,
+    adjust_sleep_plan_se_tst_conservative,
+    adjust_sleep_plans_se_tst_clipped,
+    adjust_sleep_plans_se_tst_conservative,
+    initialize_sleep_plan,
+    initialize_sleep_plans,
+)
+
+
+# The batch functions compute many users' plans with np.select; the
+# single-user functions the bot calls go through them with one row. Every
+# case below is run both ways, with all cases in one batch, and checked
+# against the original per-user if/elif rules.
+
+NAN = math.nan
+
+# (name, SE per night, TST per night, current plan)
+CASES = [
+    (
+        "se-below-70",
+        [60, 62, 58, 61, 59],
+        [300, 310, 290, 305, 295],
+        (420, "23:00", "06:00"),
+    ),
+    (
+        "se-exactly-70",
+        [70, 70, 70, 70, 70],
+        [300, 300, 300, 300, 300],
+        (420, "23:00", "06:00"),
+    ),
+    (
+        "se-between-70-85",
+        [80, 78, 82, 76, 84],
+        [390, 400, 380, 395, 405],
+        (450, "22:30", "06:00"),
+    ),
+    (
+        "se-exactly-85",
+        [85, 85, 85, 85, 85],
+        [380, 380, 380, 380, 380],
+        (450, "22:30", "06:00"),
+    ),
+    (
+        "se-exactly-90",
+        [90, 90, 90, 90, 90],
+        [400, 400, 400, 400, 400],
+        (450, "22:30", "06:00"),
+    ),
+    (
+        "se-above-90",
+        [91, 90, 91, 90, 91],
+        [430, 420, 425, 430, 428],
+        (450, "22:30", "06:00"),
+    ),
+    (
+        "tst-above-tib",
+        [80, 80, 80, 80, 80],
+        [500, 520, 510, 505, 515],
+        (420, "23:00", "06:00"),
+    ),
+    (
+        "tst-clipped-low",
+        [50, 55, 52, 54, 51],
+        [100, 120, 90, 110, 105],
+        (480, "22:00", "06:00"),
+    ),
+    (
+        "nan-nights",
+        [NAN, 88, 86, NAN, 90],
+        [NAN, 400, 390, NAN, 410],
+        (450, "22:30", "06:00"),
+    ),
+    (
+        "nan-one-column",
+        [72, NAN, 74, 73, 75],
+        [360, 365, NAN, 370, 355],
+        (420, "23:00", "06:00"),
+    ),
+    (
+        "bedtime-after-midnight",
+        [92, 95, 93, 94, 96],
+        [350, 360, 355, 365, 358],
+        (380, "00:40", "07:00"),
+    ),
+    (
+        "bedtime-crossing-midnight",
+        [65, 60, 68, 66, 64],
+        [330, 320, 340, 335, 325],
+        (400, "23:50", "06:30"),
+    ),
+    (
+        "wake-crossing-midnight",
+        [92, 94, 91, 93, 95],
+        [420, 430, 425, 435, 428],
+        (450, "17:00", "00:30"),
+    ),
+]
+
+
+def _plan(tib: int, bedtime: str, wake_time: str) -> SleepPlan:
+    return SleepPlan(
+        tib=tib,
+        bedtime=time.fromisoformat(bedtime),
+        wake_time=time.fromisoformat(wake_time),
+    )
+
+
+def _log(se: list, tst: list) -> pd.DataFrame:
+    return pd.DataFrame({"se": se, "tst": tst}, dtype="Float64")
+
+
+def _clip_avg(tst: list, tib: int) -> float:
+    return np.nanmean(np.clip(tst, 0.7 * tib, 1.2 * tib))
+
+
+def _reference_clipped(se: list, tst: list, plan: SleepPlan) -> SleepPlan:
+    avg_se, tib = np.nanmean(se), plan.tib
+    avg_tst = _clip_avg(tst, tib)
+    if avg_se > 90:
+        tib = max(tib + DELTA_UP, avg_tst)
+    elif 85 <= avg_se <= 90:
+        tib = max(tib, avg_tst)
+    elif 70 <= avg_se < 85:
+        if avg_tst > tib:
+            tib -= DELTA_DOWN
+        else:
+            tib = min(tib - DELTA_DOWN, avg_tst + BUFFER)
+    else:
+        tib = max(avg_tst + BUFFER, MIN_TIB)
+    new_plan = SleepPlan(tib=int(tib), wake_time=plan.wake_time)
+    new_plan.update_bedtime
+    return new_plan
+
+
+def _reference_conservative(se: list, tst: list, plan: SleepPlan) -> SleepPlan:
+    avg_se, tib = np.nanmean(se), plan.tib
+    avg_tst = _clip_avg(tst, tib)
+    if avg_se > 90:
+        tib = max(tib + DELTA_UP, avg_tst)
+    elif 85 <= avg_se <= 90:
+        tib = max(tib, avg_tst)
+    elif 70 <= avg_se < 85:
+        tib = max(tib - DELTA_DOWN, MIN_TIB_CONSERVATIVE)
+    else:
+        tib = max(avg_tst + BUFFER, MIN_TIB_CONSERVATIVE)
+    new_plan = SleepPlan(tib=int(tib), bedtime=plan.bedtime)
+    new_plan.update_wake_time
+    return new_plan
+
+
+def _reference_initialize(tst: list, plan: SleepPlan) -> SleepPlan:
+    new_plan = SleepPlan(
+        tib=int(max(np.nanmean(tst) + 30, 330)), wake_time=plan.wake_time
+    )
+    new_plan.update_bedtime
+    return new_plan
+
+
+def _batch_inputs():
+    se = np.array([c[1] for c in CASES], dtype=float)
+    tst = np.array([c[2] for c in CASES], dtype=float)
+    plans = [_plan(*c[3]) for c in CASES]
+    return se, tst, plans
+
+
+IDS = [c[0] for c in CASES]
+
+
+@pytest.fixture(scope="module")
+def clipped_batch():
+    se, tst, plans = _batch_inputs()
+    return adjust_sleep_plans_se_tst_clipped(
+        se,
+        tst,
+        np.array([p.tib for p in plans]),
+        np.array([p.wake_time_min for p in plans]),
+    )
+
+
+@pytest.fixture(scope="module")
+def conservative_batch():
+    se, tst, plans = _batch_inputs()
+    return adjust_sleep_plans_se_tst_conservative(
+        se,
+        tst,
+        np.array([p.tib for p in plans]),
+        np.array([p.bedtime_min for p in plans]),
+    )
+
+
+@pytest.fixture(scope="module")
+def initial_batch():
+    _, tst, plans = _batch_inputs()
+    return initialize_sleep_plans(tst, np.array([p.wake_time_min for p in plans]))
+
+
+@pytest.mark.parametrize("i", range(len(CASES)), ids=IDS)
+def test_clipped_matches_batch(i, clipped_batch):
+    _, se, tst, plan = CASES[i]
+    single, avg_se, avg_tst = adjust_sleep_plan_se_tst_clipped(
+        _log(se, tst), _plan(*plan), save=False
+    )
+    assert single == clipped_batch.plan(i)
+    assert single == _reference_clipped(se, tst, _plan(*plan))
+    assert avg_se == pytest.approx(clipped_batch.avg_se[i])
+    assert avg_tst == pytest.approx(clipped_batch.avg_tst[i])
+
+
+@pytest.mark.parametrize("i", range(len(CASES)), ids=IDS)
+def test_conservative_matches_batch(i, conservative_batch):
+    _, se, tst, plan = CASES[i]
+    single, avg_se, avg_tst = adjust_sleep_plan_se_tst_conservative(
+        _log(se, tst), _plan(*plan), save=False
+    )
+    assert single == conservative_batch.plan(i)
+    assert single == _reference_conservative(se, tst, _plan(*plan))
+    assert avg_se == pytest.approx(conservative_batch.avg_se[i])
+    assert avg_tst == pytest.approx(conservative_batch.avg_tst[i])
+
+
+@pytest.mark.parametrize("i", range(len(CASES)), ids=IDS)
+def test_initialize_matches_batch(i, initial_batch):
+    _, se, tst, plan = CASES[i]
+    single = initialize_sleep_plan(_log(se, tst), _plan(*plan), save=False)
+    assert single == initial_batch.plan(i)
+    assert single == _reference_initialize(tst, _plan(*plan))
+
+
+@pytest.mark.parametrize("i", range(len(CASES)), ids=IDS)
+def test_log_window_matches_dataframe(i):
+    _, se, tst, plan = CASES[i]
+    window = LogWindow()
+    for t, s in zip(tst, se):
+        window.push(None if math.isnan(t) else t, None if math.isnan(s) else s)
+    assert adjust_sleep_plan_se_tst_clipped(
+        window, _plan(*plan), save=False
+    ) == adjust_sleep_plan_se_tst_clipped(_log(se, tst), _plan(*plan), save=False)
+
+
+@pytest.mark.filterwarnings("ignore:Mean of empty slice")
+def test_all_nights_missing_raises():
+    log = _log([NAN] * 5, [NAN] * 5)
+    with pytest.raises(PlanUpdateError):
+        adjust_sleep_plan_se_tst_clipped(log, _plan(420, "23:00", "06:00"), save=False)
@@ -0,0 +1,116 @@
+import os
+from datetime import date, time
+
+import pandas as pd
+import pytest
+
+from src.common.models import LogEntry
+from src.data_manager import segments, storage
+from src.data_manager.importer import import_csv, prepare, resolve_columns
+
+
+# Imported nights must carry the same metrics as nights logged through the
+# bot, which computes them one entry at a time in LogEntry.compute_metrics.
+
+
+@pytest.mark.parametrize(
+    "bedtime, wakeup, onset, awake",
+    [
+        ("18:20", "06:00", 200, 94),  # tst 406 of tib 700: SE 57, not 58
+        ("23:00", "00:40", 40, 31),  # tst 29 of tib 100: SE 28, not 29
+        ("22:45", "06:15", 15, 20),
+        ("01:10", "07:00", 0, 0),
+    ],
+)
+def test_metrics_match_log_entry(bedtime, wakeup, onset, awake):
+    chunk = pd.DataFrame(
+        {
+            "date": ["2024-03-01"],
+            "bedtime": [bedtime],
+            "wakeup": [wakeup],
+            "onset": [str(onset)],
+            "awake": [str(awake)],
+        }
+    )
+    rows, reasons = prepare(chunk, resolve_columns(list(chunk.columns)), chat_id=1)
+    assert reasons[0] is None
+
+    entry = LogEntry(
+        date(2024, 3, 1),
+        time.fromisoformat(bedtime),
+        time.fromisoformat(wakeup),
+        onset,
+        awake,
+    )
+    entry.compute_metrics
+    row = rows.iloc[0]
+    assert (row["tib"], row["tst"], row["se"]) == (entry.tib, entry.tst, entry.se)
+
+
+def test_sqlite_import_without_chat_is_an_error(tmp_path, monkeypatch):
+    monkeypatch.delenv("TELEGRAM_CHAT_ID", raising=False)
+    path = tmp_path / "nights.csv"
+    path.write_text("date,bedtime,wakeup\n2024-03-01,23:00,07:00\n")
+    store = storage.SqliteStore(str(tmp_path / "shuteye.db"))
+    with pytest.raises(ValueError, match="--chat-id"):
+        import_csv(str(path), store)
+
+
+def _nights(first: str, last: str) -> list[str]:
+    return [str(d.date()) for d in pd.date_range(first, last)]
+
+
+def _write_nights(path, days: list[str]):
+    path.write_text(
+        "date,bedtime,wakeup,onset,awake\n"
+        + "".join(f"{day},23:00,07:00,10,20\n" for day in days)
+    )
+
+
+def _csv_store(tmp_path, policy: str, max_bytes: int = 1000) -> storage.CsvStore:
+    store = storage.CsvStore(str(tmp_path / "log.csv"), str(tmp_path / "plan.json"))
+    store.segments = segments.SegmentedLog(store.log_path, policy, max_bytes)
+    return store
+
+
+@pytest.mark.parametrize("policy", ["monthly", "size", "off"])
+def test_back_dated_import_keeps_the_log_in_date_order(tmp_path, policy):
+    store = _csv_store(tmp_path, policy)
+    later, earlier = _nights("2024-03-01", "2024-05-31"), _nights(
+        "2024-01-01", "2024-02-09"
+    )
+    _write_nights(tmp_path / "later.csv", later)
+    _write_nights(tmp_path / "earlier.csv", earlier)
+    import_csv(str(tmp_path / "later.csv"), store)
+    # Small chunks, so that the rows also arrive in runs
+    import_csv(str(tmp_path / "earlier.csv"), store, chunk_rows=15)
+
+    days = sorted(earlier + later)
+    assert [str(d) for d in store.read_log(0)["date"]] == days
+    assert [str(d) for d in store.read_log(0, 40)["date"]] == days[-40:]
+    sealed = store.segments.segments()
+    assert [s.first_date for s in sealed] == sorted(s.first_date for s in sealed)
+    assert all(a.last_date < b.first_date for a, b in zip(sealed, sealed[1:]))
+    assert store.log_meta(0).n_entries == len(days)
+    assert str(store.log_meta(0).last_date) == "2024-05-31"
+    if policy == "off":
+        assert not sealed
+    else:
+        # The segments merged into new ones are gone
+        assert sorted(os.listdir(store.segments.dir)) == sorted(
+            [s.file for s in sealed] + [segments.MANIFEST]
+        )
+
+
+def test_import_in_order_leaves_sealed_segments_alone(tmp_path):
+    store = _csv_store(tmp_path, "monthly")
+    _write_nights(tmp_path / "first.csv", _nights("2024-01-01", "2024-02-10"))
+    _write_nights(tmp_path / "next.csv", _nights("2024-02-11", "2024-03-05"))
+    import_csv(str(tmp_path / "first.csv"), store)
+    [january] = store.segments.segments()
+    import_csv(str(tmp_path / "next.csv"), store)
+    assert store.segments.segments()[0] == january
+    assert [s.last_date for s in store.segments.segments()] == [
+        date(2024, 1, 31),
+        date(2024, 2, 29),
+    ]
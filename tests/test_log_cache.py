@@ -0,0 +1,106 @@
+import os
+
+import pandas as pd
+
+from src.data_manager.log_utils import LogCache, parse_log_csv
+
+
+ROWS = [
+    "2024-03-01,23:00,07:00,10,20,480,450,93",
+    "2024-03-02,23:10,07:00,15,20,470,435,92",
+    "2024-03-03,23:00,06:30,20,25,450,405,90",
+]
+LATER = "2024-03-04,22:50,06:30,10,10,460,440,95"
+
+
+def _write(path, rows: list[str]) -> str:
+    path.write_text("\n".join(rows))
+    return str(path)
+
+
+def _assert_parsed(frame: pd.DataFrame, path: str):
+    pd.testing.assert_frame_equal(frame, parse_log_csv(path))
+
+
+def _touch(path: str, stat: os.stat_result, ns: int):
+    """Set path's mtime to ns after stat's."""
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + ns))
+
+
+def test_append_extends_the_cached_frame(tmp_path):
+    cache = LogCache(max_rows=100)
+    path = _write(tmp_path / "log.csv", ROWS)
+    cache.read(path)
+    with open(path, "a") as f:
+        f.write("\n" + LATER)
+    _assert_parsed(cache.read(path), path)
+    assert cache.counts == {"miss": 1, "extend": 1}
+    assert cache.rows == 4
+    # And unchanged since
+    _assert_parsed(cache.read(path), path)
+    assert cache.counts["hit"] == 1
+
+
+def test_changed_bytes_before_an_append_are_parsed_again(tmp_path):
+    cache = LogCache(max_rows=100)
+    path = _write(tmp_path / "log.csv", ROWS)
+    cache.read(path)
+    # The last row edited (in the 64 bytes kept), then a row appended
+    _write(tmp_path / "log.csv", ROWS[:2] + [ROWS[2].replace(",90", ",91"), LATER])
+    _assert_parsed(cache.read(path), path)
+    assert cache.counts == {"miss": 2}
+
+
+def test_same_size_rewrite_in_place_is_parsed_again(tmp_path):
+    cache = LogCache(max_rows=100)
+    path = _write(tmp_path / "log.csv", ROWS)
+    cache.read(path)
+    before = os.stat(path)
+    with open(path, "r+b") as f:
+        f.seek(len(ROWS[0]) - 2)
+        f.write(b"94")
+    _touch(path, before, 1_000_000)
+    assert os.stat(path).st_size == before.st_size
+    frame = cache.read(path)
+    assert frame["se"].tolist() == [94, 92, 90]
+    assert cache.counts == {"miss": 2}
+
+
+def test_replaced_file_with_same_size_and_mtime_is_parsed_again(tmp_path):
+    cache = LogCache(max_rows=100)
+    path = _write(tmp_path / "log.csv", ROWS)
+    cache.read(path)
+    before = os.stat(path)
+    # A new file renamed over the log: only the inode tells them apart
+    _write(tmp_path / "new.csv", [ROWS[0][:-2] + "94"] + ROWS[1:])
+    os.replace(tmp_path / "new.csv", path)
+    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+    assert os.stat(path).st_ino != before.st_ino
+    assert cache.read(path)["se"].tolist() == [94, 92, 90]
+    assert cache.counts == {"miss": 2}
+
+
+def test_least_recently_read_logs_are_evicted_by_rows(tmp_path):
+    cache = LogCache(max_rows=5)
+    a = _write(tmp_path / "a.csv", ROWS)
+    b = _write(tmp_path / "b.csv", ROWS[:2])
+    c = _write(tmp_path / "c.csv", ROWS[1:])
+    cache.read(a)
+    cache.read(b)
+    assert cache.rows == 5
+    cache.read(a)  # a is now the most recently read
+    cache.read(c)  # 7 rows: b goes
+    assert cache.rows == 5
+    assert cache.counts == {"miss": 3, "hit": 1}
+    cache.read(a)
+    cache.read(c)
+    assert cache.counts["hit"] == 3
+    cache.read(b)
+    assert cache.counts["miss"] == 4
+
+    # A log larger than the budget is never kept
+    big = _write(tmp_path / "big.csv", ROWS * 2)
+    cache.read(big)
+    cache.read(big)
+    assert cache.counts["miss"] == 6
+    assert cache.rows <= 5
@@ -0,0 +1,81 @@
+import asyncio
+
+from src.messaging.persistence import _DROP_VALUE, _SET_VALUE, SqlitePersistence
+
+
+def _reload(path: str) -> tuple[dict, dict]:
+    """Conversation states and user_data as a restarted bot reads them."""
+
+    async def read():
+        saved = SqlitePersistence(path)
+        data = await saved.get_conversations("log"), await saved.get_user_data()
+        await saved.flush()
+        return data
+
+    return asyncio.run(read())
+
+
+def _recorded(saved: SqlitePersistence, monkeypatch) -> list:
+    """(statement, user id and key) of every user_data write saved makes."""
+    written = []
+    write = saved._write
+
+    async def record(ops):
+        written.extend(
+            (sql, params[:2]) for sql, params in ops if sql in (_SET_VALUE, _DROP_VALUE)
+        )
+        await write(ops)
+
+    monkeypatch.setattr(saved, "_write", record)
+    return written
+
+
+def test_states_and_answers_survive_a_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / "conversations.db")
+
+    async def session():
+        saved = SqlitePersistence(path)
+        await saved.get_user_data()
+        await saved.update_conversation("log", (1, 1), 2)
+        await saved.update_conversation("log", (2, 2), 0)
+        await saved.update_user_data(1, {"bedtime": "23:00", "wakeup": "07:00"})
+        await saved.update_user_data(2, {"bedtime": "22:30"})
+
+        written = _recorded(saved, monkeypatch)
+        await saved.update_user_data(1, {"bedtime": "23:15"})
+        await saved.update_user_data(2, {"bedtime": "22:30"})
+        # Chat 2's conversation ends
+        await saved.update_conversation("log", (2, 2), None)
+        await saved.update_conversation("log", (1, 1), 3)
+        await saved.flush()
+        return written
+
+    # Only the changed answer is written and the removed one deleted
+    assert asyncio.run(session()) == [
+        (_DROP_VALUE, (1, "wakeup")),
+        (_SET_VALUE, (1, "bedtime")),
+    ]
+    assert _reload(path) == (
+        {(1, 1): 3},
+        {1: {"bedtime": "23:15"}, 2: {"bedtime": "22:30"}},
+    )
+
+    async def restarted():
+        saved = SqlitePersistence(path)
+        await saved.get_user_data()
+        written = _recorded(saved, monkeypatch)
+        await saved.update_user_data(1, {})
+        await saved.update_user_data(2, {"bedtime": "22:30", "onset": 15})
+        await saved.flush()
+        return written
+
+    # After a restart the bot still knows what is saved
+    assert asyncio.run(restarted()) == [
+        (_DROP_VALUE, (1, "bedtime")),
+        (_SET_VALUE, (2, "onset")),
+    ]
+    # Dropped answers stay dropped
+    assert _reload(path) == (
+        {(1, 1): 3},
+        {2: {"bedtime": "22:30", "onset": 15}},
+    )
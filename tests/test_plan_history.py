@@ -0,0 +1,115 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from src.common.models import SleepPlan
+from src.data_manager.plan_history import PlanHistory
+
+
+# (chat_id, effective date, tib, bedtime, wake_time) in save order
+ROWS = [
+    (7, "2024-03-10", 420, "23:00", "06:00"),
+    (3, "2024-03-01", 360, "00:00", "06:00"),
+    (7, "2024-03-20", 435, "22:45", "06:00"),
+    (3, "2024-03-15", 380, "23:40", "06:00"),
+    # Saved twice for the same date: the later one is in force
+    (7, "2024-03-20", 450, "22:30", "06:00"),
+    (9, "2023-12-31", 400, "23:20", "06:00"),
+]
+
+
+def _reference(rows: list, chat_id: int, day: date) -> SleepPlan:
+    """The plan in force, by scanning every row."""
+    best = None
+    for chat, effective, tib, bedtime, wake_time in rows:
+        effective = date.fromisoformat(effective)
+        if chat == chat_id and effective <= day:
+            if best is None or effective >= best[0]:
+                best = effective, SleepPlan.from_dict(
+                    {"tib": tib, "bedtime": bedtime, "wake_time": wake_time}
+                )
+    return None if best is None else best[1]
+
+
+def _lookup(history: PlanHistory, chat_ids, days) -> list:
+    return [None if i < 0 else history.plan(i) for i in history.lookup(chat_ids, days)]
+
+
+@pytest.mark.parametrize(
+    "day, expected",
+    [
+        ("2024-03-09", None),  # before the first plan
+        ("2024-03-10", 420),  # on the first plan's date
+        ("2024-03-15", 420),  # between changes
+        ("2024-03-19", 420),  # the night before a change
+        ("2024-03-20", 450),  # on a change saved twice
+        ("2024-04-30", 450),  # after the last change
+        ("2030-01-01", 450),  # far past the history's range
+        ("2000-01-01", None),  # far before it
+    ],
+)
+def test_as_of_one_chat(day, expected):
+    plan = PlanHistory.from_rows(ROWS).as_of(date.fromisoformat(day), chat_id=7)
+    assert (plan.tib if plan else None) == expected
+    assert plan == _reference(ROWS, 7, date.fromisoformat(day))
+
+
+def test_many_chats_in_one_call():
+    history = PlanHistory.from_rows(ROWS)
+    pairs = [
+        (3, "2024-02-29"),
+        (7, "2024-03-01"),
+        (3, "2024-03-01"),
+        (9, "2024-03-01"),
+        (3, "2024-03-16"),
+        (7, "2024-03-16"),
+        (5, "2024-03-16"),  # no plans at all
+        (7, "2024-03-21"),
+        (9, "2023-12-30"),
+    ]
+    days = [day for _, day in pairs]
+    assert _lookup(history, [chat for chat, _ in pairs], days) == [
+        _reference(ROWS, chat, date.fromisoformat(day)) for chat, day in pairs
+    ]
+    # One id for every night
+    assert _lookup(history, 3, days) == [
+        _reference(ROWS, 3, date.fromisoformat(day)) for day in days
+    ]
+    assert history.has([3, 5, 7, 9, 10]).tolist() == [
+        True,
+        False,
+        True,
+        True,
+        False,
+    ]
+
+
+def test_empty_history():
+    history = PlanHistory.from_rows([])
+    assert history.lookup([1, 2], ["2024-03-01", "2024-03-02"]).tolist() == [-1, -1]
+    assert history.as_of(date(2024, 3, 1), chat_id=1) is None
+
+
+def test_random_histories_match_a_loop():
+    rng = random.Random(7)
+    start = date(2024, 1, 1)
+    for _ in range(20):
+        rows = [
+            (
+                rng.randrange(5),
+                (start + timedelta(days=rng.randrange(60))).isoformat(),
+                rng.randrange(300, 500),
+                f"{rng.randrange(21, 24)}:{rng.randrange(60):02d}",
+                "06:00",
+            )
+            for _ in range(rng.randrange(1, 30))
+        ]
+        history = PlanHistory.from_rows(rows)
+        pairs = [
+            (rng.randrange(6), start + timedelta(days=rng.randrange(-5, 70)))
+            for _ in range(200)
+        ]
+        assert _lookup(
+            history, [chat for chat, _ in pairs], [day for _, day in pairs]
+        ) == [_reference(rows, chat, day) for chat, day in pairs]
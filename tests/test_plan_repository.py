@@ -0,0 +1,64 @@
+import threading
+
+from src.common.models import SleepPlan
+from src.data_manager.plan_repository import PlanRepository
+
+
+class BlockingStore:
+    """Plans in a dict; the first save waits until release is set."""
+
+    def __init__(self):
+        self.plans = {}
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def load_plan(self, key):
+        return self.plans.get(key)
+
+    def save_plan(self, key, plan):
+        if not self.saving.is_set():
+            self.saving.set()
+            self.release.wait(5)
+        self.plans[key] = plan.copy()
+
+    def append_plan_history(self, rows):
+        pass
+
+
+def _plan(tib: int) -> SleepPlan:
+    return SleepPlan.from_minutes(tib, 23 * 60, 6 * 60)
+
+
+def test_evicted_plan_is_not_overwritten_by_an_older_flush():
+    store = BlockingStore()
+    repo = PlanRepository(store, capacity=1, flush_interval=3600)
+    repo.put(1, _plan(400))
+
+    # The flush snapshots the plan of 400 and stalls writing it
+    flusher = threading.Thread(target=repo.flush)
+    flusher.start()
+    assert store.saving.wait(5)
+
+    # Meanwhile a newer plan is saved, then pushed out of the cache
+    repo.put(1, _plan(420))
+    repo.put(2, _plan(450))
+    assert repo.get(1) == _plan(420)
+
+    store.release.set()
+    flusher.join(5)
+    assert repo.get(1) == _plan(420)
+    repo.close()
+    assert store.plans == {1: _plan(420), 2: _plan(450)}
+
+
+def test_get_reads_evicted_plans_before_the_store():
+    store = BlockingStore()
+    store.saving.set()  # no stalling
+    store.plans[1] = _plan(400)
+    repo = PlanRepository(store, capacity=1, flush_interval=3600)
+    repo.put(1, _plan(420))
+    repo.put(2, _plan(450))
+    assert repo.get(1) == _plan(420)
+    repo.close()
+    assert store.plans[1] == _plan(420)
+    assert repo.get(1) == _plan(420)
@@ -0,0 +1,96 @@
+from datetime import date, time
+
+from src.common.models import LogEntry
+from src.data_manager.segments import SegmentedLog
+from src.data_manager.storage import CsvStore
+
+
+ROWS = [
+    "2024-03-30,23:00,07:00,10,20,480,450,93",
+    "2024-03-31,23:10,07:00,15,20,470,435,92",
+    "2024-04-01,23:00,06:30,20,25,450,405,90",
+]
+
+
+def test_tail_without_active_log(tmp_path):
+    log = SegmentedLog(str(tmp_path / "log.csv"), policy="monthly")
+    assert len(log.tail(5)) == 0
+
+
+def test_tail_after_seal_removed_active_log(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text("\n".join(ROWS))
+    log = SegmentedLog(str(path), policy="monthly")
+    log.seal()
+    path.unlink()
+    tail = log.tail(2)
+    assert [str(d) for d in tail["date"]] == ["2024-03-31", "2024-04-01"]
+
+
+def test_monthly_due_checks_every_night_of_the_batch():
+    log = SegmentedLog("unused.csv", policy="monthly")
+    march = date(2024, 3, 30)
+    assert not log.due(march, [date(2024, 3, 31)])
+    assert log.due(march, [date(2024, 3, 31), date(2024, 4, 1)])
+    assert not log.due(None, [date(2024, 4, 1)])
+
+
+def test_size_due_counts_the_batch(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(ROWS[0])
+    log = SegmentedLog(str(path), policy="size", max_bytes=100)
+    assert not log.due(None, [], 100 - len(ROWS[0]))
+    assert log.due(None, [], 101 - len(ROWS[0]))
+    # Nothing to seal in an empty log, however large the batch
+    assert not SegmentedLog(str(tmp_path / "new.csv"), policy="size").due(
+        None, [], 10**9
+    )
+
+
+def _entry(day: date) -> LogEntry:
+    entry = LogEntry(day, time(23, 0), time(7, 0), 10, 10)
+    entry.compute_metrics
+    return entry
+
+
+def test_batch_across_months_seals_the_earlier_month(tmp_path):
+    store = CsvStore(str(tmp_path / "log.csv"), str(tmp_path / "plan.json"))
+    store.segments = SegmentedLog(store.log_path, policy="monthly")
+    store.append_entries([(0, _entry(date(2024, 3, 30)))])
+    store.append_entries(
+        [(0, _entry(date(2024, 3, 31))), (0, _entry(date(2024, 4, 1)))]
+    )
+    [march] = store.segments.segments()
+    assert (march.first_date, march.last_date) == (date(2024, 3, 30), date(2024, 3, 31))
+    assert [str(d) for d in store.read_log(0)["date"]] == [
+        "2024-03-30",
+        "2024-03-31",
+        "2024-04-01",
+    ]
+    assert store.log_meta(0).n_entries == 3
+
+
+def test_reorder_interrupted_is_finished_on_the_next_read(tmp_path, monkeypatch):
+    path = tmp_path / "log.csv"
+    path.write_text("\n".join(ROWS[1:]))
+    log = SegmentedLog(str(path), policy="monthly")
+    log.seal(keep_last=True)
+    # March 30 imported after April 1
+    path.write_text(ROWS[2] + "\n" + ROWS[0])
+    monkeypatch.setattr(SegmentedLog, "_finish_reorder", lambda self, manifest: None)
+    log.reorder(date(2024, 3, 30), [len(ROWS[2])])
+    monkeypatch.undo()
+
+    # As after a crash once the new manifest was written
+    log = SegmentedLog(str(path), policy="monthly")
+    [march] = log.segments()
+    assert (march.first_date, march.last_date) == (date(2024, 3, 30), date(2024, 3, 31))
+    assert [str(d) for d in log.read()["date"]] == [
+        "2024-03-30",
+        "2024-03-31",
+        "2024-04-01",
+    ]
+    assert sorted(p.name for p in (tmp_path / "log.csv.segments").iterdir()) == [
+        march.file,
+        "manifest.json",
+    ]
@@ -0,0 +1,151 @@
+import asyncio
+import sqlite3
+from contextlib import closing
+from datetime import date, time, timedelta
+
+import pytest
+
+from src.common.models import LogEntry, SleepPlan
+from src.data_manager import storage
+from src.messaging import persistence
+from src.messaging.persistence import SqlitePersistence
+from src.messaging.sharding import HashRing, rebalance, shard_names, shard_path
+
+
+CHATS = list(range(1001, 1061))
+# Chats with a conversation in progress but nothing stored yet
+TALKING = list(range(2001, 2011))
+
+
+def _entry(chat_id: int, night: int) -> LogEntry:
+    entry = LogEntry(
+        date(2024, 3, 1) + timedelta(days=night),
+        time(23, chat_id % 60),
+        time(7, 0),
+        chat_id % 30,
+        night,
+    )
+    entry.compute_metrics
+    return entry
+
+
+def _seed(db_path: str, persistence_path: str):
+    store = storage.SqliteStore(db_path)
+    store.append_entries([(c, _entry(c, night)) for night in range(3) for c in CHATS])
+    for chat_id in CHATS[::2]:
+        plan = SleepPlan.from_minutes(400 + chat_id % 50, 23 * 60, 6 * 60)
+        store.save_plan(chat_id, plan)
+        store.append_plan_history([(chat_id, date(2024, 3, 3), plan)])
+    for chat_id in CHATS[::3]:
+        store.set_reminder(chat_id, "Europe/Berlin")
+
+    async def talk():
+        saved = SqlitePersistence(persistence_path)
+        for chat_id in CHATS[::4] + TALKING:
+            await saved.update_conversation("log", (chat_id, chat_id), chat_id % 5)
+            await saved.update_user_data(chat_id, {"bedtime": f"23:{chat_id % 60}"})
+        await saved.flush()
+
+    asyncio.run(talk())
+
+
+def _rows(path: str, chat_id: int) -> dict:
+    """Every row stored for a chat, by table."""
+    with closing(sqlite3.connect(path)) as conn:
+        return {
+            table: conn.execute(
+                f"SELECT * FROM {table} WHERE chat_id = ? ORDER BY rowid", (chat_id,)
+            ).fetchall()
+            for table in storage._CHAT_TABLES
+        }
+
+
+def _saved(path: str) -> tuple[dict, dict]:
+    """Conversation states and user_data in a persistence file."""
+
+    async def read():
+        saved = SqlitePersistence(path)
+        data = await saved.get_conversations("log"), await saved.get_user_data()
+        await saved.flush()
+        return data
+
+    return asyncio.run(read())
+
+
+def _placement(db_path: str, shards: list[str]) -> dict:
+    """chat → shards holding any of its rows."""
+    held = {}
+    for shard in shards:
+        for chat_id in storage.SqliteStore(shard_path(db_path, shard)).chat_ids():
+            held.setdefault(chat_id, []).append(shard)
+    return held
+
+
+@pytest.fixture
+def paths(tmp_path):
+    db_path, persistence_path = str(tmp_path / "shuteye.db"), str(
+        tmp_path / "conversations.db"
+    )
+    _seed(db_path, persistence_path)
+    return db_path, persistence_path
+
+
+def test_adding_a_shard_only_moves_chats_to_it():
+    ids = range(10_000)
+    for n in (1, 2, 3, 7):
+        before = HashRing(shard_names(n))
+        after = HashRing(shard_names(n + 1))
+        for chat_id in ids:
+            owner = after.shard_for(chat_id)
+            assert owner in (before.shard_for(chat_id), f"shard{n}")
+
+
+def test_rebalance_moves_every_chat_intact_to_its_shard(paths):
+    db_path, persistence_path = paths
+    rows = {chat_id: _rows(db_path, chat_id) for chat_id in CHATS}
+    conversations, user_data = _saved(persistence_path)
+
+    for n in (2, 3):
+        shards = shard_names(n)
+        ring = HashRing(shards)
+        owners = {chat_id: ring.shard_for(chat_id) for chat_id in CHATS + TALKING}
+        rebalance(shards, db_path, persistence_path)
+
+        assert storage.SqliteStore(db_path).chat_ids() == []
+        assert _placement(db_path, shards) == {c: [owners[c]] for c in CHATS}
+        for chat_id in CHATS:
+            assert _rows(shard_path(db_path, owners[chat_id]), chat_id) == rows[chat_id]
+
+        # Conversations and answers follow their chat, including chats with
+        # nothing stored
+        assert persistence.chat_ids(persistence_path) == []
+        for shard in shards:
+            states, answers = _saved(shard_path(persistence_path, shard))
+            assert states == {
+                key: state
+                for key, state in conversations.items()
+                if owners[key[0]] == shard
+            }
+            assert answers == {
+                user_id: data
+                for user_id, data in user_data.items()
+                if owners[user_id] == shard
+            }
+
+
+def test_adding_a_shard_moves_only_the_chats_it_takes(paths):
+    db_path, persistence_path = paths
+    rebalance(shard_names(2), db_path, persistence_path)
+    before = _placement(db_path, shard_names(2))
+
+    received = rebalance(shard_names(3), db_path, persistence_path)
+    after = _placement(db_path, shard_names(3))
+    ring = HashRing(shard_names(3))
+    moved = {c for c in CHATS if after[c] != before[c]}
+    assert moved == {c for c in CHATS if ring.shard_for(c) == "shard2"}
+    assert moved and all(after[c] == ["shard2"] for c in moved)
+    assert received == {"shard2": len(moved)}
+
+    # Rerunning with the same shards moves nothing
+    assert rebalance(shard_names(3), db_path, persistence_path) == {}
+    assert _placement(db_path, shard_names(3)) == after
@@ -0,0 +1,50 @@
+import asyncio
+import pstats
+from types import SimpleNamespace
+
+from src.common import tracing
+
+
+def _profiled_functions(trace: tracing.Trace) -> set:
+    stats = pstats.Stats(trace.profiles[0])
+    for profile in trace.profiles[1:]:
+        stats.add(profile)
+    return {func for _, _, func in stats.stats}
+
+
+def test_handler_profile_leaves_out_other_chats(monkeypatch):
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    monkeypatch.setattr(tracing, "TRACE_CHATS", {1})
+    monkeypatch.setattr(tracing, "_traces", {})
+
+    def other_chat_work():
+        return sum(range(1000))
+
+    @tracing.traced("compute")
+    def traced_compute():
+        return sum(range(1000))
+
+    @tracing.conversation_step({0: "BEDTIME"}, start=True)
+    async def handler(update, context):
+        # Other chats' handlers run on the loop while this one waits
+        await asyncio.sleep(0.01)
+        traced_compute()
+        return 0
+
+    async def other_chat():
+        for _ in range(5):
+            other_chat_work()
+            await asyncio.sleep(0.001)
+
+    async def chats():
+        update = SimpleNamespace(effective_chat=SimpleNamespace(id=1))
+        await asyncio.gather(handler(update, None), other_chat())
+
+    trace = tracing.Trace(1, profile=True)
+    monkeypatch.setattr(tracing, "Trace", lambda chat_id: trace)
+    asyncio.run(chats())
+
+    profiled = _profiled_functions(trace)
+    assert "traced_compute" in profiled
+    assert "other_chat_work" not in profiled
+    assert {e["name"] for e in trace.events} == {"handler", "traced_compute"}